@@ -1,18 +1,16 @@
-from lib2to3.pgen2.tokenize import Untokenizer
 import streamlit as st
 from multiapp import MultiApp
-from apps import home, extractchroms, statistics, untargeted, targeted, testing, viewchroms # import your app modules here
 
 app = MultiApp()
 st.set_page_config(layout="wide")
-# Add all your application here
-app.add_app("Home", home.app)
-app.add_app("Extract Chromatograms", extractchroms.app)
-app.add_app("View Chromatograms", viewchroms.app)
-app.add_app("Untargeted Metabolomics", untargeted.app)
-app.add_app("Targeted Metabolomics", targeted.app)
-app.add_app("Statistics", statistics.app)
-app.add_app("Testing", testing.app)
+# Add all your application here, page modules are imported when their page is selected
+app.add_app("Home", "apps.home:app")
+app.add_app("Extract Chromatograms", "apps.extractchroms:app")
+app.add_app("View Chromatograms", "apps.viewchroms:app")
+app.add_app("Untargeted Metabolomics", "apps.untargeted:app")
+app.add_app("Targeted Metabolomics", "apps.targeted:app")
+app.add_app("Statistics", "apps.statistics:app")
+app.add_app("Testing", "apps.testing:app")
 
 # The main app
 app.run()
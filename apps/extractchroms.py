@@ -1,14 +1,14 @@
 import streamlit as st
 import plotly.express as px
-from pyopenms import *
 import os
 import pandas as pd
-import numpy as np
-from pymetabo.helpers import Helper
-from pymetabo.plotting import Plot
-from pymetabo.gnps import *
-from pymetabo.dataframes import DataFrames
 from utils.filehandler import get_files, get_dir, get_file, save_file
+from utils.parallel import default_workers
+from utils.jobview import job_queue_settings, show_jobs, show_metrics, poll
+from utils.cache import ResultCache
+from utils.chromstore import ChromatogramStore
+from utils.auc import AUCSummary
+from utils.decimate import decimate, time_limits
 
 def app():
     results_dir = "results_extractchroms"
@@ -21,14 +21,19 @@ def app():
         st.session_state.viewing_extract = False
     if "mzML_files_extract" not in st.session_state:
         st.session_state.mzML_files_extract = set()
+    if "extract_peak_memory" not in st.session_state:
+        st.session_state.extract_peak_memory = None
+    if "extract_auc" not in st.session_state:
+        st.session_state.extract_auc = None
     if "masses_text_field" not in st.session_state:
         st.session_state.masses_text_field = "222.0972=GlcNAc\n294.1183=MurNAc"
     with st.sidebar:
         with st.expander("info", expanded=True):
             st.markdown("""
-Here you can get extracted ion chromatograms `EIC` from mzML files. A base peak chromatogram `BPC`
-will be automatically generated as well. Select the mass tolerance according to your data either as
-absolute values `Da` or relative to the metabolite mass in parts per million `ppm`.
+Here you can get extracted ion chromatograms `EIC` from mzML files. A base peak chromatogram `BPC` and a total ion
+chromatogram `TIC` will be automatically generated as well. Select the mass tolerance according to your data either as
+absolute values `Da` or relative to the metabolite mass in parts per million `ppm`. Chromatograms are built from the
+spectra of the selected MS level and polarity, e.g. only the MS1 spectra of the positive mode in polarity switching files.
 
 As input you can add `mzML` files and select which ones to use for the chromatogram extraction.
 Download the results of selected samples and chromatograms as `tsv` or `xlsx` files.
@@ -82,130 +87,94 @@ The results will be displayed as a summary with all samples and EICs AUC values
                             "text/txt",
                             key='download-txt',
                             help="Download mass list as a text file.")
+        workers = col3.number_input("parallel files", 1, default_workers(), default_workers(), help="Number of mzML files processed at the same time.")
+        ms_level = col3.number_input("MS level", 1, 10, 1, help="Only spectra of this MS level are used.")
+        polarity = col3.radio("polarity", ["any", "positive", "negative"], help="Only spectra of this polarity are used, e.g. for polarity switching files.")
+        low_memory = col3.checkbox("low memory mode", True, help="Stream the spectra from the mzML file one at a time instead of loading the whole file.")
+        use_cache = col3.checkbox("use cache", True, help="Re-use chromatograms that were extracted before from the same file with the same parameters.")
+        profile = col3.checkbox("profile", False, help="Record cProfile statistics of the extraction in the results folder.")
+        with col3:
+            queue = job_queue_settings("extract")
         run_button = col3.button("Extract Chromatograms!")
+        if col3.button("Clear cache", help="Delete all cached results."):
+            ResultCache().clear()
 
 
     if run_button:
-        Helper().reset_directory(results_dir)
-        masses = []
-        names = []
-        times = []
-        for line in [line for line in masses_input.split('\n') if line != '']:
-            if len(line.split("=")) == 3:
-                mass, name, time = line.split("=")
-            elif len(line.split("=")) == 2:
-                mass, name = line.split("=")
-                time = "all"
-            else:
-                mass = line
-                name = ''
-                time = "all"
-            masses.append(float(mass.strip()))
-            names.append(name.strip())
-            time_factor = 1.0
-            if time_unit == "minutes":
-                time_factor = 60.0
-            if "-" in time:
-                times.append([float(time.split("-")[0].strip())*time_factor, float(time.split("-")[1].strip())*time_factor])
-            else:
-                times.append([0,0])
-        for file in mzML_files:
-            with st.spinner("Extracting from: " + file):
-                exp = MSExperiment()
-                MzMLFile().load(file, exp)
-                df = pd.DataFrame()
-                # get BPC always
-                time = []
-                intensity = []
-                for spec in exp:
-                    _, intensities = spec.get_peaks()
-                    rt = spec.getRT()
-                    if time_unit == "minutes":
-                        rt = rt/60
-                    time.append(rt)
-                    i = int(max(intensities))
-                    intensity.append(i)
-                df["time"] = time
-                df["BPC"] = intensity
-                # get EICs
-                for mass, name, time in zip(masses, names, times):
-                    intensity = []
-                    for spec in exp:
-                        if (time == [0,0]) or (time[0] < spec.getRT() and time[1] > spec.getRT()):
-                            _, intensities = spec.get_peaks()
-                            if unit == "Da":
-                                index_highest_peak_within_window = spec.findHighestInWindow(mass, tolerance, tolerance)
-                            else:
-                                index_highest_peak_within_window = spec.findHighestInWindow(mass,float((tolerance/1000000)*mass),float((tolerance/1000000)*mass))
-                            if index_highest_peak_within_window > -1:
-                                intensity.append(int(spec[index_highest_peak_within_window].getIntensity()))
-                            else:
-                                intensity.append(0)
-                        else:
-                            intensity.append(0)
-                    df[str(mass)+"_"+name] = intensity
-            df.to_feather(os.path.join(results_dir, os.path.basename(file)[:-5]+".ftr"))
-        st.session_state.viewing_extract = True
-
-    files = [f for f in os.listdir(results_dir) if f.endswith(".ftr") and "AUC" not in f and "summary" not in f]
+        if queue.active("extract"):
+            st.warning("Chromatogram extraction is still running.")
+        else:
+            # runs in a background process, it keeps running if the page is reloaded
+            queue.submit("extract", "utils.extraction:extract_files", mzML_files=sorted(mzML_files), results_dir=results_dir,
+                         masses_input=masses_input, tolerance=tolerance, unit=unit, time_unit=time_unit, low_memory=low_memory,
+                         use_cache=use_cache, workers=workers, profile=profile, ms_level=ms_level, polarity=polarity)
+
+    job = show_jobs("extract")
+    if job is not None:
+        for file, error in job["result"]["errors"].items():
+            st.error("Extraction failed for " + file + ": " + error)
+        st.session_state.extract_peak_memory = job["result"]["peak_memory"]
+        with st.expander("stage timings"):
+            show_metrics(os.path.join(results_dir, "metrics.json"))
+    # results are shown once the last run finished, while a run is active its folder is being rewritten
+    st.session_state.viewing_extract = job is not None and not queue.active("extract")
+
+    store = ChromatogramStore(os.path.join(results_dir, "chromatograms"))
+    files = store.samples()
     if files:
-        chroms = pd.read_feather(os.path.join(results_dir, files[0])).drop(columns=["time"]).columns.tolist()
-        if "index" in chroms:
-            chroms.remove("index")
-        if "AUC baseline" in chroms:
-            chroms.remove("AUC baseline")
+        chroms = [c for c in store.columns(files[0]) if c != "time"]
     else:
         chroms = []
 
     if st.session_state.viewing_extract:
-        all_files = sorted(st.multiselect("samples", files, files, format_func=lambda x: os.path.basename(x)[:-4]), reverse=True)
+        all_files = sorted(st.multiselect("samples", files, files), reverse=True)
         all_chroms = st.multiselect("chromatograms", chroms, chroms) 
 
 
         col1, col2, col3, col4, col5 = st.columns(5)
         baseline = col1.number_input("AUC baseline", 0, 1000000, 5000, 1000)
         num_cols = col2.number_input("show columns", 1, 5, 1)
+        max_points = col3.number_input("points per trace", 100, 100000, 2000, 500, help="Chromatograms are reduced to this number of points for plotting, peak maxima are kept.")
         col4.markdown("##")
         if col4.button("Download Chromatograms", help="Select a folder where data from selceted samples and chromatograms gets stored."):
             new_folder = get_dir()
             if new_folder:
                 for file in all_files:
-                    df = pd.read_feather(os.path.join(results_dir, file))[["time"]+all_chroms]
-                    path = os.path.join(new_folder, file[:-4]+"_"+str(tolerance)+unit)
+                    df = store.read(file, ["time"]+all_chroms)
+                    path = os.path.join(new_folder, file+"_"+str(tolerance)+unit)
                     df.to_csv(path+".tsv", sep="\t", index=False)
                 col4.success("Download done!")
 
 
 
-        for file in all_files:
-            df = pd.read_feather(os.path.join(results_dir, file))
-            df["AUC baseline"] = [baseline] * len(df)
-            if "AUC baseline" not in all_chroms:
-                all_chroms.append("AUC baseline")
-
-            auc = pd.DataFrame()
-            for chrom in all_chroms:
-                if chrom != "AUC baseline" and chrom != "BPC":
-                    auc[chrom] = [int(np.trapz([x-baseline for x in df[chrom] if x > baseline]))]
-            auc.to_feather(os.path.join(results_dir, file[:-4]+"AUC.ftr"))
-            df.to_feather(os.path.join(results_dir, file))
+        # AUCs are kept per baseline until samples, chromatograms or the extraction results change
+        auc_key = (tuple(all_files), tuple(all_chroms), tuple(os.path.getmtime(store.path(f)) for f in all_files))
+        if st.session_state.extract_auc is None or st.session_state.extract_auc[0] != auc_key:
+            st.session_state.extract_auc = (auc_key, AUCSummary(store, all_files, [c for c in all_chroms if c not in ("BPC", "TIC")]))
+        df_summary = st.session_state.extract_auc[1].get(baseline)
+        all_chroms.append("AUC baseline")
 
         st.markdown("***")
-        DataFrames().get_auc_summary([os.path.join(results_dir, file[:-4]+"AUC.ftr") for file in all_files], os.path.join(results_dir, "summary.ftr"))
-        df_summary = pd.read_feather(os.path.join(results_dir, "summary.ftr"))
-        df_summary.index = df_summary["index"]
-        df_summary = df_summary.drop(columns=["index"])
 
         col5.markdown("##")
-        col5.download_button("Download Quantification Data", df_summary.rename(columns={col: col+".mzML" for col in df_summary.columns if col != "metabolite"}).to_csv(sep="\t", index=False), "Quantification-EIC.tsv")
-        col5.download_button("Download Meta Data", pd.DataFrame({"filename": [file.replace("ftr", "mzML") for file in all_files], "ATTRIBUTE_Sample_Type": ["Sample"]*len(all_files)}).to_csv(sep="\t", index=False), "Meta-Data-EIC.tsv")
+        col5.download_button("Download Quantification Data", df_summary.reset_index(names="metabolite").rename(columns={col: col+".mzML" for col in df_summary.columns}).to_csv(sep="\t", index=False), "Quantification-EIC.tsv")
+        col5.download_button("Download Meta Data", pd.DataFrame({"filename": [file+".mzML" for file in all_files], "ATTRIBUTE_Sample_Type": ["Sample"]*len(all_files)}).to_csv(sep="\t", index=False), "Meta-Data-EIC.tsv")
 
         st.markdown("Summary")
+        if st.session_state.extract_peak_memory:
+            st.metric("peak memory per worker during extraction", f"{st.session_state.extract_peak_memory:.0f} MB")
+        # plotting is only imported once there are results to show
+        from pymetabo.plotting import Plot
         fig = Plot().FeatureMatrix(df_summary)
         st.plotly_chart(fig)
         st.dataframe(df_summary)
 
         st.markdown("***")
+        limits = time_limits(store, all_files)
+        if limits and limits[0] < limits[1]:
+            time_range = st.slider("time range", limits[0], limits[1], limits, help="Zoom in to see the chromatograms in full resolution.")
+        else:
+            time_range = None
         cols = st.columns(num_cols)
         while all_files:
             for col in cols:
@@ -213,11 +182,13 @@ The results will be displayed as a summary with all samples and EICs AUC values
                     file = all_files.pop()
                 except IndexError:
                     break
-                df = pd.read_feather(os.path.join(results_dir, file))
-                auc = pd.read_feather(os.path.join(results_dir, file[:-4]+"AUC.ftr"))
+                df = decimate(store.read(file, ["time"]+all_chroms), max_points, x_range=time_range)
+                df["AUC baseline"] = baseline
+                auc = df_summary[[file]].T.reset_index(drop=True)
                 # auc.index = auc["index"]
                 # auc = auc.drop(columns=["index"])
-                fig_chrom, fig_auc = Plot().extracted_chroms(df, chroms=all_chroms, df_auc=auc, title=file[:-4], time_unit=time_unit)
+                fig_chrom, fig_auc = Plot().extracted_chroms(df, chroms=all_chroms, df_auc=auc, title=file, time_unit=time_unit)
                 col.plotly_chart(fig_chrom)
                 col.plotly_chart(fig_auc)
                 col.markdown("***")
+    poll("extract")
@@ -1,10 +1,16 @@
 import streamlit as st
+import plotly.express as px
 from pymetabo.plotting import *
-from pymetabo.statistics import *
 import pandas as pd
 from utils.filehandler import get_file, save_file
+from utils.statistics import FeatureStatistics, matrix_hash
+from utils.matrix import matrix_columns, load_matrix
+from utils.heatmap import cached_cluster_order, aggregate_rows, raster_image, top_features, search_features
 import os
 
+# matrices with more features are shown as clustered heatmap images and top feature bar charts
+LARGE_MATRIX = 500
+
 def download_df(df):
     path = save_file("Download Table", type=[("Excel table", "*.xlsx"), ("tab separated table", "*.tsv")])
     if path:
@@ -13,6 +19,17 @@ def download_df(df):
         elif path.endswith("xlsx"):
             df.to_excel(path)
         st.success("Download done")
+
+def heatmap(df, key, title, symmetric=True):
+    """Clustered heatmap of a large matrix, aggregated to one row per pixel and sent as an image."""
+    df = aggregate_rows(df.iloc[cached_cluster_order(df, key)])
+    img, (vmin, vmax) = raster_image(df, "RdBu_r" if symmetric else "viridis", symmetric)
+    fig = px.imshow(img, binary_string=True, aspect="auto", title=title)
+    fig.update_xaxes(tickvals=list(range(len(df.columns))), ticktext=list(df.columns))
+    fig.update_yaxes(showticklabels=False, title="features (clustered)")
+    st.plotly_chart(fig)
+    st.caption(f"color scale from {vmin:.3g} to {vmax:.3g}")
+
 def app():
     with st.sidebar:
         if "statistics_matrix_file" not in st.session_state:
@@ -21,6 +38,8 @@ def app():
             st.session_state.statistics_samples = []
         if "statistics_features" not in st.session_state:
             st.session_state.statistics_features = []
+        if "statistics_engine" not in st.session_state:
+            st.session_state.statistics_engine = None
 
         with st.expander("info", expanded=True):
             st.markdown("""
@@ -40,24 +59,29 @@ You can use the suggested sample names. In order to enter replicates put them in
             matrix_file = st.text_input("feature matrix file", st.session_state.statistics_matrix_file)
 
         if os.path.exists(matrix_file):
-            if matrix_file.endswith("tsv"):
-                df = pd.read_csv(matrix_file, sep="\t")
-            elif matrix_file.endswith("xlsx"):
-                df = pd.read_excel(matrix_file)
             meta_value_columns = ["id", "metabolite", "charge", "RT", "mz", "quality", "name", "adduct"]
-            df.set_index("metabolite", inplace=True)
             # st.session_state.statistics_samples = df.drop(columns=[c for c in ["index", "Unnamed: 0"]+meta_value_columns if c in df.columns]).columns.to_list()
             # st.session_state.statistics_features = df.drop(columns=[c for c in ["index", "Unnamed: 0"]+meta_value_columns if c in df.columns])["metabolite"].to_list()
-            st.session_state.statistics_samples = [col for col in df.columns if col.endswith("mzML")]
-            st.session_state.statistics_features = df.index.to_list()
+            # only the metabolite names and the selected samples are read from the cached matrix
+            st.session_state.statistics_samples = [col for col in matrix_columns(matrix_file) if col.endswith("mzML")]
+            st.session_state.statistics_features = load_matrix(matrix_file, ["metabolite"])["metabolite"].to_list()
             samples = st.multiselect("samples", st.session_state.statistics_samples, st.session_state.statistics_samples)
-            features = st.multiselect("features", st.session_state.statistics_features, st.session_state.statistics_features)
-            
-            df = df.loc[features, samples]
+            # features are filtered on the server instead of sending all names to the browser
+            query = st.text_input("search features", help="Only features containing this text are analysed, all features if empty.")
+            features = search_features(st.session_state.statistics_features, query)
+            st.write(f"{len(features)} of {len(st.session_state.statistics_features)} features")
+
+            df = load_matrix(matrix_file, ["metabolite"]+samples).set_index("metabolite")
+            df = df.loc[df.index.isin(features), samples]
             df_meta_values = df[[c for c in meta_value_columns if c in df.columns]]
             df.drop(columns=[c for c in meta_value_columns if c in df.columns], inplace=True)
+            # replicate groups and results are kept as long as the selected matrix does not change
+            df_hash = matrix_hash(df)
+            if st.session_state.statistics_engine is None or st.session_state.statistics_engine.hash != df_hash:
+                st.session_state.statistics_engine = FeatureStatistics(df)
+            engine = st.session_state.statistics_engine
             st.write("Choose pairs for comparison from the follwing samples:")
-            for name in set([c.split("#")[0] for c in df.columns]):
+            for name in engine.groups:
                 st.write(name)
             col1, col2 = st.columns(2)
             with col1:
@@ -67,27 +91,33 @@ You can use the suggested sample names. In order to enter replicates put them in
             col1, col2, col3 = st.columns(3)
             with col1:
                 normalize = st.radio("normalize values", ["do not", "per sample", "across feature map"])
+            with col2:
+                n_top = st.number_input("features in bar charts", 1, 1000, 50, help=f"With more than {LARGE_MATRIX} features bar charts show only the top features.")
+            with col3:
+                rank_by = st.radio("rank features by", ["fold change", "variance"])
 
     if os.path.exists(matrix_file):
-        if normalize == "per sample":
-            df_norm = Statistics().maximum_absolute_scaling_per_column(df)
-        elif normalize == "across feature map":
-            df_norm = Statistics().normalize_max(df)
-        elif normalize == "do not":
-            df_norm = df
-
         pairs = []
         for a, b in zip(pairs_a.split("\n"), pairs_b.split("\n")):
             a = a.strip()
             b = b.strip()
             if a and b:
                 pairs.append((b, a))
-        df_mean, df_std, df_change = Statistics().get_mean_std_change_df(df, pairs)
+        df_norm = engine.normalize(normalize)
+        df_mean, df_std, df_change, df_p, df_fdr = engine.compare(pairs, normalize)
         df_summary = pd.concat([df_meta_values, df_norm, df_change], axis=1)
         if st.button("Summary"):
             download_df(df_summary)
         st.dataframe(df_summary)
-        fig = Plot().FeatureMatrix(df_norm)
+        large = len(df_norm) > LARGE_MATRIX
+        if large:
+            # top features by the largest fold change of any pair, or by variance across samples
+            top = top_features(df_norm, n_top, df_change if rank_by == "fold change" and not df_change.empty else None).index
+            heatmap(df_norm, engine.hash+normalize, "feature matrix", symmetric=False)
+            fig = Plot().FeatureMatrix(df_norm.loc[top])
+        else:
+            top = df_norm.index
+            fig = Plot().FeatureMatrix(df_norm)
         st.plotly_chart(fig)
         if not df_mean.empty:
             st.markdown("***")
@@ -97,10 +127,16 @@ You can use the suggested sample names. In order to enter replicates put them in
             if st.button("Standard deviations"):
                 download_df(df_std)
             st.dataframe(df_std)
-            st.plotly_chart(Plot().FeatureMatrix(df_mean, df_std, y_title="mean AUC"))
+            st.plotly_chart(Plot().FeatureMatrix(df_mean.loc[top], df_std.loc[top], y_title="mean AUC"))
             st.markdown("***")
             if st.button("Log 2 fold changes"):
                 download_df(df_change)
             st.dataframe(df_change)
-            st.plotly_chart(Plot().FeatureMatrix(df_change, y_title="log 2 fold change"))
-            st.plotly_chart(Plot().FeatureMatrixHeatMap(df_change, title="log 2 fold change"))
+            st.plotly_chart(Plot().FeatureMatrix(df_change.loc[top], y_title="log 2 fold change"))
+            if st.button("p-values"):
+                download_df(pd.concat([df_p.add_prefix("p-value "), df_fdr.add_prefix("FDR ")], axis=1))
+            st.dataframe(pd.concat([df_p.add_prefix("p-value "), df_fdr.add_prefix("FDR ")], axis=1))
+            if large:
+                heatmap(df_change, engine.hash+normalize+str(pairs), "log 2 fold change")
+            else:
+                st.plotly_chart(Plot().FeatureMatrixHeatMap(df_change, title="log 2 fold change"))
@@ -1,13 +1,15 @@
 import streamlit as st
 import plotly.express as px
-from pyopenms import *
-from pymetabo.helpers import Helper
-from pymetabo.core import FeatureFinderMetaboIdent
 from pymetabo.dataframes import DataFrames
 from pymetabo.plotting import Plot
 import os
 import pandas as pd
 from utils.filehandler import get_files, get_dir, save_file
+from utils.parallel import default_workers
+from utils.cache import ResultCache
+from utils.jobview import job_queue_settings, show_jobs, show_metrics, poll
+from utils.chromstore import ChromatogramStore
+from utils.decimate import decimate, time_limits
 
 def app():
     results_dir = "results_targeted"
@@ -80,51 +82,54 @@ The results will be displayed as a summary with all samples and intensity values
             ffmid_n_isotopes = st.number_input("extract:n_isotopes", 2, 10, 2)
         with col4: 
             time_unit = st.radio("time unit", ["seconds", "minutes"])
+            workers = st.number_input("parallel files", 1, default_workers(), default_workers(), help="Number of mzML files processed at the same time.")
+            use_cache = st.checkbox("use cache", True, help="Re-use results of files that were quantified before with the same library and parameters.")
+            profile = st.checkbox("profile", False, help="Record cProfile statistics of the quantification in the results folder.")
+            queue = job_queue_settings("targeted")
             run_button = st.button("Extract Chromatograms!")
+            if st.button("Clear cache", help="Delete all cached results."):
+                ResultCache().clear()
 
     if run_button:
-        Helper().reset_directory(results_dir)
-        for file in mzML_files:
-            with st.spinner("Extracting from: " + file):
-
-                FeatureFinderMetaboIdent().run(file,
-                            os.path.join(results_dir,  os.path.basename(file[:-4]+"featureXML")), library,
-                            params={"extract:mz_window": ffmid_mz,
-                                    "detect:peak_width": ffmid_peak_width,
-                                    "extract:n_isotopes": ffmid_n_isotopes})
-
-                DataFrames().FFMID_chroms_to_df(os.path.join(results_dir, os.path.basename(file[:-4]+"featureXML")),
-                                                os.path.join(results_dir,  os.path.basename(file[:-4]+"ftr")),
-                                                time_unit=time_unit)
-
-                DataFrames().FFMID_auc_to_df(os.path.join(results_dir,os.path.basename(file[:-4]+"featureXML")),
-                                            os.path.join(results_dir,  os.path.basename(file[:-5]+"AUC.ftr")))
-
-                DataFrames().FFMID_auc_combined_to_df(os.path.join(results_dir,  os.path.basename(file[:-5]+"AUC.ftr")),
-                                                os.path.join(results_dir,  os.path.basename(file[:-5]+"AUC_combined.ftr")))
-
-                os.remove(os.path.join(results_dir,  os.path.basename(file[:-4]+"featureXML")))
-
-
-        st.session_state.viewing_targeted = True
-
-    files = [f for f in os.listdir(results_dir) if f.endswith(".ftr") and "AUC" not in f and "summary" not in f]
+        if queue.active("targeted"):
+            st.warning("Targeted metabolomics is still running.")
+        else:
+            # runs in a background process, it keeps running if the page is reloaded
+            queue.submit("targeted", "utils.targeted:quantify_files", mzML_files=sorted(mzML_files), results_dir=results_dir,
+                         library=library, params={"extract:mz_window": ffmid_mz,
+                                                  "detect:peak_width": ffmid_peak_width,
+                                                  "extract:n_isotopes": ffmid_n_isotopes},
+                         time_unit=time_unit, use_cache=use_cache, workers=workers, profile=profile)
+
+    job = show_jobs("targeted")
+    if job is not None:
+        for file, error in job["result"]["errors"].items():
+            st.error("Extraction failed for " + file + ": " + error)
+        with st.expander("stage timings"):
+            show_metrics(os.path.join(results_dir, "metrics.json"))
+    # results are shown once the last run finished, while a run is active its folder is being rewritten
+    st.session_state.viewing_targeted = job is not None and not queue.active("targeted")
+
+    store = ChromatogramStore(os.path.join(results_dir, "chromatograms"))
+    files = store.samples()
     if st.session_state.viewing_targeted:
-        all_files = sorted(st.multiselect("samples", files, files, format_func=lambda x: os.path.basename(x)[:-4]), reverse=True)
+        all_files = sorted(st.multiselect("samples", files, files), reverse=True)
 
-        DataFrames().get_auc_summary([os.path.join(results_dir, file[:-4]+"AUC.ftr") for file in all_files], os.path.join(results_dir, "summary.ftr"))
-        DataFrames().get_auc_summary([os.path.join(results_dir, file[:-4]+"AUC_combined.ftr") for file in all_files], os.path.join(results_dir, "summary_combined.ftr"))
+        DataFrames().get_auc_summary([os.path.join(results_dir, file+"AUC.ftr") for file in all_files], os.path.join(results_dir, "summary.ftr"))
+        DataFrames().get_auc_summary([os.path.join(results_dir, file+"AUC_combined.ftr") for file in all_files], os.path.join(results_dir, "summary_combined.ftr"))
 
-        col1, _, col2, col3, col4 = st.columns(5)
+        col1, col5, col2, col3, col4 = st.columns(5)
         num_cols = col1.number_input("show columns", 1, 5, 1)
+        max_points = col5.number_input("points per trace", 100, 100000, 2000, 500, help="Chromatograms are reduced to this number of points for plotting, peak maxima are kept.")
         col3.markdown("##")
         if col3.button("Download Selection", help="Select a folder where data from selceted samples and chromatograms gets stored."):
             new_folder = get_dir()
             if new_folder:
-                for file in all_files+["summary.ftr", "summary_combined.ftr"]:
-                    df = pd.read_feather(os.path.join(results_dir, file))
-                    path = os.path.join(new_folder, file[:-4])
-                    df.to_csv(path+".tsv", sep="\t", index=False)
+                for file in all_files:
+                    store.read(file).to_csv(os.path.join(new_folder, file+".tsv"), sep="\t", index=False)
+                for file in ["summary", "summary_combined"]:
+                    df = pd.read_feather(os.path.join(results_dir, file+".ftr"))
+                    df.to_csv(os.path.join(new_folder, file+".tsv"), sep="\t", index=False)
                 col3.success("Download done!")
 
         df_summary_combined = pd.read_feather(os.path.join(results_dir, "summary_combined.ftr"))
@@ -132,7 +137,7 @@ The results will be displayed as a summary with all samples and intensity values
         df_summary_combined = df_summary_combined.drop(columns=["index"])
         col4.markdown("##")
         col4.download_button("Download Quantification Data", df_summary_combined.rename(columns={col: col+".mzML" for col in df_summary_combined.columns if col != "metabolite"}).to_csv(sep="\t", index=False), "Feature-Quantification-Targeted-Metabolomics.tsv")
-        col4.download_button("Download Meta Data", pd.DataFrame({"filename": [file.replace("ftr", "mzML") for file in all_files], "ATTRIBUTE_Sample_Type": ["Sample"]*len(all_files)}).to_csv(sep="\t", index=False), "Meta-Data-Targeted-Metabolomics.tsv")
+        col4.download_button("Download Meta Data", pd.DataFrame({"filename": [file+".mzML" for file in all_files], "ATTRIBUTE_Sample_Type": ["Sample"]*len(all_files)}).to_csv(sep="\t", index=False), "Meta-Data-Targeted-Metabolomics.tsv")
 
 
         st.markdown("***")
@@ -149,6 +154,11 @@ The results will be displayed as a summary with all samples and intensity values
         st.plotly_chart(fig)
         st.dataframe(df_summary)
         st.markdown("***")
+        limits = time_limits(store, all_files)
+        if limits and limits[0] < limits[1]:
+            time_range = st.slider("time range", limits[0], limits[1], limits, help="Zoom in to see the chromatograms in full resolution.")
+        else:
+            time_range = None
         cols = st.columns(num_cols)
         while all_files:
             for col in cols:
@@ -156,15 +166,16 @@ The results will be displayed as a summary with all samples and intensity values
                     file = all_files.pop()
                 except IndexError:
                     break
-                df_chrom = pd.read_feather(os.path.join(results_dir, file))
-                df_auc = pd.read_feather(os.path.join(results_dir, file[:-4]+"AUC.ftr")).drop(columns=["index"])
-                df_auc_combined = pd.read_feather(os.path.join(results_dir, file[:-4]+"AUC_combined.ftr")).drop(columns=["index"])
+                df_chrom = decimate(store.read(file), max_points, x_range=time_range)
+                df_auc = pd.read_feather(os.path.join(results_dir, file+"AUC.ftr")).drop(columns=["index"])
+                df_auc_combined = pd.read_feather(os.path.join(results_dir, file+"AUC_combined.ftr")).drop(columns=["index"])
 
-                fig_chrom, fig_auc, fig_auc_combined = Plot().FFMID(df_chrom, df_auc=df_auc, df_auc_combined=df_auc_combined, time_unit=time_unit, title=file[:-4])
+                fig_chrom, fig_auc, fig_auc_combined = Plot().FFMID(df_chrom, df_auc=df_auc, df_auc_combined=df_auc_combined, time_unit=time_unit, title=file)
                 col.plotly_chart(fig_chrom)
                 col.plotly_chart(fig_auc)
                 col.dataframe(df_auc)
                 col.plotly_chart(fig_auc_combined)
                 col.dataframe(df_auc_combined)
 
-                col.markdown("***")
\ No newline at end of file
+                col.markdown("***")
+    poll("targeted")
@@ -1,17 +1,14 @@
-import shutil
 import streamlit as st
-import pandas as pd
-from pymetabo.core import *
-from pymetabo.helpers import *
-from pymetabo.dataframes import *
-from pymetabo.sirius import *
-from pymetabo.gnps import *
+import os
 from utils.filehandler import get_file, get_files, get_dir, save_file
+from utils.parallel import default_workers
+from utils.matrix import load_matrix
+from utils.consensus import load_summary
+from utils.jobview import job_queue_settings, show_jobs, show_metrics, poll
 
-# @st.cache(suppress_st_warning=True)
 def open_df(path):
     if os.path.isfile(path):
-        df = pd.read_csv(path, sep="\t")
+        df = load_matrix(path)
     else:
         return
     for column in df.columns:
@@ -57,9 +54,11 @@ def app():
     result_dir_button = col2.button("Select", help="Choose a folder for your results.")
     if result_dir_button:
         st.session_state.results_dir_untargeted = get_dir("Open folder for your results.")
-    results_dir = col1.text_input("results folder (will be deleted each time the workflow is started!)", st.session_state.results_dir_untargeted)
+    results_dir = col1.text_input("results folder (results of unchanged workflow stages will be re-used)", st.session_state.results_dir_untargeted)
 
 
+    workers = st.number_input("parallel samples", 1, default_workers(), default_workers(), help="Number of mzML files processed at the same time in feature detection and ID mapping.")
+
     st.markdown("##### Feature Detection")
     col1, col2, col3 = st.columns(3)
     with col1:
@@ -87,7 +86,13 @@ def app():
         ma_mz_max, ma_mz_unit, ma_rt_max = 10.0, "ppm", 100.0
 
     st.markdown("##### Re-Quantification")
-    use_ffmid = st.checkbox("enable", False, help="Use FeatureFinderMetaboIdent to re-quantify consensus features that have missing values.")
+    use_requant = st.checkbox("enable", False, help="Quantify consensus features that have missing values.")
+    use_ffmid, use_gap_filling = False, False
+    if use_requant:
+        requant_method = st.radio("method", ["FeatureFinderMetaboIdent", "gap filling"],
+                                  help="FeatureFinderMetaboIdent re-detects the features with missing values in all samples and links them again. Gap filling only integrates the m/z and RT window of each missing value in the spectra of its sample, which is much faster.")
+        use_ffmid = requant_method == "FeatureFinderMetaboIdent"
+        use_gap_filling = requant_method == "gap filling"
     if use_ffmid:
         col1, col2, col3 = st.columns(3)
         with col1:
@@ -96,6 +101,11 @@ def app():
             ffmid_peak_width = float(st.number_input("detect:peak_width", 1, 1000, 60))
         with col3:
             ffmid_n_isotopes = st.number_input("extract:n_isotopes", 2, 10, 2)
+    if use_gap_filling:
+        col1, col2, _ = st.columns(3)
+        gap_mz_window_ppm = float(col1.number_input("mz window in ppm", 1, 100, 10, key="gap filling ppm"))
+        gap_rt_window_sec = float(col2.number_input("retention time window in seconds", 1, 600, 30, key="gap filling rt",
+                                                    help="Integrated around the retention time of the consensus feature, e.g. 30 s are 15 s to each side."))
 
     st.markdown("##### Adduct Detection")
     use_ad = st.checkbox("enable", True)
@@ -119,7 +129,7 @@ def app():
             ad_ion_mode, ad_adducts, ad_charge_min, ad_charge_max = "false", "H:+:0.9\nNa:+:0.1\nH-2O-1:0:0.4\nH-4O-2:0:0.1", 1, 3
 
     st.markdown("##### SIRIUS")
-    use_sirius_manual = st.checkbox("enable", True, help="Export files for formula and structure predictions. Run Sirius with these pre-processed .ms files, can be found in results -> SIRIUS -> sirius_files.")
+    use_sirius_manual = st.checkbox("enable", False, help="Export files for formula and structure predictions. Run Sirius with these pre-processed .ms files, can be found in results -> SIRIUS -> sirius_files. The export reads retention time aligned spectra from disk, so an aligned copy of every mzML file is written to the results folder.")
 
     # disable gnps for now, seq fault error with some files
     # use_gnps = st.checkbox("export files for GNPS FBMN and IIMN", False, help="Run GNPS Feature Based Molecular Networking and Ion Identity Molecular Networking with these files, can be found in results -> GNPS.")
@@ -152,157 +162,73 @@ def app():
             ms1_annotation_file = get_file("Select file for MS1 annotations.")
         ms1_annotation_file = c1.text_input("select a file for MS1 annotations", ms1_annotation_file)
 
-    _, c2, _ = st.columns(3)
-    if c2.button("Run Workflow!"):
-        st.session_state.viewing_untargeted = True
-        interim = Helper().reset_directory(os.path.join(results_dir, "interim"))
-
-        with st.spinner("Fetching mzML file data..."):
-            mzML_dir = os.path.join(interim, "mzML_original")
-            Helper().reset_directory(mzML_dir)
-            for file in mzML_files:
-                shutil.copy(file, mzML_dir)
-
-        with st.spinner("Detecting features..."):
-            FeatureFinderMetabo().run(mzML_dir, os.path.join(interim, "FFM"),
-                                    {"noise_threshold_int": ffm_noise,
-                                    "mass_error_ppm": ffm_mass_error,
-                                    "remove_single_traces": ffm_single_traces})
-
-        with st.spinner("Aligning feature maps..."):
-            MapAligner().run(os.path.join(interim, "FFM"), os.path.join(interim, "FFM_aligned"),
-                            os.path.join(interim, "Trafo"),
-                            {"max_num_peaks_considered": -1,
-                            "superimposer:mz_pair_max_distance": 0.05,
-                            "pairfinder:distance_MZ:max_difference": ma_mz_max,
-                            "pairfinder:distance_MZ:unit": ma_mz_unit,
-                            "pairfinder:distance_RT:max_difference": ma_rt_max})
-
-        with st.spinner("Aligning mzML files..."):
-            MapAligner().run(mzML_dir, os.path.join(interim, "mzML_aligned"),
-            os.path.join(interim, "Trafo"))
-            mzML_dir = os.path.join(interim, "mzML_aligned")
-
-        if use_ad:
-            with st.spinner("Determining adducts..."):
-                MetaboliteAdductDecharger().run(os.path.join(interim, "FFM_aligned"), os.path.join(interim, "FeatureMaps_decharged"),
-                            {"potential_adducts": [line.encode() for line in ad_adducts.split("\n")],
-                            "charge_min": ad_charge_min,
-                            "charge_max": ad_charge_max,
-                            "max_neutrals": 2,
-                            "negative_mode": ad_ion_mode,
-                            "retention_max_diff": 3.0,
-                            "retention_max_diff_local": 3.0})
-            featureXML_dir = os.path.join(interim, "FeatureMaps_decharged")
-        else:
-            featureXML_dir = os.path.join(interim, "FFM_aligned")
-        
-        with st.spinner("Mapping MS2 data to features..."):
-            MapID().run(mzML_dir, featureXML_dir, os.path.join(interim, "FeatureMaps_ID_mapped"))
-            featureXML_dir = os.path.join(interim, "FeatureMaps_ID_mapped")
-
-        with st.spinner("Linking features..."):
-            FeatureLinker().run(featureXML_dir,
-                            os.path.join(interim,  "FeatureMatrix.consensusXML"),
-                            {"link:mz_tol": fl_mz_tol,
-                                "link:rt_tol": fl_rt_tol,
-                                "mz_unit": fl_mz_unit})
-
-        sirius_featureXML_dir = featureXML_dir
-
-        if use_ffmid:
-            with st.spinner("Re-quantifying features with missing values..."):
-                FeatureMapHelper().split_consensus_map(os.path.join(interim,  "FeatureMatrix.consensusXML"),
-                                                    os.path.join(interim,  "FFM_complete.consensusXML"),
-                                                    os.path.join(interim,  "FFM_missing.consensusXML"))
-
-                FeatureMapHelper().consensus_to_feature_maps(os.path.join(interim,  "FFM_complete.consensusXML"),
-                                                            featureXML_dir,
-                                                            os.path.join(interim, "FFM_complete"))
-
-                FeatureFinderMetaboIdent().run(mzML_dir,
-                                            os.path.join(interim,  "FFMID"),
-                                            os.path.join(interim,  "FFM_missing.consensusXML"),
-                                            {"detect:peak_width": ffmid_peak_width,
-                                            "extract:mz_window": ffmid_mz,
-                                            "extract:n_isotopes": ffmid_n_isotopes,
-                                            "extract:rt_window": ffmid_peak_width})
-
-
-                FeatureMapHelper().merge_feature_maps(os.path.join(interim, "FeatureMaps_merged"), os.path.join(
-                    interim, "FFM_complete"), os.path.join(interim, "FFMID"))
-
-            if use_ad:
-                with st.spinner("Determining adducts..."):
-                    print([line.encode() for line in ad_adducts.split("\n")])
-                    MetaboliteAdductDecharger().run(os.path.join(interim, "FeatureMaps_merged"), os.path.join(interim, "FeatureMaps_decharged"),
-                                {"potential_adducts": [line.encode() for line in ad_adducts.split("\n")],
-                                "charge_min": ad_charge_min,
-                                "charge_max": ad_charge_max,
-                                "max_neutrals": 2,
-                                "negative_mode": ad_ion_mode,
-                                "retention_max_diff": 4.0,
-                                "retention_max_diff_local": 4.0})
-                featureXML_dir = os.path.join(interim, "FeatureMaps_decharged")
-            else:
-                featureXML_dir = os.path.join(interim, "FeatureMaps_merged")
-
-            with st.spinner("Mapping MS2 data to re-quantified features..."):
-                MapID().run(mzML_dir, featureXML_dir, os.path.join(interim, "FeatureMaps_ID_mapped"))
-                featureXML_dir = os.path.join(interim, "FeatureMaps_ID_mapped")
-
-            with st.spinner("Linking re-quantified features..."):
-                FeatureLinker().run(featureXML_dir,
-                                os.path.join(interim, "FeatureMatrixRequantified.consensusXML"),
-                                {"link:mz_tol": fl_mz_tol,
-                                "link:rt_tol": fl_rt_tol,
-                                "mz_unit": fl_mz_unit})
-            sirius_featureXML_dir = featureXML_dir
-
-        if use_sirius_manual: # export only sirius ms files to use in the GUI tool
-            with st.spinner("Exporting files for Sirius..."):
-                Sirius().run(mzML_dir, sirius_featureXML_dir, os.path.join(results_dir, "SIRIUS"), "", True,
-                            {"-preprocessing:feature_only": "true"})
-            sirius_ms_dir = os.path.join(results_dir, "SIRIUS", "sirius_files")
-        else:
-            sirius_ms_dir = ""
-        
-        if use_gnps:
-            with st.spinner("Exporting files for GNPS..."):
-                if use_ffmid:
-                    consensusXML_file = os.path.join(interim, "FeatureMatrixRequantified.consensusXML")
-                else:
-                    consensusXML_file = os.path.join(interim, "FeatureMatrix.consensusXML")
-                GNPSExport().run(consensusXML_file, mzML_dir, os.path.join(results_dir, "GNPS"))
+    st.markdown("##### Accurate mass search")
+    use_ams = st.checkbox("enable", False, key="accurate mass search", help="Annotate features with all formula and adduct combinations of an AccurateMassSearch database within an m/z window.")
+    if use_ams:
+        c1, c2, c3 = st.columns(3)
+        ams_maps = c1.selectbox("database", [os.path.join("example_data", "AccurateMassSearch", f) for f in sorted(os.listdir(os.path.join("example_data", "AccurateMassSearch"))) if f.endswith("_maps.tsv")],
+                                format_func=lambda x: os.path.basename(x)[:-9])
+        ams_adducts = os.path.join("example_data", "AccurateMassSearch", c2.radio("ionization mode", ["positive", "negative"], key="accurate mass search mode")+"_adducts.tsv")
+        ams_mz_window_ppm = c3.number_input("mz window in ppm", 1, 100, 10, 1, key="accurate mass search ppm")
+    else:
+        ams_maps, ams_adducts, ams_mz_window_ppm = "", "", 0
 
-        if use_ffmid:
-            DataFrames().create_consensus_table(os.path.join(interim, "FeatureMatrixRequantified.consensusXML"),
-                                            os.path.join(results_dir, "FeatureMatrixRequantified.tsv"), sirius_ms_dir)
-            DataFrames().create_consensus_table(os.path.join(interim, "FeatureMatrix.consensusXML"), 
-                                                os.path.join(results_dir, "FeatureMatrix.tsv"), "")
-            GNPSExport().export_metadata_table_only(os.path.join(interim, "FeatureMatrixRequantified.consensusXML"), os.path.join(results_dir, "MetaData.tsv"))
+    _, c1, c2, c3 = st.columns(4)
+    with c1:
+        queue = job_queue_settings("untargeted")
+    force = c3.checkbox("re-run all stages", False, help="Ignore results from previous runs and compute every stage again.")
+    profile = c3.checkbox("profile stages", False, help="Record cProfile statistics of every stage in the results folder.")
+    if c2.button("Run Workflow!"):
+        if any(job["kwargs"]["results_dir"] == results_dir for job in queue.active("untargeted")):
+            st.warning("A workflow writing to this results folder is still running.")
         else:
-            DataFrames().create_consensus_table(os.path.join(interim, "FeatureMatrix.consensusXML"), 
-                                                os.path.join(results_dir, "FeatureMatrix.tsv"), sirius_ms_dir)
-            GNPSExport().export_metadata_table_only(os.path.join(interim, "FeatureMatrix.consensusXML"), os.path.join(results_dir, "MetaData.tsv"))
-        
-        if annotate_ms1 and use_ffmid:
-            with st.spinner("Annotating feautures on MS1 level by m/z and RT"):
-                DataFrames().annotate_ms1(os.path.join(results_dir, "FeatureMatrixRequantified.tsv"), ms1_annotation_file, annotation_mz_window_ppm, annoation_rt_window_sec)
-                DataFrames().save_MS1_ids(os.path.join(results_dir, "FeatureMatrixRequantified.tsv"), os.path.join(results_dir, "MS1-annotations"))
-        elif annotate_ms1:
-            with st.spinner("Annotating feautures on MS1 level by m/z and RT"):
-                DataFrames().annotate_ms1(os.path.join(results_dir, "FeatureMatrix.tsv"), ms1_annotation_file, annotation_mz_window_ppm, annoation_rt_window_sec)
-                DataFrames().save_MS1_ids(os.path.join(results_dir, "FeatureMatrix.tsv"), os.path.join(results_dir, "MS1-annotations"))
-
+            params = {"FeatureFinderMetabo": {"noise_threshold_int": ffm_noise,
+                                              "mass_error_ppm": ffm_mass_error,
+                                              "remove_single_traces": ffm_single_traces},
+                      "MapAligner": {"pairfinder:distance_MZ:max_difference": ma_mz_max,
+                                     "pairfinder:distance_MZ:unit": ma_mz_unit,
+                                     "pairfinder:distance_RT:max_difference": ma_rt_max},
+                      "FeatureFinderMetaboIdent": {"detect:peak_width": ffmid_peak_width,
+                                                   "extract:mz_window": ffmid_mz,
+                                                   "extract:n_isotopes": ffmid_n_isotopes} if use_ffmid else None,
+                      "Gap filling": {"mz_window_ppm": gap_mz_window_ppm,
+                                      "rt_window_sec": gap_rt_window_sec} if use_gap_filling else None,
+                      "MetaboliteAdductDecharger": {"potential_adducts": ad_adducts,
+                                                    "charge_min": ad_charge_min,
+                                                    "charge_max": ad_charge_max,
+                                                    "negative_mode": ad_ion_mode} if use_ad else None,
+                      "FeatureLinker": {"link:mz_tol": fl_mz_tol,
+                                        "link:rt_tol": fl_rt_tol,
+                                        "mz_unit": fl_mz_unit},
+                      "Sirius": use_sirius_manual,
+                      "GNPS": use_gnps,
+                      "MS1 annotation": {"file": ms1_annotation_file,
+                                         "mz_window_ppm": annotation_mz_window_ppm,
+                                         "rt_window_sec": annoation_rt_window_sec} if annotate_ms1 else None,
+                      "AccurateMassSearch": {"maps": ams_maps,
+                                             "adducts": ams_adducts,
+                                             "mz_window_ppm": ams_mz_window_ppm} if use_ams else None}
+            # the workflow runs in a background process, it keeps running if the page is reloaded
+            queue.submit("untargeted", "utils.untargeted:run_workflow", mzML_files=sorted(mzML_files), results_dir=results_dir,
+                         params=params, force=force, workers=workers, profile=profile)
+
+    job = show_jobs("untargeted")
+    if job is not None and os.path.isfile(os.path.join(job["kwargs"]["results_dir"], "FeatureMatrix.tsv")):
+        results_dir = job["kwargs"]["results_dir"]
         st.success("Complete!")
+        with st.expander("workflow stages"):
+            show_metrics(os.path.join(results_dir, "metrics.json"))
 
-        df = open_df(os.path.join(results_dir, "FeatureMatrix.tsv"))
+        # missing values are counted while the tables are exported, the tables are not loaded for them
         col1, col2, col3, col4 = st.columns(4)
-        col1.metric("missing values", sum([(df[col] == 0).sum() for col in df.columns]))
-        if use_ffmid:
-            df_requant = open_df(os.path.join(results_dir, "FeatureMatrixRequantified.tsv"))
-            col2.metric("missing values after requantification", sum([(df_requant[col] == 0).sum() for col in df_requant.columns]))
-            st._arrow_table(df_requant)
+        summary = load_summary(os.path.join(results_dir, "FeatureMatrix.tsv"))
+        if summary:
+            col1.metric("missing values", summary["missing values"])
+        if job["kwargs"]["params"]["FeatureFinderMetaboIdent"] or job["kwargs"]["params"].get("Gap filling"):
+            summary = load_summary(os.path.join(results_dir, "FeatureMatrixRequantified.tsv"))
+            if summary:
+                col2.metric("missing values after requantification", summary["missing values"])
+            st._arrow_table(open_df(os.path.join(results_dir, "FeatureMatrixRequantified.tsv")))
         else:
-            st._arrow_table(df) 
+            st._arrow_table(open_df(os.path.join(results_dir, "FeatureMatrix.tsv")))
+    poll("untargeted")
@@ -1,9 +1,9 @@
 import streamlit as st
 import plotly.express as px
-from pyopenms import *
 import os
 import pandas as pd
 from utils.filehandler import get_files
+from utils.decimate import decimate
 
 # TODO deal with multiple file inputs (only problem on Windows?)
 # TODO how to enter path in Windows? raw string? conversion? works with Linux also?
@@ -42,6 +42,8 @@ Simply load the `tsv` files that you stored earlier.
     
     col2.write("")
     num_cols = col2.number_input("columns", 1, 5, 1)
+    max_points = col2.number_input("points per trace", 100, 100000, 2000, 500, help="Chromatograms are reduced to this number of points for plotting, peak maxima are kept.")
+    time_range = col1.slider("time range", 0.0, 1.0, (0.0, 1.0), help="Zoom in to see the chromatograms in full resolution, relative to the time range of each file.")
     cols = st.columns(num_cols)
 
     while all_files:
@@ -55,6 +57,8 @@ Simply load the `tsv` files that you stored earlier.
             if file.endswith(".xlsx"):
                 df = pd.read_excel(file)
 
+            start, end = df["time"].min(), df["time"].max()
+            df = decimate(df[["time"]+all_chroms], max_points, x_range=(start+time_range[0]*(end-start), start+time_range[1]*(end-start)))
             fig = px.line(df, x=df["time"], y=all_chroms, title=file)
             fig.update_layout(xaxis=dict(title="time"), yaxis=dict(title="intensity (cps)"))
             col.plotly_chart(fig)
@@ -0,0 +1,171 @@
+"""Runs the workflows without the Streamlit app, e.g. on cluster nodes.
+
+    python -m batch parameters.yaml
+    python -m batch parameters.json --sample-index 3
+
+The parameter file (YAML or JSON) selects the workflow and holds the settings of its page, settings that are left
+out get the defaults of the page:
+
+    workflow: untargeted            # untargeted, targeted or extract
+    mzML_files: [data/*.mzML]       # files or glob patterns
+    results_dir: results_untargeted
+    workers: 8                      # files processed at the same time (default: all cores)
+    profile: false                  # cProfile statistics per stage in results_dir/profiles
+    params:
+      FeatureFinderMetabo: {noise_threshold_int: 10000}
+      FeatureFinderMetaboIdent: {"extract:mz_window": 5}    # null disables re-quantification
+      Gap filling: {rt_window_sec: 20}   # integrates only the missing values, if FeatureFinderMetaboIdent is null
+
+The other workflows take the remaining arguments of utils.targeted.quantify_files and utils.extraction.extract_files
+(e.g. library, time_unit, masses, tolerance, unit, low_memory, use_cache, ms_level, polarity) as top level keys.
+
+With --sample-index (or inside a SLURM array job, SLURM_ARRAY_TASK_ID) only that mzML file of the sorted list is
+processed into results_dir, which is not cleared first. This is supported for the targeted and extract workflows.
+The untargeted workflow is rejected: map alignment, feature linking and the re-quantification with
+FeatureFinderMetaboIdent need the features of all samples, and there is no step that merges per-sample results.
+Run it as a single task, its workers setting parallelizes the per-file stages on one node.
+"""
+import argparse
+import glob
+import json
+import os
+import sys
+
+UNTARGETED_PARAMS = {
+    "FeatureFinderMetabo": {"noise_threshold_int": 1000.0, "mass_error_ppm": 10.0, "remove_single_traces": "true"},
+    "MapAligner": {"pairfinder:distance_MZ:max_difference": 10.0, "pairfinder:distance_MZ:unit": "ppm",
+                   "pairfinder:distance_RT:max_difference": 100.0},
+    "FeatureFinderMetaboIdent": None,
+    "Gap filling": None,
+    "MetaboliteAdductDecharger": {"potential_adducts": "H:+:0.9\nNa:+:0.1\nH-2O-1:0:0.4\nH-4O-2:0:0.1",
+                                  "charge_min": 1, "charge_max": 3, "negative_mode": "false"},
+    "FeatureLinker": {"link:mz_tol": 10.0, "link:rt_tol": 30.0, "mz_unit": "ppm"},
+    "Sirius": False,
+    "GNPS": False,
+    "MS1 annotation": {"file": "example_data/matchMzRt/standards_pos.tsv", "mz_window_ppm": 10, "rt_window_sec": 60},
+    "AccurateMassSearch": None,
+}
+# defaults of optional steps that are enabled with an empty mapping
+OPTIONAL_PARAMS = {
+    "FeatureFinderMetaboIdent": {"extract:mz_window": 10.0, "detect:peak_width": 60.0, "extract:n_isotopes": 2},
+    "Gap filling": {"mz_window_ppm": 10.0, "rt_window_sec": 30.0},
+    "AccurateMassSearch": {"maps": "example_data/AccurateMassSearch/WTA_maps.tsv", "adducts": "example_data/AccurateMassSearch/positive_adducts.tsv", "mz_window_ppm": 10},
+}
+TARGETED_PARAMS = {"extract:mz_window": 10.0, "detect:peak_width": 60.0, "extract:n_isotopes": 2}
+
+
+def load_parameters(path):
+    with open(path, "r") as f:
+        if path.endswith((".yaml", ".yml")):
+            try:
+                import yaml
+            except ImportError:
+                sys.exit("Reading YAML parameter files needs PyYAML (pip install pyyaml), or use a JSON file.")
+            return yaml.safe_load(f)
+        return json.load(f)
+
+
+def mzML_files(patterns):
+    files = []
+    for pattern in patterns:
+        files += glob.glob(pattern) or [pattern]
+    return sorted(dict.fromkeys(files))
+
+
+def untargeted_params(params):
+    """Page defaults updated with the given parameters, per step."""
+    merged = {}
+    for step, default in UNTARGETED_PARAMS.items():
+        value = params.get(step, default)
+        if isinstance(value, dict):
+            value = {**(default or OPTIONAL_PARAMS.get(step, {})), **value}
+        merged[step] = value
+    return merged
+
+
+def progress(message, fraction=None):
+    if fraction is None:
+        print(message, flush=True)
+    else:
+        print(f"[{fraction*100:3.0f}%] {message}", flush=True)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m batch", description="Run a workflow from a parameter file.")
+    parser.add_argument("parameters", help="YAML or JSON parameter file")
+    parser.add_argument("--sample-index", type=int, default=os.environ.get("SLURM_ARRAY_TASK_ID"),
+                        help="process only this mzML file of the sorted file list (default: $SLURM_ARRAY_TASK_ID), "
+                             "targeted and extract workflows only: the untargeted workflow aligns and links "
+                             "features across all samples and has to run as a single task")
+    args = parser.parse_args(argv)
+
+    config = load_parameters(args.parameters)
+    workflow = config.get("workflow", "untargeted")
+    files = mzML_files(config.get("mzML_files", []))
+    results_dir = config.get("results_dir", "results_"+{"extract": "extractchroms"}.get(workflow, workflow))
+    workers = config.get("workers")
+    profile = config.get("profile", False)
+    if not files:
+        sys.exit("No mzML files given.")
+    if args.sample_index is not None:
+        if workflow == "untargeted":
+            sys.exit("The untargeted workflow runs across all samples, run it without --sample-index.")
+        if not 0 <= int(args.sample_index) < len(files):
+            sys.exit(f"Sample index {args.sample_index} is out of range, there are {len(files)} mzML files "
+                     f"(indices 0 to {len(files)-1}).")
+        files = [files[int(args.sample_index)]]
+
+    if workflow == "untargeted":
+        from utils.untargeted import run_workflow
+        report = run_workflow(files, results_dir, untargeted_params(config.get("params", {})),
+                              force=config.get("force", False), workers=workers, progress=progress, profile=profile)
+        for stage, status in report:
+            print(f"{stage}: {status}")
+        return 0
+
+    if workflow == "targeted":
+        from utils.cache import ResultCache
+        from utils.targeted import quantify_file, quantify_files
+        library = config.get("library", "example_data/FeatureFinderMetaboIdent/standards_pos.tsv")
+        params = {**TARGETED_PARAMS, **config.get("params", {})}
+        time_unit = config.get("time_unit", "seconds")
+        cache = ResultCache() if config.get("use_cache", True) else None
+        if args.sample_index is not None:
+            os.makedirs(results_dir, exist_ok=True)
+            quantify_file(files[0], results_dir, library, params, time_unit, cache)
+            progress("Extracted from: " + os.path.basename(files[0]))
+            return 0
+        result = quantify_files(files, results_dir, library, params, time_unit, cache is not None, workers, progress, profile)
+
+    elif workflow == "extract":
+        from utils.cache import ResultCache
+        from utils.extraction import extract_file, extract_files, parse_targets
+        masses = config.get("masses", "222.0972=GlcNAc\n294.1183=MurNAc")
+        if isinstance(masses, list):
+            masses = "\n".join(str(mass) for mass in masses)
+        unit = config.get("unit", "ppm")
+        tolerance = config.get("tolerance", 10 if unit == "ppm" else 0.02)
+        time_unit = config.get("time_unit", "seconds")
+        low_memory = config.get("low_memory", True)
+        use_cache = config.get("use_cache", True)
+        ms_level = config.get("ms_level", 1)
+        polarity = config.get("polarity", "any")
+        if args.sample_index is not None:
+            os.makedirs(results_dir, exist_ok=True)
+            memory, _ = extract_file(files[0], results_dir, *parse_targets(masses, time_unit), tolerance, unit, time_unit,
+                                  low_memory, ResultCache() if use_cache else None, ms_level, polarity)
+            progress("Extracted from: " + os.path.basename(files[0]) + (f" (peak memory {memory:.0f} MB)" if memory else ""))
+            return 0
+        result = extract_files(files, results_dir, masses, tolerance, unit, time_unit, low_memory, use_cache, workers, progress, profile,
+                               ms_level, polarity)
+
+    else:
+        sys.exit(f"Unknown workflow {workflow}, use untargeted, targeted or extract.")
+
+    for file, error in result["errors"].items():
+        print(f"Extraction failed for {file}: {error}", file=sys.stderr)
+    return 1 if result["errors"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,246 @@
+"""Benchmarks of the hot paths of chromatogram extraction, quantification and annotation.
+
+Synthetic mzML files are generated with pyOpenMS (MS1 spectra with random noise peaks and Gaussian elution
+profiles of the target masses), so the benchmarks run offline. Inputs that are not part of a case (the extracted
+chromatograms of the AUC summary, the consensus table) are prepared beforehand in the main process. Every case
+runs in a fresh spawned process and records its wall time, throughput and the peak memory of that process.
+
+    python benchmarks/hotpaths.py --save-baseline          # store the results as benchmarks/baseline.json
+    python benchmarks/hotpaths.py                          # compare against it, exits with 1 on a regression
+
+A case regresses if it takes more than --tolerance (relative) longer or needs that much more memory than in the
+baseline, it fails without a baseline. The committed baseline was stored with the default sizes on a development
+machine; baselines are machine specific, store a new one with --save-baseline on the machine that runs the
+comparison.
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+BASELINE = os.path.join(ROOT, "benchmarks", "baseline.json")
+
+
+def targets(n, seed=0):
+    rng = np.random.default_rng(seed)
+    masses = np.round(rng.uniform(100, 1000, n), 4)
+    rts = rng.uniform(60, 540, n)
+    return masses, rts
+
+
+def write_mzML(path, scans, peaks, n_targets, seed=0):
+    """mzML file with scans MS1 spectra over 600 s holding peaks noise peaks and the eluting target masses."""
+    from pyopenms import MSExperiment, MSSpectrum, MzMLFile
+    rng = np.random.default_rng(seed)
+    masses, rts = targets(n_targets)
+    exp = MSExperiment()
+    for rt in np.linspace(0, 600, scans):
+        intensity = 1e6 * np.exp(-0.5*((rt - rts)/5)**2)
+        eluting = intensity > 1000
+        mzs = np.concatenate([rng.uniform(100, 1000, peaks), masses[eluting] + rng.normal(0, 0.0005, eluting.sum())])
+        intensities = np.concatenate([rng.uniform(0, 5000, peaks), intensity[eluting]])
+        order = np.argsort(mzs)
+        spec = MSSpectrum()
+        spec.setRT(float(rt))
+        spec.setMSLevel(1)
+        spec.set_peaks((mzs[order], intensities[order].astype(np.float32)))
+        exp.addSpectrum(spec)
+    MzMLFile().store(path, exp)
+
+
+def write_consensusXML(path, samples, features, seed=0):
+    """consensusXML file with features consensus features, each found in a random subset of samples."""
+    from pyopenms import ConsensusMap, ConsensusFeature, ConsensusXMLFile, ColumnHeader, FeatureHandle
+    rng = np.random.default_rng(seed)
+    cmap = ConsensusMap()
+    headers = cmap.getColumnHeaders()
+    for i in range(samples):
+        header = ColumnHeader()
+        header.filename = f"sample{i}.mzML"
+        header.size = features
+        headers[i] = header
+    cmap.setColumnHeaders(headers)
+    for j, (mz, rt) in enumerate(zip(rng.uniform(100, 1000, features), rng.uniform(0, 600, features))):
+        cf = ConsensusFeature()
+        cf.setMZ(float(mz))
+        cf.setRT(float(rt))
+        cf.setCharge(1)
+        for i in np.flatnonzero(rng.random(samples) < 0.8):
+            handle = FeatureHandle()
+            handle.setMapIndex(int(i))
+            handle.setUniqueId(j+1)
+            handle.setMZ(float(mz))
+            handle.setRT(float(rt))
+            handle.setIntensity(float(rng.uniform(1e4, 1e7)))
+            cf.insert(handle)
+        cmap.push_back(cf)
+    cmap.setUniqueIds()
+    ConsensusXMLFile().store(path, cmap)
+
+
+def bench_extract(data, low_memory):
+    from utils.extraction import extract_df
+    masses, _ = targets(data["targets"])
+    start = time.perf_counter()
+    for file in data["mzML"]:
+        extract_df(file, list(masses), [""]*len(masses), [[0, 0]]*len(masses), 10, "ppm", "seconds", low_memory)
+    seconds = time.perf_counter() - start
+    return seconds, {"spectra/s": len(data["mzML"])*data["scans"]/seconds,
+                     "targets/s": len(data["mzML"])*data["targets"]/seconds}
+
+
+def prepare_auc(data):
+    from utils.extraction import extract_file
+    masses, _ = targets(data["targets"])
+    data["chromatograms"] = os.path.join(data["dir"], "extracted")
+    for file in data["mzML"]:
+        extract_file(file, data["chromatograms"], list(masses), [""]*len(masses), [[0, 0]]*len(masses), 10)
+
+
+def bench_auc(data):
+    from utils.chromstore import ChromatogramStore
+    from utils.auc import AUCSummary
+    store = ChromatogramStore(os.path.join(data["chromatograms"], "chromatograms"))
+    chroms = [c for c in store.columns(store.samples()[0]) if c not in ("time", "BPC", "TIC")]
+    start = time.perf_counter()
+    AUCSummary(store, store.samples(), chroms).get(5000)
+    seconds = time.perf_counter() - start
+    return seconds, {"chromatograms/s": len(data["mzML"])*len(chroms)/seconds}
+
+
+def bench_annotate(data):
+    from utils.annotation import annotate
+    rng = np.random.default_rng(1)
+    masses, rts = targets(data["library"], seed=2)
+    library = pd.DataFrame({"name": [f"m{i}" for i in range(len(masses))], "mz": masses, "RT": rts}).sort_values("mz")
+    features = pd.DataFrame({"mz": rng.uniform(100, 1000, data["features"]), "RT": rng.uniform(0, 600, data["features"])})
+    start = time.perf_counter()
+    annotate(features, library, 10, 60)
+    seconds = time.perf_counter() - start
+    return seconds, {"features/s": len(features)/seconds}
+
+
+def prepare_consensus_table(data):
+    from pyopenms import ConsensusMap, ConsensusXMLFile
+    # the tsv file itself is written by pymetabo, only its conversion is measured
+    write_consensusXML(data["consensusXML"], len(data["mzML"]), data["features"])
+    cmap = ConsensusMap()
+    ConsensusXMLFile().load(data["consensusXML"], cmap)
+    data["table"] = os.path.join(data["dir"], "FeatureMatrix.tsv")
+    cmap.to_df().drop(columns=["sequence"]).reset_index().to_csv(data["table"], sep="\t", index=False)
+
+
+def bench_consensus_table(data):
+    from utils.consensus import convert_table
+    start = time.perf_counter()
+    convert_table(data["table"])
+    seconds = time.perf_counter() - start
+    return seconds, {"features/s": data["features"]/seconds}
+
+
+CASES = {
+    "extract streaming": (bench_extract, {"low_memory": True}),
+    "extract in memory": (bench_extract, {"low_memory": False}),
+    "AUC summary": (bench_auc, {}),
+    "MS1 annotation": (bench_annotate, {}),
+    "consensus table": (bench_consensus_table, {}),
+}
+# inputs of a case that are not part of its measurement, prepared in the main process
+PREPARE = {"AUC summary": prepare_auc, "consensus table": prepare_consensus_table}
+
+
+def run_case(name, data):
+    """Runs one case in this (fresh) process, returns its results with the peak memory of the process."""
+    from utils.memory import peak_memory_mb, reset_peak_memory
+    func, kwargs = CASES[name]
+    # the spawned process starts with the peak of the main process
+    reset_peak_memory()
+    seconds, throughput = func(data, **kwargs)
+    return {"seconds": seconds, "peak memory MB": peak_memory_mb(), **throughput}
+
+
+def regressions(results, baseline, tolerance):
+    found = []
+    for name, result in results.items():
+        if name not in baseline or "error" in baseline[name]:
+            continue
+        if "error" in result:
+            found.append(f"{name}: {result['error']}")
+            continue
+        for key in ("seconds", "peak memory MB"):
+            if result[key] and baseline[name][key] and result[key] > baseline[name][key]*(1+tolerance):
+                found.append(f"{name}: {key} {result[key]:.2f} > {baseline[name][key]:.2f} (baseline)")
+    return found
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--files", type=int, default=4, help="number of mzML files")
+    parser.add_argument("--scans", type=int, default=2000, help="MS1 spectra per file")
+    parser.add_argument("--peaks", type=int, default=500, help="noise peaks per spectrum")
+    parser.add_argument("--targets", type=int, default=200, help="target masses for extraction")
+    parser.add_argument("--features", type=int, default=20000, help="consensus features")
+    parser.add_argument("--library", type=int, default=5000, help="MS1 annotation library entries")
+    parser.add_argument("--cases", nargs="*", default=list(CASES), choices=list(CASES))
+    parser.add_argument("--baseline", default=BASELINE)
+    parser.add_argument("--save-baseline", action="store_true", help="store the results as baseline")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed relative slow down or memory increase")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        data = {"dir": directory, "scans": args.scans, "targets": args.targets, "features": args.features,
+                "library": args.library, "mzML": [], "consensusXML": os.path.join(directory, "FeatureMatrix.consensusXML")}
+        print("generating data...")
+        for i in range(args.files):
+            data["mzML"].append(os.path.join(directory, f"sample{i}.mzML"))
+            write_mzML(data["mzML"][-1], args.scans, args.peaks, args.targets, seed=i)
+        for name in args.cases:
+            if name in PREPARE:
+                PREPARE[name](data)
+
+        results = {}
+        for name in args.cases:
+            # a fresh process per case, so the peak memory belongs to that case only. It is spawned, a forked
+            # process would start with the memory of this one
+            with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn")) as executor:
+                try:
+                    results[name] = executor.submit(run_case, name, data).result()
+                except Exception as e:
+                    results[name] = {"error": f"{type(e).__name__}: {e}"}
+            if "error" in results[name]:
+                print(f"{name:<20} skipped, {results[name]['error']}")
+            else:
+                print(f"{name:<20} " + ", ".join(f"{value:.4g} {key}" for key, value in results[name].items() if value is not None))
+
+    sizes = {key: getattr(args, key) for key in ("files", "scans", "peaks", "targets", "features", "library")}
+    if args.save_baseline:
+        with open(args.baseline, "w") as f:
+            json.dump({"sizes": sizes, "results": results}, f, indent=2)
+        print("baseline stored in " + args.baseline)
+        return 0
+    if not os.path.isfile(args.baseline):
+        print("no baseline to compare with at " + args.baseline + ", store one with --save-baseline")
+        return 1
+    with open(args.baseline, "r") as f:
+        baseline = json.load(f)
+    if baseline["sizes"] != sizes:
+        print("baseline was recorded with other data sizes: " + json.dumps(baseline["sizes"]))
+        return 1
+    found = regressions(results, baseline["results"], args.tolerance)
+    for regression in found:
+        print("regression: " + regression)
+    return 1 if found else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
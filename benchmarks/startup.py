@@ -0,0 +1,83 @@
+"""Startup time of the Streamlit app.
+
+Compares a cold start that imports every page module up front (as app.py did before pages were registered as
+"module:function" strings) with the lazy cold start that only imports the Home page, and measures the import
+cost of each page on its own. Every measurement runs in a fresh interpreter, the median of --repeat runs is shown.
+If streamlit.testing is available the first run and the reruns of app.py are timed as well.
+
+    python benchmarks/startup.py --repeat 5
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PAGES = ["apps.home", "apps.extractchroms", "apps.viewchroms", "apps.untargeted", "apps.targeted", "apps.statistics", "apps.testing"]
+
+TIMED = """
+import time
+start = time.perf_counter()
+{code}
+print(time.perf_counter() - start)
+"""
+
+APPTEST = """
+import time
+from streamlit.testing.v1 import AppTest
+at = AppTest.from_file("app.py", default_timeout=600)
+start = time.perf_counter()
+at.run()
+print(time.perf_counter() - start)
+for _ in range({reruns}):
+    start = time.perf_counter()
+    at.run()
+    print(time.perf_counter() - start)
+"""
+
+
+def run(label, code):
+    """Output lines of code run in a fresh interpreter in the repository root, None if it failed."""
+    result = subprocess.run([sys.executable, "-c", code], cwd=ROOT, capture_output=True, text=True)
+    if result.returncode != 0:
+        print(f"{label:<45} failed: " + (result.stderr.strip().splitlines() or ["unknown error"])[-1])
+        return None
+    return [float(line) for line in result.stdout.split()]
+
+
+def timed(label, code, repeat):
+    times = []
+    for _ in range(repeat):
+        out = run(label, TIMED.format(code=code))
+        if out is None:
+            return None
+        times.append(out[0])
+    print(f"{label:<45} {statistics.median(times)*1000:8.0f} ms")
+    return statistics.median(times)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    print("cold start")
+    eager = timed("  all pages imported up front", "import multiapp\n" + "\n".join(f"import {page}" for page in PAGES), args.repeat)
+    lazy = timed("  lazy, Home page only", "import multiapp\nimport apps.home", args.repeat)
+    if eager and lazy:
+        print(f"  {'speed up':<43} {eager/lazy:8.1f} x")
+
+    print("import cost per page")
+    for page in PAGES:
+        timed("  " + page, f"import {page}", args.repeat)
+
+    print("app.py with streamlit.testing")
+    out = run("  app.py", APPTEST.format(reruns=args.repeat))
+    if out is not None:
+        print(f"  {'first run':<43} {out[0]*1000:8.0f} ms")
+        print(f"  {'rerun (median)':<43} {statistics.median(out[1:])*1000:8.0f} ms")
+
+
+if __name__ == "__main__":
+    main()
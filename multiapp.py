@@ -1,5 +1,6 @@
 """Frameworks for running multiple Streamlit applications as a single app.
 """
+import importlib
 import streamlit as st
 
 class MultiApp:
@@ -20,6 +21,9 @@ class MultiApp:
         app.add_app("Foo", foo.app)
         app.add_app("Bar", bar.app)
         app.run()
+    Pages can also be given as "module:function" strings. The module is only imported when its page is
+    selected, so the dependencies of the other pages are not loaded.
+        app.add_app("Foo", "foo:app")
     """
     def __init__(self):
         self.apps = []
@@ -29,7 +33,7 @@ class MultiApp:
         Parameters
         ----------
         func:
-            the python function to render this app.
+            the python function to render this app, or "module:function" to import it when the app is selected.
         title:
             title of the app. Appears in the dropdown in the sidebar.
         """
@@ -46,4 +50,8 @@ class MultiApp:
                 self.apps,
                 format_func=lambda app: app['title'])
 
-        app['function']()
+        func = app['function']
+        if isinstance(func, str):
+            module, name = func.split(":")
+            func = getattr(importlib.import_module(module), name)
+        func()
@@ -0,0 +1,44 @@
+import pandas as pd
+import pytest
+from utils.accuratemass import ELECTRON_MASS, load_search_space, read_adducts, search
+from utils.cache import ResultCache
+
+GLUCOSE = 180.0633881
+HYDROGEN = 1.0078250319
+
+
+@pytest.fixture
+def database(tmp_path):
+    maps, structs, adducts = (str(tmp_path / name) for name in ("mapping.tsv", "struct.tsv", "adducts.tsv"))
+    with open(maps, "w") as f:
+        f.write("database_name\tTestDB\ndatabase_version\t1.0\n180.0634\tC6H12O6\tDB:1\n146.0579\tC5H9NO4\tDB:2\n")
+    with open(structs, "w") as f:
+        f.write("DB:1\tglucose\tC(C1C(C(C(C(O1)O)O)O)O)O\tInChI=1S/C6H12O6\n")
+    with open(adducts, "w") as f:
+        f.write("M+H;1+\n2M-H;1-\nM+2H;2+\n")
+    return maps, structs, adducts
+
+
+def test_read_adducts(database):
+    adducts = {name: (shift, multiplier, charge) for name, shift, multiplier, charge in read_adducts(database[2])}
+    assert adducts["M+H"] == (pytest.approx(HYDROGEN - ELECTRON_MASS), 1, 1)
+    assert adducts["2M-H"] == (pytest.approx(-HYDROGEN + ELECTRON_MASS), 2, -1)
+    assert adducts["M+2H"] == (pytest.approx(2*HYDROGEN - 2*ELECTRON_MASS), 1, 2)
+
+
+def test_search_space_and_search(database, tmp_path):
+    cache = ResultCache(str(tmp_path / "cache"))
+    space = load_search_space(*database, cache=cache)
+    assert len(space) == 6
+    assert space["mz"].is_monotonic_increasing
+    # entries without structure are named by their id
+    assert set(space["name"]) == {"glucose", "DB:2"}
+    glucose = space[space["name"] == "glucose"].set_index("adduct")["mz"]
+    assert glucose["M+H"] == pytest.approx(GLUCOSE + HYDROGEN - ELECTRON_MASS)
+    assert glucose["2M-H"] == pytest.approx(2*GLUCOSE - HYDROGEN + ELECTRON_MASS)
+    assert glucose["M+2H"] == pytest.approx((GLUCOSE + 2*HYDROGEN - 2*ELECTRON_MASS)/2)
+    assert load_search_space(*database, cache=cache).equals(space)
+
+    df = search(pd.DataFrame({"mz": [glucose["M+H"] + 0.0002, 500.0]}), space, 5)
+    assert df["AccurateMassSearch"].tolist() == ["glucose C6H12O6 M+H", ""]
+    assert df["AccurateMassSearch matches"].tolist() == [1, 0]
@@ -0,0 +1,41 @@
+import numpy as np
+import pandas as pd
+from utils.annotation import annotate, load_library, match_mz, save_ms1_ids
+from utils.cache import ResultCache
+
+LIBRARY = pd.DataFrame({"name": ["ADP", "ATP", "ADP#Dimer", "glucose"],
+                        "mz": [426.022, 506.996, 853.051, 179.056],
+                        "RT": [100.0, 110.0, 100.0, 50.0]})
+
+
+def test_match_mz_ppm_window():
+    lib_mz = np.array([100.0, 100.0005, 100.002, 200.0])
+    features, entries = match_mz([100.0, 150.0, 200.001], lib_mz, 10)
+    assert features.tolist() == [0, 0, 2]
+    assert entries.tolist() == [0, 1, 3]
+
+
+def test_annotate():
+    df = pd.DataFrame({"mz": [426.0221, 853.0505, 179.056, 506.996], "RT": [101.0, 99.0, 80.0, 110.0]})
+    df = annotate(df, LIBRARY.sort_values("mz").reset_index(drop=True), 5, 10)
+    assert df["MS1 annotation"].tolist() == ["ADP", "ADP#Dimer", "", "ATP"]
+    assert df["MS1 metabolite"].tolist() == ["ADP", "ADP", "", "ATP"]
+    assert df["MS1 matches"].tolist() == [1, 1, 0, 1]
+
+
+def test_library_is_sorted_and_cached(tmp_path):
+    path = str(tmp_path / "library.tsv")
+    LIBRARY.to_csv(path, sep="\t", index=False)
+    cache = ResultCache(str(tmp_path / "cache"))
+    library = load_library(path, cache)
+    assert library["name"].tolist() == ["glucose", "ADP", "ATP", "ADP#Dimer"]
+    assert len(cache.entries()) == 2
+    assert load_library(path, cache).equals(library)
+
+
+def test_ms1_ids_sum_adducts(tmp_path):
+    table, path = str(tmp_path / "FeatureMatrix.tsv"), str(tmp_path / "MS1-ids.tsv")
+    pd.DataFrame({"MS1 matches": [1, 1, 0], "MS1 metabolite": ["ADP", "ADP", ""],
+                  "a.mzML": [1.0, 2.0, 4.0], "b.mzML": [3.0, 0.0, 5.0]}).to_csv(table, sep="\t", index=False)
+    save_ms1_ids(table, path)
+    assert pd.read_csv(path, sep="\t").values.tolist() == [["ADP", 3.0, 3.0]]
@@ -0,0 +1,20 @@
+import numpy as np
+from utils.auc import auc_matrix
+
+
+def test_auc_matrix():
+    times = [np.array([0.0, 1.0, 2.0]), np.array([0.0, 2.0])]
+    intensities = [np.array([[0.0, 1.0], [2.0, 1.0], [0.0, 1.0]]), np.array([[4.0, 0.0], [4.0, 2.0]])]
+    assert auc_matrix(times, intensities).tolist() == [[2.0, 2.0], [8.0, 2.0]]
+    # the area below the baseline is ignored
+    assert auc_matrix(times, intensities, baseline=1).tolist() == [[1.0, 0.0], [6.0, 1.0]]
+
+
+def test_auc_matrix_empty_samples():
+    empty = (np.array([]), np.zeros((0, 2)))
+    times = [np.array([0.0, 1.0]), np.array([5.0, 6.0])]
+    intensities = [np.array([[1.0, 1.0], [1.0, 1.0]]), np.array([[3.0, 3.0], [3.0, 3.0]])]
+    aucs = auc_matrix([empty[0], times[0], empty[0], times[1], empty[0]],
+                      [empty[1], intensities[0], empty[1], intensities[1], empty[1]])
+    assert aucs.tolist() == [[0.0, 0.0], [1.0, 1.0], [0.0, 0.0], [3.0, 3.0], [0.0, 0.0]]
+    assert auc_matrix([empty[0]], [empty[1]]).tolist() == [[0.0, 0.0]]
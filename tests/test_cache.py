@@ -0,0 +1,54 @@
+import os
+from utils.cache import ResultCache
+
+
+def test_put_and_get(tmp_path):
+    cache = ResultCache(str(tmp_path / "cache"))
+    key = cache.key("sample.mzML", {"tolerance": 10})
+    assert key == cache.key("sample.mzML", {"tolerance": 10}) != cache.key("sample.mzML", {"tolerance": 5})
+    assert cache.get(key) is None
+    with cache.put(key) as directory:
+        with open(os.path.join(directory, "result.txt"), "w") as f:
+            f.write("result")
+    with open(os.path.join(cache.get(key), "result.txt"), "r") as f:
+        assert f.read() == "result"
+
+
+def test_failed_put_leaves_no_entry(tmp_path):
+    cache = ResultCache(str(tmp_path / "cache"))
+    try:
+        with cache.put("ab12") as directory:
+            open(os.path.join(directory, "partial.txt"), "w").close()
+            raise RuntimeError
+    except RuntimeError:
+        pass
+    assert cache.get("ab12") is None
+    assert cache.entries() == []
+
+
+def test_file_hash_follows_content(tmp_path):
+    cache = ResultCache(str(tmp_path / "cache"))
+    path = str(tmp_path / "sample.mzML")
+    with open(path, "w") as f:
+        f.write("a")
+    first = cache.file_hash(path)
+    assert cache.file_hash(path) == first
+    with open(path, "w") as f:
+        f.write("bb")
+    assert cache.file_hash(path) != first
+
+
+def test_evict_includes_hashes(tmp_path):
+    cache = ResultCache(str(tmp_path / "cache"), max_size_mb=0)
+    path = str(tmp_path / "sample.mzML")
+    with open(path, "w") as f:
+        f.write("a")
+    cache.file_hash(path)
+    with cache.put(cache.key("entry")) as directory:
+        with open(os.path.join(directory, "result.txt"), "w") as f:
+            f.write("result")
+    assert len(cache.entries()) == 2
+    assert cache.size_mb() > 0
+    cache.evict()
+    assert cache.entries() == []
+    assert os.listdir(os.path.join(cache.directory, "hashes")) == []
@@ -0,0 +1,109 @@
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pytest
+from pyopenms import ColumnHeader, ConsensusFeature, ConsensusMap, ConsensusXMLFile, FeatureHandle
+from utils.consensus import column_headers, convert_table, export_metadata, load_summary, write_consensus_table
+from utils.matrix import arrow_path, load_matrix
+
+SAMPLES = ["a.mzML", "b.mzML", "c.mzML"]
+# intensity per sample of every consensus feature, 0 is a missing value
+INTENSITIES = np.array([[1e5, 2e5, 3e5],
+                        [4e5, 0, 6e5],
+                        [0, 0, 9e5],
+                        [1e6, 2e6, 3e6],
+                        [5e4, 6e4, 0]])
+
+
+def write_consensusXML(path):
+    cmap = ConsensusMap()
+    headers = cmap.getColumnHeaders()
+    for i, sample in enumerate(SAMPLES):
+        header = ColumnHeader()
+        header.filename = sample
+        header.size = len(INTENSITIES)
+        headers[i] = header
+    cmap.setColumnHeaders(headers)
+    for j, row in enumerate(INTENSITIES):
+        cf = ConsensusFeature()
+        cf.setMZ(100.0 + j)
+        cf.setRT(60.0 * (j+1))
+        cf.setCharge(1)
+        for i in np.flatnonzero(row):
+            handle = FeatureHandle()
+            handle.setMapIndex(int(i))
+            handle.setUniqueId(10*j + int(i) + 1)
+            handle.setMZ(100.0 + j)
+            handle.setRT(60.0 * (j+1))
+            handle.setIntensity(float(row[i]))
+            cf.insert(handle)
+        cmap.push_back(cf)
+    cmap.setUniqueIds()
+    ConsensusXMLFile().store(path, cmap)
+
+
+def write_tsv(path):
+    """Feature matrix tsv file with metadata columns and one intensity column per sample."""
+    df = pd.DataFrame({"id": np.arange(len(INTENSITIES)) + 1, "metabolite": [f"{100.0 + j}@{60.0 * (j+1)}" for j in range(5)],
+                       "charge": 1, "RT": 60.0 * np.arange(1, 6), "mz": 100.0 + np.arange(5),
+                       # no adduct in the first chunk
+                       "adduct": [None, None, "[M+H]+", None, "[M+Na]+"]})
+    df[SAMPLES] = INTENSITIES
+    df.to_csv(path, sep="\t", index=False)
+    return df
+
+
+def test_convert_table(tmp_path):
+    table = str(tmp_path / "FeatureMatrix.tsv")
+    df = write_tsv(table)
+    # chunks smaller than the table to write several batches
+    summary = convert_table(table, chunk_rows=2)
+
+    arrow = pa.ipc.open_file(pa.memory_map(arrow_path(table), "r")).read_all()
+    assert arrow.column_names == list(df.columns)
+    assert arrow.schema.field("adduct").type == pa.string()
+    assert arrow.schema.field("id").type == pa.int64()
+    assert arrow["adduct"].to_pylist() == [None, None, "[M+H]+", None, "[M+Na]+"]
+    arrow = arrow.to_pandas()
+    np.testing.assert_allclose(arrow[SAMPLES].to_numpy(), INTENSITIES)
+    assert arrow["metabolite"].tolist() == df["metabolite"].tolist()
+
+    assert summary == load_summary(table)
+    assert summary["features"] == 5
+    assert summary["complete features"] == 2
+    assert summary["missing values"] == 4
+    assert summary["missing values per sample"] == {"a.mzML": 1, "b.mzML": 2, "c.mzML": 1}
+    # the Arrow file written next to the tsv is used by the result pages
+    np.testing.assert_allclose(load_matrix(table, SAMPLES).to_numpy(), INTENSITIES)
+
+
+def test_convert_empty_table(tmp_path):
+    table = str(tmp_path / "empty.tsv")
+    pd.DataFrame(columns=["id", "mz", "a.mzML"]).to_csv(table, sep="\t", index=False)
+    summary = convert_table(table)
+    assert summary["features"] == 0
+    assert summary["missing values per sample"] == {"a.mzML": 0}
+    assert pa.ipc.open_file(pa.memory_map(arrow_path(table), "r")).schema.names == ["id", "mz", "a.mzML"]
+
+
+def test_write_consensus_table(tmp_path):
+    # the table layout is the one of pymetabo's builder
+    pytest.importorskip("pymetabo")
+    consensusXML = str(tmp_path / "FeatureMatrix.consensusXML")
+    table = str(tmp_path / "FeatureMatrix.tsv")
+    write_consensusXML(consensusXML)
+    summary = write_consensus_table(consensusXML, table, chunk_rows=2)
+    tsv = pd.read_csv(table, sep="\t")
+    np.testing.assert_allclose(tsv[SAMPLES].to_numpy(), INTENSITIES)
+    np.testing.assert_allclose(load_matrix(table, SAMPLES).to_numpy(), INTENSITIES)
+    assert summary["missing values"] == 4
+
+
+def test_metadata(tmp_path):
+    consensusXML = str(tmp_path / "FeatureMatrix.consensusXML")
+    write_consensusXML(consensusXML)
+    assert column_headers(consensusXML) == dict(enumerate(SAMPLES))
+    export_metadata(consensusXML, tmp_path / "MetaData.tsv")
+    df = pd.read_csv(tmp_path / "MetaData.tsv", sep="\t", index_col=0)
+    assert list(df["filename"]) == SAMPLES
+    assert list(df["ATTRIBUTE_MAPID"]) == ["MAP0", "MAP1", "MAP2"]
@@ -0,0 +1,29 @@
+import numpy as np
+import pandas as pd
+from utils.decimate import decimate
+
+
+def test_extremes_keep_their_time():
+    time = np.arange(1000, dtype=float)
+    df = pd.DataFrame({"time": time, "a": np.exp(-(time-503)**2/2), "b": np.exp(-(time-250)**2/2)})
+    result = decimate(df, max_points=100)
+    assert len(result) < len(df)
+    assert result.loc[result["a"].idxmax(), "time"] == 503
+    assert result.loc[result["b"].idxmax(), "time"] == 250
+    assert result["a"].max() == 1 and result["b"].max() == 1
+
+
+def test_single_trace_points_are_its_own():
+    rng = np.random.default_rng(0)
+    df = pd.DataFrame({"time": np.linspace(0, 60, 5000), "TIC": rng.uniform(0, 1, 5000)})
+    result = decimate(df, max_points=200)
+    assert len(result) <= 200
+    merged = result.merge(df, on="time", suffixes=("", " original"))
+    assert len(merged) == len(result)
+    assert (merged["TIC"] == merged["TIC original"]).all()
+
+
+def test_x_range_and_small_frames():
+    df = pd.DataFrame({"time": np.arange(10.0), "a": np.arange(10.0)})
+    assert decimate(df, max_points=100).equals(df)
+    assert decimate(df, max_points=100, x_range=(2, 5))["time"].tolist() == [2, 3, 4, 5]
@@ -0,0 +1,118 @@
+import numpy as np
+import pandas as pd
+import pytest
+from pyopenms import IonSource, MSSpectrum, MSExperiment, MzMLFile
+from utils.cache import ResultCache
+import utils.extraction
+from utils.extraction import (cached_extract_df, extract_df, extract_windows, indexed_chromatograms, parse_targets,
+                              stream_chromatograms)
+from utils.scanindex import build_scan_index, scan_index, scans_in_windows, select_scans
+
+MASSES = [150.05, 320.1, 501.2]
+# elution apex of each target in s
+APEX = [100.0, 250.0, 400.0]
+
+
+def spectrum(rt, rng, ms_level=1):
+    spec = MSSpectrum()
+    spec.setRT(float(rt))
+    spec.setMSLevel(ms_level)
+    intensity = 1e6 * np.exp(-0.5*((rt - np.array(APEX))/5)**2)
+    mzs = np.concatenate([rng.uniform(100, 600, 50), MASSES])
+    intensities = np.concatenate([rng.uniform(0, 5000, 50), intensity])
+    order = np.argsort(mzs)
+    spec.set_peaks((mzs[order], intensities[order].astype(np.float32)))
+    return spec
+
+
+@pytest.fixture
+def mzML(tmp_path):
+    rng = np.random.default_rng(0)
+    exp = MSExperiment()
+    for rt in np.arange(0, 500, 1.0):
+        exp.addSpectrum(spectrum(rt, rng))
+    path = str(tmp_path / "sample.mzML")
+    MzMLFile().store(path, exp)
+    return path
+
+
+@pytest.fixture
+def mixed_mzML(tmp_path):
+    """Positive and negative MS1 spectra with an MS2 spectrum after each, the negative ones at odd seconds."""
+    rng = np.random.default_rng(1)
+    exp = MSExperiment()
+    for rt in np.arange(0, 500, 1.0):
+        for ms_level in (1, 2):
+            spec = spectrum(rt + ms_level/10, rng, ms_level)
+            settings = spec.getInstrumentSettings()
+            settings.setPolarity(IonSource.Polarity.NEGATIVE if rt % 2 else IonSource.Polarity.POSITIVE)
+            spec.setInstrumentSettings(settings)
+            exp.addSpectrum(spec)
+    path = str(tmp_path / "mixed.mzML")
+    MzMLFile().store(path, exp)
+    return path
+
+
+def test_scans_in_windows():
+    rt = np.array([3.0, 1.0, 2.0, 5.0, 4.0])
+    windows = scans_in_windows(rt, [(1.5, 4.5), (0, 1), (10, 20)])
+    assert [list(w) for w in windows] == [[0, 2, 4], [], []]
+
+
+def test_windows_match_streaming(mzML):
+    masses, names, times = parse_targets("150.05=a=90-110\n320.1=b=0-500\n501.2=c=300-350")
+    index = build_scan_index(mzML)
+    streamed = extract_df(mzML, masses, names, times, 10)
+    eics = extract_windows(mzML, index, masses, times, 10)
+    np.testing.assert_array_equal(eics, streamed[[str(m)+"_"+n for m, n in zip(masses, names)]].to_numpy())
+    # the window of c holds no peak of it
+    assert eics[:, 2].max() < 5000
+    assert streamed["150.05_a"].max() > 9e5
+
+
+def test_cached_windows_match_streaming(mzML, tmp_path, monkeypatch):
+    windowed = []
+    monkeypatch.setattr(utils.extraction, "extract_windows", lambda *args, **kwargs: windowed.append(args[3]) or
+                        extract_windows(*args, **kwargs))
+    cache = ResultCache(str(tmp_path / "cache"))
+    masses, names, times = parse_targets("150.05=a\n320.1=b")
+    cached_extract_df(cache, mzML, masses, names, times, 10)
+    assert scan_index(mzML, cache) is not None
+    # time and BPC are cached now, the RT limited targets are only read from the spectra in their windows
+    masses, names, times = parse_targets("150.05=a=90-110\n501.2=c=390-410")
+    cached = cached_extract_df(cache, mzML, masses, names, times, 10)
+    assert windowed == [times]
+    pd.testing.assert_frame_equal(cached, extract_df(mzML, masses, names, times, 10), check_dtype=False)
+    pd.testing.assert_frame_equal(cached_extract_df(cache, mzML, masses, names, times, 10), cached)
+
+
+def test_select_scans(mixed_mzML):
+    index = build_scan_index(mixed_mzML)
+    assert len(select_scans(index, 1)) == len(select_scans(index, 2)) == 500
+    positive = select_scans(index, 1, "positive")
+    assert len(positive) == 250
+    np.testing.assert_array_equal(index["rt"][positive], np.arange(0, 500, 2.0) + 0.1)
+    np.testing.assert_array_equal(index["rt"][select_scans(index, 2, "negative")], np.arange(1, 500, 2.0) + 0.2)
+
+
+@pytest.mark.parametrize("ms_level, polarity", [(1, "any"), (1, "positive"), (1, "negative"), (2, "any"), (2, "negative")])
+def test_index_matches_streaming(mixed_mzML, tmp_path, ms_level, polarity):
+    masses, names, times = parse_targets("150.05=a\n320.1=b=200-300\n501.2=c")
+    index = build_scan_index(mixed_mzML)
+    streamed = stream_chromatograms(mixed_mzML, masses, names, times, 10, ms_level=ms_level, polarity=polarity)
+    expected = index["rt"][select_scans(index, ms_level, polarity)]
+    np.testing.assert_allclose(streamed["time"], expected)
+    assert streamed["320.1_b"].max() > 9e5
+    pd.testing.assert_frame_equal(indexed_chromatograms(mixed_mzML, index, masses, names, times, 10, ms_level=ms_level,
+                                                        polarity=polarity), streamed)
+    pd.testing.assert_frame_equal(extract_df(mixed_mzML, masses, names, times, 10, low_memory=False, ms_level=ms_level,
+                                             polarity=polarity), streamed)
+    cache = ResultCache(str(tmp_path / "cache"))
+    pd.testing.assert_frame_equal(cached_extract_df(cache, mixed_mzML, masses, names, times, 10, ms_level=ms_level,
+                                                    polarity=polarity), streamed, check_dtype=False)
+    # once the file is cached the RT limited target is extracted through the index
+    masses, names, times = parse_targets("501.2=d=350-450")
+    pd.testing.assert_frame_equal(cached_extract_df(cache, mixed_mzML, masses, names, times, 10, ms_level=ms_level,
+                                                    polarity=polarity),
+                                  stream_chromatograms(mixed_mzML, masses, names, times, 10, ms_level=ms_level,
+                                                       polarity=polarity), check_dtype=False)
@@ -0,0 +1,118 @@
+import os
+import numpy as np
+import pytest
+from pyopenms import (ColumnHeader, ConsensusFeature, ConsensusMap, ConsensusXMLFile, FeatureHandle, MSExperiment,
+                      MSSpectrum, MzMLFile, TransformationDescription, TransformationXMLFile)
+from utils.gapfill import fill_gaps, missing_cells
+from utils.workspace import trafo_file
+
+# Gaussian elution profiles with sigma 5 s and height 1e6
+AREA = 1e6 * 5 * np.sqrt(2*np.pi)
+# (mz, RT) of the consensus features, the third one has no signal in any file
+FEATURES = [(300.0, 200.0), (450.0, 350.0), (600.0, 450.0)]
+
+
+def write_mzML(path, rt_shift=0.0):
+    exp = MSExperiment()
+    for rt in np.arange(0, 600, 0.5):
+        spec = MSSpectrum()
+        spec.setRT(float(rt + rt_shift))
+        spec.setMSLevel(1)
+        mzs = np.array([mz for mz, _ in FEATURES[:2]])
+        intensities = np.array([1e6 * np.exp(-0.5*((rt - feature_rt)/5)**2) for _, feature_rt in FEATURES[:2]])
+        spec.set_peaks((mzs, intensities.astype(np.float32)))
+        exp.addSpectrum(spec)
+    MzMLFile().store(path, exp)
+
+
+def write_consensusXML(path, found):
+    """Consensus map of samples a and b, found[j] are the map indices holding feature j."""
+    cmap = ConsensusMap()
+    headers = cmap.getColumnHeaders()
+    for i, sample in enumerate(["a.mzML", "b.mzML"]):
+        header = ColumnHeader()
+        header.filename = sample
+        headers[i] = header
+    cmap.setColumnHeaders(headers)
+    for j, ((mz, rt), maps) in enumerate(zip(FEATURES, found)):
+        cf = ConsensusFeature()
+        cf.setMZ(mz)
+        cf.setRT(rt)
+        for i in maps:
+            handle = FeatureHandle()
+            handle.setMapIndex(i)
+            handle.setUniqueId(10*j + i + 1)
+            handle.setMZ(mz)
+            handle.setRT(rt)
+            handle.setIntensity(AREA)
+            cf.insert(handle)
+        cmap.push_back(cf)
+    cmap.setUniqueIds()
+    ConsensusXMLFile().store(path, cmap)
+
+
+@pytest.fixture
+def workspace(tmp_path):
+    mzML_dir = tmp_path / "mzML"
+    mzML_dir.mkdir()
+    write_mzML(str(mzML_dir / "a.mzML"))
+    write_mzML(str(mzML_dir / "b.mzML"))
+    consensusXML = str(tmp_path / "FeatureMatrix.consensusXML")
+    write_consensusXML(consensusXML, [[0], [0, 1], [0, 1]])
+    return tmp_path, str(mzML_dir), consensusXML
+
+
+def filled_table(tmp_path, consensusXML, mzML_dir, trafo_dir=None):
+    out = str(tmp_path / "FeatureMatrixGapFilled.consensusXML")
+    fill_gaps(consensusXML, mzML_dir, trafo_dir, out, workers=1)
+    cmap = ConsensusMap()
+    ConsensusXMLFile().load(out, cmap)
+    return cmap.get_intensity_df().reset_index(drop=True)
+
+
+def test_missing_cells(workspace):
+    _, _, consensusXML = workspace
+    cells = missing_cells(consensusXML)
+    assert len(cells["a.mzML"]) == 0
+    np.testing.assert_allclose(cells["b.mzML"], [[0, 300.0, 200.0]])
+
+
+def test_fill_gaps(workspace):
+    tmp_path, mzML_dir, consensusXML = workspace
+    write_consensusXML(consensusXML, [[0], [0, 1], [0]])
+    df = filled_table(tmp_path, consensusXML, mzML_dir)
+    # the missing cell of feature 0 is integrated, feature 2 has no signal and stays missing
+    assert df["b.mzML"][0] == pytest.approx(AREA, rel=0.01)
+    assert df["b.mzML"][1] == pytest.approx(AREA)
+    assert df["b.mzML"][2] == 0
+    np.testing.assert_allclose(df["a.mzML"], AREA)
+
+
+def test_fill_gaps_aligned(workspace):
+    tmp_path, mzML_dir, consensusXML = workspace
+    # sample b elutes 20 s later, its transformation maps it back to the consensus retention times
+    write_mzML(os.path.join(mzML_dir, "b.mzML"), rt_shift=20.0)
+    trafo_dir = tmp_path / "Trafo"
+    trafo_dir.mkdir()
+    for sample, shift in (("a", 0.0), ("b", 20.0)):
+        trafo = TransformationDescription()
+        trafo.setDataPoints([(rt + shift, rt) for rt in (0.0, 300.0, 600.0)])
+        trafo.fitModel("linear")
+        TransformationXMLFile().store(str(trafo_dir / (sample+".trafoXML")), trafo)
+    df = filled_table(tmp_path, consensusXML, mzML_dir, str(trafo_dir))
+    assert df["b.mzML"][0] == pytest.approx(AREA, rel=0.01)
+    # without alignment the window of 30 s around RT 200 s only holds the rising edge of the peak
+    assert filled_table(tmp_path, consensusXML, mzML_dir)["b.mzML"][0] < AREA/2
+
+    os.remove(trafo_dir / "b.trafoXML")
+    with pytest.raises(FileNotFoundError):
+        trafo_file(str(trafo_dir), os.path.join(mzML_dir, "b.mzML"))
+    with pytest.raises(RuntimeError):
+        fill_gaps(consensusXML, mzML_dir, str(trafo_dir), str(tmp_path / "out.consensusXML"), workers=1)
+
+
+def test_missing_mzML(workspace):
+    tmp_path, mzML_dir, consensusXML = workspace
+    os.remove(os.path.join(mzML_dir, "b.mzML"))
+    with pytest.raises(FileNotFoundError):
+        fill_gaps(consensusXML, mzML_dir, None, str(tmp_path / "out.consensusXML"), workers=1)
@@ -0,0 +1,96 @@
+import os
+import sys
+import time
+import pytest
+from utils.jobs import JobQueue, run_job, write_job
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+FUNCTIONS = '''
+import time
+
+
+def double(value, progress):
+    progress("doubling", 0.5)
+    return 2*value
+
+
+def fail(progress):
+    raise ValueError("no input")
+
+
+def wait(seconds, progress):
+    time.sleep(seconds)
+'''
+
+
+@pytest.fixture
+def queue(tmp_path, monkeypatch):
+    """JobQueue whose job processes can import the functions above and the utils package."""
+    with open(tmp_path / "jobfunctions.py", "w") as f:
+        f.write(FUNCTIONS)
+    monkeypatch.setenv("PYTHONPATH", os.pathsep.join([str(tmp_path), ROOT]))
+    monkeypatch.chdir(ROOT)
+    return JobQueue(str(tmp_path / "jobs"), max_running=1)
+
+
+def wait_for(queue, job_id, timeout=60):
+    start = time.time()
+    while queue.job(job_id)["status"] in ("queued", "starting", "running"):
+        assert time.time() - start < timeout
+        time.sleep(0.1)
+    return queue.job(job_id)
+
+
+def test_job_result_and_progress(queue):
+    job = wait_for(queue, queue.submit("test", "jobfunctions:double", value=21))
+    assert job["status"] == "done"
+    assert job["result"] == 42
+    assert [message for _, message, _ in job["progress"]] == ["doubling"]
+
+
+def test_failed_job(queue):
+    job_id = queue.submit("test", "jobfunctions:fail")
+    job = wait_for(queue, job_id)
+    assert job["status"] == "failed"
+    assert job["error"] == "ValueError: no input"
+    assert "ValueError" in queue.log(job_id)
+    queue.remove(job_id)
+    assert queue.jobs() == []
+
+
+def test_queued_jobs_start_when_one_finishes(queue):
+    first = queue.submit("test", "jobfunctions:wait", seconds=1)
+    second = queue.submit("other", "jobfunctions:double", value=1)
+    assert queue.job(second)["status"] == "queued"
+    assert [job["id"] for job in queue.active("other")] == [second]
+    assert wait_for(queue, first)["status"] == "done"
+    assert wait_for(queue, second)["status"] == "done"
+    assert [job["id"] for job in queue.jobs()] == [first, second]
+
+
+def test_killed_job_is_interrupted(queue, monkeypatch):
+    monkeypatch.setattr("utils.jobs.STALE_SEC", 0)
+    path = os.path.join(queue.directory, "killed")
+    os.makedirs(path)
+    write_job(path, {"id": "killed", "kind": "test", "status": "running", "created": 0, "heartbeat": 0,
+                     "pid": None})
+    assert queue.job("killed")["status"] == "interrupted"
+    # alive processes keep running without heartbeat
+    write_job(path, {"id": "killed", "kind": "test", "status": "running", "created": 0, "heartbeat": 0,
+                     "pid": os.getpid()})
+    assert queue.job("killed")["status"] == "running"
+
+
+def test_run_job_in_process(queue, tmp_path):
+    sys.path.insert(0, str(tmp_path))
+    try:
+        path = os.path.join(queue.directory, "inline")
+        os.makedirs(path)
+        write_job(path, {"id": "inline", "kind": "test", "func": "jobfunctions:double", "kwargs": {"value": 2},
+                         "status": "starting", "created": time.time(), "heartbeat": None, "progress": []})
+        run_job(path)
+    finally:
+        sys.path.remove(str(tmp_path))
+    job = queue.job("inline")
+    assert (job["status"], job["result"], job["pid"]) == ("done", 4, os.getpid())
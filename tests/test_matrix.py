@@ -0,0 +1,23 @@
+import pandas as pd
+from utils.matrix import arrow_path, load_matrix, write_table
+
+
+def test_rewrite_keeps_loaded_frames(tmp_path):
+    table = str(tmp_path / "FeatureMatrix.tsv")
+    write_table(pd.DataFrame({"metabolite": ["a", "b"], "sample": [1.0, 2.0]}), table)
+    before = load_matrix(table)
+    write_table(pd.DataFrame({"metabolite": ["long name " * 10] * 5, "sample": [3.0] * 5}), table)
+    # frames are views of the memory-mapped file, which is replaced instead of rewritten
+    assert before.values.tolist() == [["a", 1.0], ["b", 2.0]]
+
+
+def test_sidecar_per_extension(tmp_path):
+    assert arrow_path(str(tmp_path / "FeatureMatrix.tsv")) != arrow_path(str(tmp_path / "FeatureMatrix.xlsx"))
+
+
+def test_reload_after_rewrite(tmp_path):
+    table = str(tmp_path / "FeatureMatrix.tsv")
+    write_table(pd.DataFrame({"metabolite": ["a"], "sample": [1.0]}), table)
+    assert load_matrix(table, ["sample"])["sample"].tolist() == [1.0]
+    write_table(pd.DataFrame({"metabolite": ["a", "b"], "sample": [2.0, 3.0]}), table)
+    assert load_matrix(table, ["sample"])["sample"].tolist() == [2.0, 3.0]
@@ -0,0 +1,58 @@
+import subprocess
+import sys
+import time
+from pyopenms import ConsensusFeature, ConsensusMap, ConsensusXMLFile, Feature, FeatureMap, FeatureXMLFile
+import utils.metrics
+from utils.memory import MemorySampler, process_tree_memory_mb
+from utils.metrics import Metrics, count_items, load_metrics
+
+
+def test_count_items(tmp_path, monkeypatch):
+    fm = FeatureMap()
+    for i in range(3):
+        feature = Feature()
+        feature.setUniqueId(i+1)
+        fm.push_back(feature)
+    FeatureXMLFile().store(str(tmp_path / "a.featureXML"), fm)
+    cmap = ConsensusMap()
+    for i in range(7):
+        cmap.push_back(ConsensusFeature())
+    cmap.setUniqueIds()
+    ConsensusXMLFile().store(str(tmp_path / "a.consensusXML"), cmap)
+    # chunks shorter than the tag must not miss or double count elements
+    monkeypatch.setattr(utils.metrics, "CHUNK_BYTES", 5)
+    assert count_items(str(tmp_path / "a.consensusXML")) == {"consensus features": 7}
+    monkeypatch.undo()
+    assert count_items(str(tmp_path)) == {"features": 3, "consensus features": 7}
+    assert count_items(str(tmp_path / "missing")) == {}
+
+
+def test_stage(tmp_path):
+    metrics = Metrics(str(tmp_path / "metrics.json"))
+    out = tmp_path / "out.consensusXML"
+    with metrics.stage("link", [], [str(out)]) as stage:
+        cmap = ConsensusMap()
+        cmap.push_back(ConsensusFeature())
+        cmap.setUniqueIds()
+        ConsensusXMLFile().store(str(out), cmap)
+        stage["items"]["maps"] = 2
+    with metrics.stage("link", status="reused"):
+        pass
+    stages = load_metrics(str(tmp_path / "metrics.json"))
+    assert [s["status"] for s in stages] == ["computed", "reused"]
+    assert stages[0]["items"] == {"input files": 0, "maps": 2, "consensus features": 1}
+    assert stages[0]["bytes written"] == out.stat().st_size
+
+
+def test_memory_of_children():
+    before = process_tree_memory_mb()
+    if before is None:
+        return
+    child = subprocess.Popen([sys.executable, "-c", "import time; b = b'x' * (200*1024**2); time.sleep(5)"])
+    try:
+        with MemorySampler(0.05) as sampler:
+            time.sleep(1.5)
+    finally:
+        child.kill()
+        child.wait()
+    assert sampler.peak > before + 150
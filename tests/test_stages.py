@@ -0,0 +1,59 @@
+import os
+import pytest
+from utils.stages import Pipeline
+
+
+def write(path, text):
+    with open(path, "w") as f:
+        f.write(text)
+
+
+def copy(source, target, suffix="", workers=1):
+    with open(source, "r") as f:
+        write(target, f.read() + suffix)
+
+
+def stages(directory, source, suffix="", **kwargs):
+    """Two chained stages source -> a -> b, returns the report of a fresh Pipeline."""
+    pipeline = Pipeline(str(directory / "interim"), **kwargs)
+    a, b = str(directory / "a.txt"), str(directory / "b.txt")
+    pipeline.run("a", [source], [a], copy, source, a, suffix)
+    pipeline.run("b", [a], [b], copy, a, b, workers=4)
+    return pipeline.report
+
+
+def test_reuse_unchanged_stages(tmp_path):
+    source = str(tmp_path / "source.txt")
+    write(source, "x")
+    assert stages(tmp_path, source) == [("a", "computed"), ("b", "computed")]
+    assert stages(tmp_path, source) == [("a", "reused"), ("b", "reused")]
+    assert stages(tmp_path, source, force=True) == [("a", "computed"), ("b", "computed")]
+
+
+def test_changes_propagate_downstream(tmp_path):
+    source = str(tmp_path / "source.txt")
+    write(source, "x")
+    stages(tmp_path, source)
+    # changed arguments
+    assert stages(tmp_path, source, "y") == [("a", "computed"), ("b", "computed")]
+    with open(tmp_path / "b.txt", "r") as f:
+        assert f.read() == "xy"
+    # changed input file
+    write(source, "xx")
+    os.utime(source, (0, 0))
+    assert stages(tmp_path, source, "y") == [("a", "computed"), ("b", "computed")]
+    # missing output of the last stage only
+    os.remove(tmp_path / "b.txt")
+    assert stages(tmp_path, source, "y") == [("a", "reused"), ("b", "computed")]
+
+
+def test_failed_stage_runs_again(tmp_path):
+    def fail():
+        write(str(tmp_path / "out.txt"), "partial")
+        raise RuntimeError
+
+    pipeline = Pipeline(str(tmp_path / "interim"))
+    with pytest.raises(RuntimeError):
+        pipeline.run("fail", [], [str(tmp_path / "out.txt")], fail)
+    pipeline = Pipeline(str(tmp_path / "interim"))
+    assert pipeline.run("fail", [], [str(tmp_path / "out.txt")], write, str(tmp_path / "out.txt"), "done")
@@ -0,0 +1,44 @@
+import numpy as np
+import pandas as pd
+import pytest
+from scipy import stats
+from utils.statistics import FeatureStatistics, fdr, normalize, replicate_groups, welch_t_test
+
+
+def test_welch_t_test_matches_scipy():
+    rng = np.random.default_rng(0)
+    a, b = rng.normal(10, 1, (50, 3)), rng.normal(11, 3, (50, 4))
+    expected = stats.ttest_ind(a, b, axis=1, equal_var=False).pvalue
+    assert welch_t_test(a, b) == pytest.approx(expected)
+    assert np.isnan(welch_t_test(a, b[:, :1])).all()
+
+
+def test_fdr_matches_scipy():
+    p_values = np.random.default_rng(1).uniform(0, 0.1, 40)
+    assert fdr(p_values)[:, 0] == pytest.approx(stats.false_discovery_control(p_values, method="bh"))
+    # NaN p-values are left out of the ranking
+    with_nan = np.concatenate([p_values, [np.nan]])
+    assert np.isnan(fdr(with_nan)[-1, 0])
+    assert fdr(with_nan)[:-1, 0] == pytest.approx(fdr(p_values)[:, 0])
+
+
+def test_replicates_and_normalization():
+    groups = replicate_groups(["a#1.mzML", "a#2.mzML", "b.mzML"])
+    assert {name: list(indices) for name, indices in groups.items()} == {"a": [0, 1], "b.mzML": [2]}
+    values = np.array([[1.0, 0.0], [-4.0, 0.0]])
+    assert normalize(values, "per sample").tolist() == [[0.25, 0.0], [-1.0, 0.0]]
+    assert normalize(values, "across feature map").tolist() == [[0.25, 0.0], [-1.0, 0.0]]
+    assert normalize(values, "do not").tolist() == values.tolist()
+
+
+def test_compare_is_memoized():
+    df = pd.DataFrame({"a#1": [1.0, 4.0], "a#2": [3.0, 4.0], "b#1": [1.0, 1.0], "b#2": [1.0, 1.0]}, index=["x", "y"])
+    statistics = FeatureStatistics(df)
+    means, stds, changes, p_values, q_values = statistics.compare([("a", "b")])
+    assert means.to_dict("list") == {"a": [2.0, 4.0], "b": [1.0, 1.0]}
+    assert changes["a/b"].tolist() == [1.0, 2.0]
+    assert stds.loc["x", "a"] == pytest.approx(np.sqrt(2))
+    assert q_values.shape == p_values.shape == (2, 1)
+    assert statistics.compare([("a", "b")])[0] is means
+    # groups that do not exist are left out
+    assert list(statistics.compare([("a", "c")])[2].columns) == []
@@ -0,0 +1,88 @@
+"""Accurate mass search of consensus features against the AccurateMassSearch databases.
+
+A database consists of a mapping file (header lines `database_name` and `database_version`, then
+`mass<TAB>formula<TAB>id` rows), a structure file (`id<TAB>name<TAB>SMILES<TAB>InChI`) and an adduct file with one
+adduct per line, e.g. `M+H;1+` or `2M-H;1-`. The m/z values of all formula and adduct combinations are computed
+once per database version and adduct list, sorted and kept in the ResultCache.
+"""
+import os
+import re
+import numpy as np
+import pandas as pd
+from pyopenms import EmpiricalFormula
+from utils.cache import ResultCache
+from utils.annotation import match_mz
+from utils.matrix import write_table
+
+ELECTRON_MASS = 0.00054857990946
+
+
+def read_adducts(path):
+    """List of (name, mass shift per molecule multiplier, multiplier, charge) from an adduct file."""
+    adducts = []
+    with open(path, "r") as f:
+        for line in [line.strip() for line in f if line.strip()]:
+            name, charge = line.split(";")
+            charge = int(charge[:-1] or 1) * (-1 if charge.endswith("-") else 1)
+            multiplier, groups = re.match(r"^(\d*)M(.*)$", name).groups()
+            shift = 0.0
+            for sign, count, formula in re.findall(r"([+-])(\d*)([A-Za-z0-9]+)", groups):
+                mass = int(count or 1) * EmpiricalFormula(formula).getMonoWeight()
+                shift += mass if sign == "+" else -mass
+            adducts.append((name, shift - charge*ELECTRON_MASS, int(multiplier or 1), charge))
+    return adducts
+
+
+def read_database(maps, structs):
+    """DataFrame with id, formula, name and neutral monoisotopic mass of every database entry."""
+    header = {}
+    rows = []
+    with open(maps, "r") as f:
+        for line in f:
+            fields = line.rstrip("\n").split("\t")
+            if fields[0] in ("database_name", "database_version"):
+                header[fields[0]] = fields[1]
+            elif len(fields) >= 3:
+                rows.append((fields[2], fields[1]))
+    df = pd.DataFrame(rows, columns=["id", "formula"])
+    names = pd.read_csv(structs, sep="\t", header=None, usecols=[0, 1], names=["id", "name"], dtype=str)
+    df["name"] = df["id"].map(dict(zip(names["id"], names["name"]))).fillna(df["id"])
+    df["mass"] = [EmpiricalFormula(formula).getMonoWeight() for formula in df["formula"]]
+    return df, header
+
+
+def load_search_space(maps, structs, adducts, cache=None):
+    """Sorted m/z of all database entries with all adducts, cached per database version and adduct list."""
+    cache = cache or ResultCache()
+    with open(maps, "r") as f:
+        version = [line.strip() for _, line in zip(range(2), f)]
+    key = cache.key("AccurateMassSearch", version, cache.file_hash(maps), cache.file_hash(structs), cache.file_hash(adducts))
+    entry = cache.get(key)
+    if entry is None:
+        db, _ = read_database(maps, structs)
+        space = []
+        for name, shift, multiplier, charge in read_adducts(adducts):
+            space.append(pd.DataFrame({"mz": (multiplier*db["mass"].to_numpy() + shift) / abs(charge),
+                                       "id": db["id"], "name": db["name"], "formula": db["formula"], "adduct": name}))
+        space = pd.concat(space).sort_values("mz", kind="stable").reset_index(drop=True)
+        with cache.put(key) as entry:
+            space.to_feather(os.path.join(entry, "search_space.ftr"))
+        entry = cache.get(key)
+    return pd.read_feather(os.path.join(entry, "search_space.ftr"))
+
+
+def search(df, space, mz_window_ppm):
+    """Adds the columns "AccurateMassSearch" (name, formula and adduct of every hit) and "AccurateMassSearch matches"."""
+    features, entries = match_mz(df["mz"], space["mz"].to_numpy(dtype=float), mz_window_ppm)
+    hits = (space["name"].astype(str) + " " + space["formula"].astype(str) + " " + space["adduct"].astype(str)).to_numpy()[entries]
+    df = df.copy()
+    df["AccurateMassSearch"] = pd.Series(hits).groupby(features).agg(";".join).reindex(range(len(df)), fill_value="").to_numpy()
+    df["AccurateMassSearch matches"] = np.bincount(features, minlength=len(df))
+    return df
+
+
+def search_table(table, maps, structs, adducts, mz_window_ppm):
+    """Accurate mass search for a feature matrix tsv file, annotations are written to the file in place."""
+    df = pd.read_csv(table, sep="\t")
+    df = search(df, load_search_space(maps, structs, adducts), mz_window_ppm)
+    write_table(df, table)
@@ -0,0 +1,81 @@
+"""MS1 annotation of consensus features by m/z and retention time.
+
+The library (tab separated with name, mz and RT columns) is sorted by m/z once and kept in the ResultCache,
+features are matched against it with binary searches on their ppm window followed by an RT filter. Library
+names can contain a `#` to give several adduct masses to one metabolite, e.g. `ADP` and `ADP#Dimer`.
+"""
+import os
+import numpy as np
+import pandas as pd
+from utils.cache import ResultCache
+from utils.matrix import write_table
+
+
+def load_library(path, cache=None):
+    """Library sorted by m/z, read from the cache if the file content has been indexed before."""
+    cache = cache or ResultCache()
+    key = cache.key("MS1 library", cache.file_hash(path))
+    entry = cache.get(key)
+    if entry is None:
+        df = pd.read_csv(path, sep="\t")[["name", "mz", "RT"]]
+        df = df.sort_values("mz", kind="stable").reset_index(drop=True)
+        with cache.put(key) as entry:
+            df.to_feather(os.path.join(entry, "library.ftr"))
+        entry = cache.get(key)
+    return pd.read_feather(os.path.join(entry, "library.ftr"))
+
+
+def match_mz(mz, lib_mz, mz_window_ppm):
+    """All (feature, library entry) pairs with |mz - lib_mz| / lib_mz * 1e6 <= mz_window_ppm.
+
+    lib_mz has to be sorted. Returns two index arrays into the features and the library.
+    """
+    mz = np.asarray(mz, dtype=float)
+    left = np.searchsorted(lib_mz, mz/(1+mz_window_ppm/1e6), side="left")
+    right = np.searchsorted(lib_mz, mz/(1-mz_window_ppm/1e6), side="right")
+    counts = right - left
+    features = np.repeat(np.arange(len(mz)), counts)
+    offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts)-counts, counts)
+    entries = np.repeat(left, counts) + offsets
+    return features, entries
+
+
+def match(mz, rt, library, mz_window_ppm, rt_window_sec):
+    """All (feature, library entry) pairs within the ppm window and within rt_window_sec/2 around the feature RT.
+
+    Returns two index arrays into the features and the library.
+    """
+    lib_rt = library["RT"].to_numpy(dtype=float)
+    rt = np.asarray(rt, dtype=float)
+    features, entries = match_mz(mz, library["mz"].to_numpy(dtype=float), mz_window_ppm)
+    within_rt = np.abs(rt[features] - lib_rt[entries]) <= rt_window_sec/2
+    return features[within_rt], entries[within_rt]
+
+
+def annotate(df, library, mz_window_ppm, rt_window_sec):
+    """Adds the columns "MS1 annotation" (matching library names), "MS1 metabolite" (names without # suffix)
+    and "MS1 matches" (number of matching library entries) to a feature table with mz and RT columns."""
+    features, entries = match(df["mz"], df["RT"], library, mz_window_ppm, rt_window_sec)
+    names = library["name"].astype(str).to_numpy()[entries]
+    matches = pd.DataFrame({"feature": features, "name": names, "metabolite": [n.split("#")[0] for n in names]})
+    df = df.copy()
+    df["MS1 annotation"] = matches.groupby("feature")["name"].agg(";".join).reindex(range(len(df)), fill_value="").to_numpy()
+    df["MS1 metabolite"] = matches.groupby("feature")["metabolite"].agg(lambda x: ";".join(dict.fromkeys(x))).reindex(range(len(df)), fill_value="").to_numpy()
+    df["MS1 matches"] = np.bincount(features, minlength=len(df))
+    return df
+
+
+def annotate_table(table, library_file, mz_window_ppm, rt_window_sec):
+    """Annotates a feature matrix tsv file in place."""
+    df = pd.read_csv(table, sep="\t")
+    df = annotate(df, load_library(library_file), mz_window_ppm, rt_window_sec)
+    write_table(df, table)
+
+
+def save_ms1_ids(table, path):
+    """Intensities of annotated metabolites, features of all adducts of a metabolite (# convention) summed up."""
+    df = pd.read_csv(table, sep="\t")
+    samples = [c for c in df.columns if c.endswith(".mzML")]
+    df = df[df["MS1 matches"] > 0]
+    df = df.assign(metabolite=df["MS1 metabolite"].str.split(";")).explode("metabolite")
+    df.groupby("metabolite")[samples].sum().reset_index().to_csv(path, sep="\t", index=False)
@@ -0,0 +1,56 @@
+"""Areas under extracted ion chromatograms."""
+import numpy as np
+import pandas as pd
+
+
+def auc_matrix(times, intensities, baseline=0):
+    """AUCs above baseline of several samples in one pass.
+
+    Parameters
+    ----------
+    times:
+        list with the time axis of each sample.
+    intensities:
+        list with a (scans x chromatograms) array for each sample, same column order for all samples.
+    baseline:
+        intensity subtracted from every point, the area below it is ignored.
+
+    Returns a (samples x chromatograms) array, integrated along the time axis with the trapezoidal rule.
+    """
+    lengths = np.array([len(t) for t in times])
+    time = np.concatenate(times).astype(float)
+    y = np.clip(np.vstack(intensities).astype(float) - baseline, 0, None)
+    segments = np.diff(time)[:, None] * (y[1:] + y[:-1]) / 2
+    # cumulative sums only ever get differenced within a sample, segments between samples are never counted
+    cumulative = np.vstack([np.zeros((1, y.shape[1])), np.cumsum(segments, axis=0)])
+    starts = np.concatenate([[0], np.cumsum(lengths)[:-1]])
+    ends = starts + np.maximum(lengths-1, 0)
+    # samples without scans have an AUC of 0, a trailing one would otherwise index past the end
+    starts, ends = np.minimum(starts, len(cumulative)-1), np.minimum(ends, len(cumulative)-1)
+    aucs = cumulative[ends] - cumulative[starts]
+    aucs[lengths == 0] = 0
+    return aucs
+
+
+class AUCSummary:
+    """AUCs of chromatograms x samples from a ChromatogramStore, memoized per baseline."""
+    def __init__(self, store, samples, chroms):
+        self.samples = list(samples)
+        self.chroms = list(chroms)
+        self.times = []
+        self.intensities = []
+        for sample in self.samples:
+            df = store.read(sample, ["time"]+self.chroms)
+            self.times.append(df["time"].to_numpy())
+            self.intensities.append(df[self.chroms].to_numpy())
+        self.results = {}
+
+    def get(self, baseline):
+        """DataFrame with one row per chromatogram and one column per sample."""
+        if baseline not in self.results:
+            if self.samples and self.chroms:
+                aucs = auc_matrix(self.times, self.intensities, baseline).astype(np.int64)
+            else:
+                aucs = np.zeros((len(self.samples), len(self.chroms)), dtype=np.int64)
+            self.results[baseline] = pd.DataFrame(aucs.T, index=self.chroms, columns=self.samples)
+        return self.results[baseline]
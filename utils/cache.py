@@ -0,0 +1,140 @@
+"""Persistent content-addressed cache for per-file results.
+
+Entries are directories named by a hash over the mzML file content and the parameters that produced them.
+They are written to a temporary directory first and renamed into place, so worker processes can fill the
+cache at the same time. The least recently used entries and remembered file hashes are removed once the cache
+exceeds its size cap.
+
+Clear the cache from the command line with `python -m utils.cache clear`.
+"""
+import hashlib
+import json
+import os
+import shutil
+import sys
+import tempfile
+from contextlib import contextmanager
+
+CACHE_DIR = "cache"
+MAX_SIZE_MB = 5000
+
+
+class ResultCache:
+    def __init__(self, directory=CACHE_DIR, max_size_mb=MAX_SIZE_MB):
+        self.directory = directory
+        self.max_size_mb = max_size_mb
+
+    def key(self, *parts):
+        """Hash over any JSON serializable parameters."""
+        return hashlib.sha256(json.dumps(parts, sort_keys=True, default=str).encode()).hexdigest()
+
+    def file_hash(self, path):
+        """SHA-256 of the file content, remembered per path, size and modification time."""
+        stat = os.stat(path)
+        memo = os.path.join(self.directory, "hashes",
+                            self.key(os.path.abspath(path), stat.st_size, stat.st_mtime_ns))
+        if os.path.isfile(memo):
+            try:
+                with open(memo, "r") as f:
+                    digest = f.read()
+                # marks the hash as recently used for evict
+                os.utime(memo)
+                return digest
+            except OSError:
+                # evicted in the meantime
+                pass
+        sha = hashlib.sha256()
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(1024*1024), b""):
+                sha.update(chunk)
+        digest = sha.hexdigest()
+        os.makedirs(os.path.dirname(memo), exist_ok=True)
+        with tempfile.NamedTemporaryFile("w", dir=os.path.dirname(memo), delete=False) as f:
+            f.write(digest)
+        os.replace(f.name, memo)
+        return digest
+
+    def entry(self, key):
+        return os.path.join(self.directory, "entries", key[:2], key)
+
+    def get(self, key):
+        """Returns the entry directory for key or None, marks the entry as recently used."""
+        path = self.entry(key)
+        if not os.path.isdir(path):
+            return None
+        try:
+            os.utime(path)
+        except OSError:
+            return None
+        return path
+
+    @contextmanager
+    def put(self, key):
+        """Yields a directory to write the entry files to, the entry becomes visible when the block exits."""
+        path = self.entry(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = tempfile.mkdtemp(dir=os.path.dirname(path), prefix=".tmp")
+        try:
+            yield tmp
+            try:
+                os.rename(tmp, path)
+            except OSError:
+                # another process stored the same entry first
+                shutil.rmtree(tmp, ignore_errors=True)
+        except BaseException:
+            shutil.rmtree(tmp, ignore_errors=True)
+            raise
+
+    def entries(self):
+        """List of (last used, size in bytes, path) for all entries and remembered file hashes."""
+        entries = []
+        hashes = os.path.join(self.directory, "hashes")
+        if os.path.isdir(hashes):
+            for name in os.listdir(hashes):
+                # temporary files of file_hash
+                if name.startswith("tmp"):
+                    continue
+                path = os.path.join(hashes, name)
+                entries.append((os.path.getmtime(path), os.path.getsize(path), path))
+        root = os.path.join(self.directory, "entries")
+        if not os.path.isdir(root):
+            return entries
+        for prefix in os.listdir(root):
+            for name in os.listdir(os.path.join(root, prefix)):
+                if name.startswith(".tmp"):
+                    continue
+                path = os.path.join(root, prefix, name)
+                size = sum(os.path.getsize(os.path.join(path, f)) for f in os.listdir(path))
+                entries.append((os.path.getmtime(path), size, path))
+        return entries
+
+    def size_mb(self):
+        return sum(size for _, size, _ in self.entries()) / 1024**2
+
+    def evict(self):
+        """Removes least recently used entries until the cache fits its size cap."""
+        entries = sorted(self.entries())
+        total = sum(size for _, size, _ in entries)
+        while entries and total > self.max_size_mb*1024**2:
+            _, size, path = entries.pop(0)
+            if os.path.isdir(path):
+                shutil.rmtree(path, ignore_errors=True)
+            else:
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+            total -= size
+
+    def clear(self):
+        if os.path.isdir(self.directory):
+            shutil.rmtree(self.directory)
+
+
+if __name__ == "__main__":
+    if sys.argv[1:] == ["clear"]:
+        ResultCache().clear()
+    elif sys.argv[1:] == ["size"]:
+        print(f"{ResultCache().size_mb():.1f} MB")
+    else:
+        print("usage: python -m utils.cache clear|size")
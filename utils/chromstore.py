@@ -0,0 +1,43 @@
+"""Chromatogram storage of one run as uncompressed Arrow IPC files, one file per sample.
+
+Files are opened memory-mapped, so reading a sample maps the file instead of copying it and only the
+requested chromatogram columns are materialized.
+"""
+import os
+import pyarrow as pa
+
+
+class ChromatogramStore:
+    def __init__(self, directory):
+        self.directory = directory
+
+    def path(self, sample):
+        return os.path.join(self.directory, sample+".arrow")
+
+    def write(self, sample, df):
+        os.makedirs(self.directory, exist_ok=True)
+        table = pa.Table.from_pandas(df, preserve_index=False)
+        tmp = self.path(sample)+".tmp"
+        with pa.OSFile(tmp, "wb") as sink:
+            with pa.ipc.new_file(sink, table.schema) as writer:
+                writer.write_table(table)
+        os.replace(tmp, self.path(sample))
+
+    def samples(self):
+        if not os.path.isdir(self.directory):
+            return []
+        return sorted(f[:-6] for f in os.listdir(self.directory) if f.endswith(".arrow"))
+
+    def table(self, sample):
+        return pa.ipc.open_file(pa.memory_map(self.path(sample), "r")).read_all()
+
+    def columns(self, sample):
+        """Column names of a sample, only the schema is read."""
+        return pa.ipc.open_file(pa.memory_map(self.path(sample), "r")).schema.names
+
+    def read(self, sample, columns=None):
+        """DataFrame of a sample with only the given columns (all if None)."""
+        table = self.table(sample)
+        if columns is not None:
+            table = table.select([c for c in columns if c in table.column_names])
+        return table.to_pandas()
@@ -0,0 +1,110 @@
+"""Export of consensusXML feature matrices.
+
+The feature matrix tsv file is written by pymetabo's create_consensus_table, so its column layout stays the one all
+pages and exports expect. The file is then read in chunks of CHUNK_ROWS consensus features and written to an Arrow
+IPC file next to it, so this step does not load the whole table. Summary metrics (features, missing values per
+sample) are counted in the same pass and stored as <table>.summary.json for the result pages. Intensity columns
+are the ones named by mzML file, missing values have intensity 0.
+"""
+import itertools
+import json
+import os
+import xml.etree.ElementTree as ET
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+from utils.matrix import arrow_compatible, arrow_path
+
+CHUNK_ROWS = 10000
+
+
+def summary_path(table):
+    return os.path.splitext(table)[0]+".summary.json"
+
+
+def load_summary(table):
+    """Summary metrics of an exported feature matrix, None if there are none."""
+    if not os.path.isfile(summary_path(table)):
+        return None
+    with open(summary_path(table), "r") as f:
+        return json.load(f)
+
+
+def column_headers(consensusXML):
+    """{map index: file name} of a consensusXML file, only the map list at the top of the file is read."""
+    headers = {}
+    for _, elem in ET.iterparse(consensusXML, events=("start",)):
+        if elem.tag == "map":
+            headers[int(elem.get("id"))] = os.path.basename(elem.get("name", ""))
+        elif elem.tag == "consensusElementList":
+            break
+    return headers
+
+
+def export_metadata(consensusXML, path):
+    """GNPS meta value table (filename and ATTRIBUTE_MAPID per sample) from the map list of a consensusXML file."""
+    headers = column_headers(consensusXML)
+    pd.DataFrame({"filename": list(headers.values()), "ATTRIBUTE_MAPID": [f"MAP{i}" for i in headers]}).to_csv(path, sep="\t")
+
+
+def consensus_features(consensusXML):
+    """Yields the map headers first and then one (attributes, centroid, elements, user params) per consensus feature."""
+    headers, started = {}, False
+    for _, elem in ET.iterparse(consensusXML):
+        if elem.tag == "map":
+            headers[int(elem.get("id"))] = os.path.basename(elem.get("name", ""))
+        elif elem.tag == "consensusElement":
+            if not started:
+                started = True
+                yield headers
+            centroid = elem.find("centroid")
+            elements = [(int(e.get("map")), e.get("id"), float(e.get("it"))) for e in elem.iter("element")]
+            params = {p.get("name"): p.get("value") for p in elem.findall("UserParam")}
+            yield elem.attrib, centroid.attrib, elements, params
+            # only an empty element is kept per parsed feature
+            elem.clear()
+    if not started:
+        yield headers
+
+
+def write_consensus_table(consensusXML, table, sirius_ms_dir="", chunk_rows=CHUNK_ROWS):
+    """Writes the feature matrix of a consensusXML file as tsv file, its Arrow file and summary, returns the summary."""
+    # imported here, reading summaries and consensus features does not need pymetabo
+    from pymetabo.dataframes import DataFrames
+    DataFrames().create_consensus_table(consensusXML, table, sirius_ms_dir)
+    return convert_table(table, chunk_rows)
+
+
+def convert_table(table, chunk_rows=CHUNK_ROWS):
+    """Writes the Arrow file and summary of a feature matrix tsv file chunk by chunk, returns the summary.
+
+    Column types are taken from the first chunk, columns without values in it are stored as text.
+    """
+    chunks = pd.read_csv(table, sep="\t", chunksize=chunk_rows)
+    first = arrow_compatible(next(chunks))
+    samples = [c for c in first.columns if c.endswith(".mzML")]
+    schema = pa.schema([(c, pa.float64()) if c in samples
+                        else (c, pa.string()) if first[c].isna().all()
+                        else pa.Schema.from_pandas(first[[c]], preserve_index=False).field(c)
+                        for c in first.columns])
+    text = [c for c in first.columns if pa.types.is_string(schema.field(c).type)]
+    summary = {"features": 0, "complete features": 0, "missing values": 0, "missing values per sample": {}}
+    missing = np.zeros(len(samples), dtype=np.int64)
+
+    tmp = arrow_path(table)+".tmp"
+    with pa.OSFile(tmp, "wb") as sink, pa.ipc.new_file(sink, schema) as writer:
+        for df in itertools.chain([first], chunks):
+            for c in text:
+                df[c] = df[c].where(df[c].isna(), df[c].astype(str))
+            writer.write_table(pa.Table.from_pandas(df, schema=schema, preserve_index=False))
+            found = df[samples].fillna(0).to_numpy() > 0
+            missing += len(df) - found.sum(axis=0)
+            summary["complete features"] += int(found.all(axis=1).sum())
+            summary["features"] += len(df)
+    os.replace(tmp, arrow_path(table))
+
+    summary["missing values per sample"] = dict(zip(samples, missing.tolist()))
+    summary["missing values"] = int(missing.sum())
+    with open(summary_path(table), "w") as f:
+        json.dump(summary, f, indent=2)
+    return summary
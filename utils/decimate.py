@@ -0,0 +1,51 @@
+"""Reducing chromatograms to a fixed number of points per trace before they are sent to the browser."""
+import numpy as np
+import pandas as pd
+
+
+def decimate(df, max_points=2000, x="time", x_range=None):
+    """Min/max decimation of all numeric columns against the x column.
+
+    The rows are split into max_points/2 equally sized buckets. Of every bucket only the rows holding the minimum
+    and maximum of each trace are kept, at their own x values, so peak apices and baselines survive in place and
+    each trace has at most max_points points of its own. Where another trace has no point of its own at such a row
+    its value is interpolated linearly between its neighbouring points, which is the line the plot draws anyway.
+    With x_range only rows inside (start, end) are kept before decimating, zooming in therefore shows the data in
+    full resolution again.
+    """
+    if x not in df.columns:
+        return df
+    if x_range is not None:
+        df = df[(df[x] >= x_range[0]) & (df[x] <= x_range[1])]
+    buckets = max(max_points // 2, 1)
+    if len(df) <= max_points:
+        return df
+    columns = [c for c in df.columns if c != x and pd.api.types.is_numeric_dtype(df[c])]
+    size = -(-len(df) // buckets)
+    # repeat the last row so every bucket has the same size
+    pad = buckets*size - len(df)
+    values = df[columns].to_numpy(dtype=float)
+    filled = np.nan_to_num(values, nan=0.0)
+    filled = np.concatenate([filled, np.repeat(filled[-1:], pad, axis=0)]).reshape(buckets, size, len(columns))
+    offsets = np.arange(buckets)[:, None]*size
+    # row of the minimum and maximum of each trace in each bucket, the padding rows stand for the last row
+    rows = np.minimum(np.concatenate([offsets + filled.argmin(axis=1), offsets + filled.argmax(axis=1)]), len(df)-1)
+    kept = np.unique(rows)
+    result = pd.DataFrame({x: df[x].to_numpy(dtype=float)[kept]})
+    for i, column in enumerate(columns):
+        own = np.unique(rows[:, i])
+        result[column] = np.interp(kept, own, values[own, i])
+    return result
+
+
+def time_limits(store, samples, x="time"):
+    """Smallest and largest x value over the samples of a ChromatogramStore, None if there is no x column."""
+    limits = []
+    for sample in samples:
+        if x in store.columns(sample):
+            time = store.read(sample, [x])[x]
+            if len(time):
+                limits += [time.min(), time.max()]
+    if not limits:
+        return None
+    return float(min(limits)), float(max(limits))
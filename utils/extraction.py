@@ -0,0 +1,331 @@
+"""Chromatogram extraction from mzML spectra.
+
+All target masses are resolved per spectrum at once on the peak arrays, so every
+spectrum is visited a single time regardless of how many EICs are requested.
+Targets with RT limits are only resolved on the spectra within them. Once time and BPC of a file are cached,
+new targets with RT limits are extracted by decoding just those spectra through the scan index of the file.
+"""
+import os
+import shutil
+import numpy as np
+import pandas as pd
+from pyopenms import MSExperiment, MzMLFile, OnDiscMSExperiment
+from utils.memory import peak_memory_mb
+from utils.chromstore import ChromatogramStore
+from utils.parallel import run_parallel
+from utils.cache import ResultCache
+from utils.scanindex import POLARITIES, build_scan_index, scan_index, scans_in_windows, select_scans
+from utils.metrics import Metrics
+
+
+def parse_targets(masses_input, time_unit="seconds"):
+    """Parses the mass list text field into masses, names and RT limits in seconds.
+
+    One target per line as `mass`, `mass=name` or `mass=name=start-end`. Targets without RT limits get [0, 0].
+    """
+    masses = []
+    names = []
+    times = []
+    time_factor = 1.0
+    if time_unit == "minutes":
+        time_factor = 60.0
+    for line in [line for line in masses_input.split('\n') if line != '']:
+        if len(line.split("=")) == 3:
+            mass, name, time = line.split("=")
+        elif len(line.split("=")) == 2:
+            mass, name = line.split("=")
+            time = "all"
+        else:
+            mass = line
+            name = ''
+            time = "all"
+        masses.append(float(mass.strip()))
+        names.append(name.strip())
+        if "-" in time:
+            times.append([float(time.split("-")[0].strip())*time_factor, float(time.split("-")[1].strip())*time_factor])
+        else:
+            times.append([0, 0])
+    return masses, names, times
+
+
+def window_maxima(mzs, intensities, lower, upper):
+    """Highest intensity within each [lower, upper] window (0 if the window holds no peak).
+
+    Windows are inclusive on both sides like MSSpectrum.findHighestInWindow.
+    """
+    if len(mzs) == 0 or len(lower) == 0:
+        return np.zeros(len(lower), dtype=np.int64)
+    left = np.searchsorted(mzs, lower, side="left")
+    right = np.searchsorted(mzs, upper, side="right")
+    # trailing sentinel keeps right == len(mzs) a valid reduceat index
+    padded = np.append(intensities, intensities.dtype.type(0))
+    bounds = np.empty(2*len(left), dtype=np.intp)
+    bounds[0::2] = left
+    bounds[1::2] = right
+    maxima = np.maximum.reduceat(padded, bounds)[0::2]
+    maxima[left >= right] = 0
+    return maxima.astype(np.int64)
+
+
+class ChromatogramExtractor:
+    """Collects BPC, TIC and EIC intensities spectrum by spectrum.
+
+    Parameters
+    ----------
+    masses, names, times:
+        targets as returned by parse_targets, RT limits in seconds.
+    tolerance, unit:
+        mass tolerance either in "ppm" or "Da".
+    time_unit:
+        unit of the resulting time column, "seconds" or "minutes".
+    """
+    def __init__(self, masses, names, times, tolerance, unit="ppm", time_unit="seconds"):
+        self.masses = np.asarray(masses, dtype=float)
+        self.columns = [str(mass)+"_"+name for mass, name in zip(masses, names)]
+        if unit == "Da":
+            tolerances = np.full(len(self.masses), float(tolerance))
+        else:
+            tolerances = (tolerance/1000000)*self.masses
+        self.lower = self.masses - tolerances
+        self.upper = self.masses + tolerances
+        times = np.asarray(times, dtype=float).reshape(-1, 2)
+        self.rt_start = times[:, 0]
+        self.rt_end = times[:, 1]
+        self.rt_all = (self.rt_start == 0) & (self.rt_end == 0)
+        self.time_unit = time_unit
+        self.time = []
+        self.bpc = []
+        self.tic = []
+        self.eics = []
+
+    def window_maxima(self, mzs, intensities):
+        return window_maxima(mzs, intensities, self.lower, self.upper)
+
+    def add(self, mzs, intensities, rt):
+        """Adds one spectrum given as peak arrays with its RT in seconds."""
+        if self.time_unit == "minutes":
+            self.time.append(rt/60)
+        else:
+            self.time.append(rt)
+        if len(intensities):
+            self.bpc.append(int(intensities.max()))
+        else:
+            self.bpc.append(0)
+        self.tic.append(int(intensities.sum(dtype=float)))
+        # only targets whose RT window contains the spectrum are resolved, the others stay 0
+        active = self.rt_all | ((self.rt_start < rt) & (self.rt_end > rt))
+        if active.all():
+            eic = self.window_maxima(mzs, intensities)
+        else:
+            eic = np.zeros(len(self.masses), dtype=np.int64)
+            eic[active] = window_maxima(mzs, intensities, self.lower[active], self.upper[active])
+        self.eics.append(eic)
+
+    def add_spectrum(self, spec):
+        mzs, intensities = spec.get_peaks()
+        self.add(mzs, intensities, spec.getRT())
+
+    def to_df(self):
+        if self.eics:
+            eics = np.vstack(self.eics)
+        else:
+            eics = np.zeros((0, len(self.columns)), dtype=np.int64)
+        columns = {"time": self.time, "BPC": np.array(self.bpc, dtype=np.int64), "TIC": np.array(self.tic, dtype=np.int64)}
+        columns.update({column: eics[:, i] for i, column in enumerate(self.columns)})
+        return pd.DataFrame(columns)
+
+
+def extract_chromatograms(exp, masses, names, times, tolerance, unit="ppm", time_unit="seconds"):
+    """Returns a DataFrame with time, BPC, TIC and one EIC column per target from an MSExperiment."""
+    extractor = ChromatogramExtractor(masses, names, times, tolerance, unit, time_unit)
+    for spec in exp:
+        extractor.add_spectrum(spec)
+    return extractor.to_df()
+
+
+class SpectrumConsumer:
+    """pyOpenMS consumer passing each spectrum (of one polarity) to a ChromatogramExtractor without keeping it."""
+    def __init__(self, extractor, polarity="any"):
+        self.extractor = extractor
+        self.polarity = POLARITIES[polarity]
+
+    def setExpectedSize(self, num_spectra, num_chromatograms):
+        pass
+
+    def setExperimentalSettings(self, settings):
+        pass
+
+    def consumeSpectrum(self, spec):
+        if self.polarity is None or spec.getInstrumentSettings().getPolarity().value == self.polarity:
+            self.extractor.add_spectrum(spec)
+
+    def consumeChromatogram(self, chrom):
+        pass
+
+
+def stream_chromatograms(file, masses, names, times, tolerance, unit="ppm", time_unit="seconds", ms_level=1, polarity="any"):
+    """Like extract_chromatograms but reads the spectra of one MS level from the mzML file one at a time.
+
+    The experiment is never loaded as a whole, only a single decoded spectrum is held in memory at any time.
+    Spectra of other MS levels are skipped by the parser without decoding, other polarities only after decoding,
+    use indexed_chromatograms to skip them as well.
+    """
+    extractor = ChromatogramExtractor(masses, names, times, tolerance, unit, time_unit)
+    mzml = MzMLFile()
+    options = mzml.getOptions()
+    options.setMSLevels([ms_level])
+    options.setMaxDataPoolSize(1)
+    mzml.setOptions(options)
+    mzml.transform(file, SpectrumConsumer(extractor, polarity))
+    return extractor.to_df()
+
+
+def indexed_chromatograms(file, index, masses, names, times, tolerance, unit="ppm", time_unit="seconds", ms_level=1, polarity="any"):
+    """Like stream_chromatograms for indexed mzML files, only the spectra of ms_level and polarity are decoded."""
+    extractor = ChromatogramExtractor(masses, names, times, tolerance, unit, time_unit)
+    exp = OnDiscMSExperiment()
+    exp.openFile(file, True)
+    for i in select_scans(index, ms_level, polarity):
+        mzs, intensities = exp.getSpectrum(int(i)).get_peaks()
+        extractor.add(mzs, intensities, index["rt"][i])
+    return extractor.to_df()
+
+
+def extract_windows(file, index, masses, times, tolerance, unit="ppm", ms_level=1, polarity="any"):
+    """EICs (spectra x targets) of targets with RT limits, only the spectra within their windows are decoded.
+
+    index is the scan_index of the indexed mzML file. Rows are the spectra of ms_level and polarity in file order,
+    like the rows of extract_df.
+    """
+    extractor = ChromatogramExtractor(masses, [""]*len(masses), times, tolerance, unit)
+    spectra = select_scans(index, ms_level, polarity)
+    rts = index["rt"][spectra]
+    eics = np.zeros((len(spectra), len(masses)), dtype=np.int64)
+    exp = OnDiscMSExperiment()
+    exp.openFile(file, True)
+    windows = scans_in_windows(rts, zip(extractor.rt_start, extractor.rt_end))
+    for row in np.unique(np.concatenate(windows)):
+        mzs, intensities = exp.getSpectrum(int(spectra[row])).get_peaks()
+        active = (extractor.rt_start < rts[row]) & (extractor.rt_end > rts[row])
+        eics[row, active] = window_maxima(mzs, intensities, extractor.lower[active], extractor.upper[active])
+    return eics
+
+
+def extract_df(file, masses, names, times, tolerance, unit="ppm", time_unit="seconds", low_memory=True, ms_level=1,
+               polarity="any", index=None):
+    """Chromatograms of the spectra of one MS level and polarity ("any", "positive" or "negative") of an mzML file.
+
+    With a polarity the spectra are selected through the scan index of the file (built if index is None), so
+    spectra of the other polarity are not decoded.
+    """
+    if polarity != "any":
+        if index is None:
+            index = build_scan_index(file)
+        if index is not None:
+            return indexed_chromatograms(file, index, masses, names, times, tolerance, unit, time_unit, ms_level, polarity)
+    if low_memory:
+        return stream_chromatograms(file, masses, names, times, tolerance, unit, time_unit, ms_level, polarity)
+    mzml = MzMLFile()
+    options = mzml.getOptions()
+    options.setMSLevels([ms_level])
+    mzml.setOptions(options)
+    exp = MSExperiment()
+    mzml.load(file, exp)
+    if polarity != "any":
+        exp.setSpectra([spec for spec in exp if spec.getInstrumentSettings().getPolarity().value == POLARITIES[polarity]])
+    return extract_chromatograms(exp, masses, names, times, tolerance, unit, time_unit)
+
+
+def cached_extract_df(cache, file, masses, names, times, tolerance, unit="ppm", time_unit="seconds", low_memory=True,
+                      ms_level=1, polarity="any"):
+    """Like extract_df but loads (file, target) chromatograms from a ResultCache and only extracts the missing ones."""
+    file_hash = cache.file_hash(file)
+    base_key = cache.key("BPC", file_hash, time_unit, ms_level, polarity)
+    keys = [cache.key("EIC", file_hash, float(mass), [float(t) for t in time], float(tolerance), unit, ms_level, polarity)
+            for mass, time in zip(masses, times)]
+    missing = {key: (mass, time) for mass, time, key in zip(masses, times, keys) if cache.get(key) is None}
+    base = cache.get(base_key)
+    windowed = {key: (mass, time) for key, (mass, time) in missing.items() if list(time) != [0, 0]}
+    index = None
+    if (windowed and base is not None) or ((missing or base is None) and polarity != "any"):
+        index = scan_index(file, cache)
+    if windowed and base is not None and index is not None:
+        # time and BPC are known, targets with RT limits are extracted from the spectra within them only
+        eics = extract_windows(file, index, [mass for mass, _ in windowed.values()], [time for _, time in windowed.values()],
+                               tolerance, unit, ms_level, polarity)
+        if len(eics) == len(np.load(os.path.join(base, "time.npy"))):
+            for i, key in enumerate(windowed):
+                with cache.put(key) as entry:
+                    np.save(os.path.join(entry, "EIC.npy"), eics[:, i])
+                del missing[key]
+    if missing or base is None:
+        # name the new columns by their keys to keep them unique
+        df_new = extract_df(file, [mass for mass, _ in missing.values()], list(missing.keys()),
+                            [time for _, time in missing.values()], tolerance, unit, time_unit, low_memory,
+                            ms_level, polarity, index)
+        with cache.put(base_key) as entry:
+            for column in ("time", "BPC", "TIC"):
+                np.save(os.path.join(entry, column+".npy"), df_new[column].to_numpy())
+        for key, (mass, _) in missing.items():
+            with cache.put(key) as entry:
+                np.save(os.path.join(entry, "EIC.npy"), df_new[str(mass)+"_"+key].to_numpy())
+        base = cache.get(base_key)
+    columns = {column: np.load(os.path.join(base, column+".npy")) for column in ("time", "BPC", "TIC")}
+    columns.update({str(mass)+"_"+name: np.load(os.path.join(cache.get(key), "EIC.npy")) for mass, name, key in zip(masses, names, keys)})
+    return pd.DataFrame(columns)
+
+
+def extract_file(file, results_dir, masses, names, times, tolerance, unit="ppm", time_unit="seconds", low_memory=True, cache=None,
+                 ms_level=1, polarity="any"):
+    """Extracts the chromatograms of the spectra of one MS level and polarity of one mzML file into the chromatogram
+    store of results_dir.
+
+    Module level so it can run in a worker process, returns the peak memory of that process so far in MB (the
+    workers of run_parallel are started for one run, so the largest value is the peak of any worker during the run)
+    and the number of spectra.
+    With a ResultCache only chromatograms that have not been extracted before with the same parameters are computed.
+    """
+    if cache is None:
+        df = extract_df(file, masses, names, times, tolerance, unit, time_unit, low_memory, ms_level, polarity)
+    else:
+        df = cached_extract_df(cache, file, masses, names, times, tolerance, unit, time_unit, low_memory, ms_level, polarity)
+    ChromatogramStore(os.path.join(results_dir, "chromatograms")).write(os.path.basename(file)[:-5], df)
+    return peak_memory_mb(), len(df)
+
+
+def extract_files(mzML_files, results_dir, masses_input, tolerance, unit="ppm", time_unit="seconds", low_memory=True,
+                  use_cache=True, workers=None, progress=None, profile=False, ms_level=1, polarity="any"):
+    """Extracts the chromatograms of all mzML files into a fresh results_dir with one worker process per file.
+
+    masses_input is the mass list as entered on the Extract Chromatograms page, chromatograms are built from the
+    spectra of ms_level and polarity ("any", "positive" or "negative"). progress(message, fraction) is
+    called after each file. Stage timings are written to results_dir/metrics.json (with cProfile statistics if
+    profile). Returns the highest peak memory of a worker in MB and the errors per file.
+    """
+    if os.path.isdir(results_dir):
+        shutil.rmtree(results_dir)
+    os.makedirs(results_dir)
+    metrics = Metrics(os.path.join(results_dir, "metrics.json"), profile)
+    masses, names, times = parse_targets(masses_input, time_unit)
+    peak_memory = []
+    errors = {}
+    with metrics.stage("Chromatogram extraction", mzML_files, [os.path.join(results_dir, "chromatograms")]) as stage:
+        stage["items"].update({"files": 0, "spectra": 0, "targets": len(masses)})
+        for i, (file, result, error) in enumerate(run_parallel(extract_file, mzML_files, workers,
+                                                                results_dir=results_dir, masses=masses, names=names, times=times,
+                                                                tolerance=tolerance, unit=unit, time_unit=time_unit, low_memory=low_memory,
+                                                                cache=ResultCache() if use_cache else None,
+                                                                ms_level=ms_level, polarity=polarity)):
+            if error:
+                errors[os.path.basename(file)] = str(error)
+            else:
+                memory, spectra = result
+                stage["items"]["files"] += 1
+                stage["items"]["spectra"] += spectra
+                if memory:
+                    peak_memory.append(memory)
+            if progress is not None:
+                progress("Extracted from: " + os.path.basename(file), (i+1)/len(mzML_files))
+    with metrics.stage("Cache eviction"):
+        ResultCache().evict()
+    return {"peak_memory": max(peak_memory, default=None), "errors": errors}
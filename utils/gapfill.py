@@ -0,0 +1,143 @@
+"""Gap filling of a linked feature matrix as a cheaper alternative to re-quantification with FeatureFinderMetaboIdent.
+
+Only the missing (consensus feature, sample) cells are integrated: for every sample the MS1 spectra are streamed
+from its mzML file, their retention times are aligned with the sample's transformation and the intensities within
+the m/z window of each missing cell are summed per spectrum and integrated (trapezoid) over the RT window around
+the consensus feature. The areas are added to the consensus map as feature handles, features are not linked again.
+"""
+import os
+import numpy as np
+from pyopenms import (ConsensusMap, ConsensusXMLFile, FeatureHandle, MzMLFile, TransformationDescription,
+                      TransformationXMLFile, UniqueIdGenerator)
+from utils.consensus import consensus_features
+from utils.parallel import run_parallel
+from utils.workspace import trafo_file
+
+
+def missing_cells(consensusXML):
+    """{sample file name: array of (consensus feature index, mz, RT) rows} of the cells without intensity."""
+    features = consensus_features(consensusXML)
+    headers = next(features, {})
+    cells = {m: [] for m in headers}
+    for i, (_, centroid, elements, _) in enumerate(features):
+        found = {m for m, _, intensity in elements if intensity > 0}
+        for m in headers:
+            if m not in found:
+                cells[m].append((i, float(centroid["mz"]), float(centroid["rt"])))
+    return {headers[m]: np.array(rows, dtype=float).reshape(-1, 3) for m, rows in cells.items()}
+
+
+class GapIntegrator:
+    """Integrates the m/z windows of the missing cells of one sample spectrum by spectrum."""
+    def __init__(self, cells, mz_window_ppm, rt_window_sec, trafo=None):
+        cells = cells[np.argsort(cells[:, 2], kind="stable")]
+        self.features = cells[:, 0].astype(np.int64)
+        self.lower = cells[:, 1] * (1 - mz_window_ppm/1e6)
+        self.upper = cells[:, 1] * (1 + mz_window_ppm/1e6)
+        self.rt = cells[:, 2]
+        self.rt_window_sec = rt_window_sec
+        self.trafo = trafo
+        self.area = np.zeros(len(cells))
+        # RT and summed intensity of the previous spectrum within the window of each cell
+        self.last_rt = np.full(len(cells), np.nan)
+        self.last_intensity = np.zeros(len(cells))
+
+    def add(self, mzs, intensities, rt):
+        if self.trafo is not None:
+            rt = self.trafo.apply(rt)
+        start = np.searchsorted(self.rt, rt - self.rt_window_sec/2, side="left")
+        end = np.searchsorted(self.rt, rt + self.rt_window_sec/2, side="right")
+        if start == end:
+            return
+        summed = np.concatenate([[0], np.cumsum(intensities, dtype=float)])
+        window = (summed[np.searchsorted(mzs, self.upper[start:end], side="right")] -
+                  summed[np.searchsorted(mzs, self.lower[start:end], side="left")])
+        last_rt = self.last_rt[start:end]
+        previous = ~np.isnan(last_rt)
+        self.area[start:end][previous] += ((window + self.last_intensity[start:end]) / 2 * (rt - last_rt))[previous]
+        self.last_rt[start:end] = rt
+        self.last_intensity[start:end] = window
+
+    def consumeSpectrum(self, spec):
+        mzs, intensities = spec.get_peaks()
+        self.add(mzs, intensities, spec.getRT())
+
+    def setExpectedSize(self, num_spectra, num_chromatograms):
+        pass
+
+    def setExperimentalSettings(self, settings):
+        pass
+
+    def consumeChromatogram(self, chrom):
+        pass
+
+
+def fill_sample(item, trafo_dir=None, mz_window_ppm=10, rt_window_sec=30):
+    """Areas of the missing cells of one sample, item is (mzML file, cells as from missing_cells).
+
+    Module level so it can run in a worker process, returns the consensus feature indices and their areas.
+    """
+    mzML, cells = item
+    trafo = None
+    trafo_path = trafo_file(trafo_dir, mzML)
+    if trafo_path:
+        trafo = TransformationDescription()
+        TransformationXMLFile().load(trafo_path, trafo, True)
+    integrator = GapIntegrator(cells, mz_window_ppm, rt_window_sec, trafo)
+    mzml = MzMLFile()
+    options = mzml.getOptions()
+    options.setMSLevels([1])
+    options.setMaxDataPoolSize(1)
+    mzml.setOptions(options)
+    mzml.transform(mzML, integrator)
+    return integrator.features, integrator.area
+
+
+def fill_gaps(consensusXML, mzML_dir, trafo_dir, out, mz_window_ppm=10, rt_window_sec=30, workers=None):
+    """Writes consensusXML with its missing values filled to out, one worker per sample.
+
+    Samples are matched to the mzML files in mzML_dir by file name, the RT transformations are taken from
+    trafo_dir. Cells without signal stay missing.
+    """
+    cells = missing_cells(consensusXML)
+    items = []
+    for sample, sample_cells in cells.items():
+        mzML = os.path.join(mzML_dir, sample)
+        if not os.path.isfile(mzML):
+            raise FileNotFoundError(f"No mzML file for sample {sample} in {mzML_dir}.")
+        if len(sample_cells):
+            items.append((mzML, sample_cells))
+
+    cmap = ConsensusMap()
+    ConsensusXMLFile().load(consensusXML, cmap)
+    map_index = {os.path.basename(header.filename): m for m, header in cmap.getColumnHeaders().items()}
+    filled = {}
+    errors = []
+    for (mzML, _), result, error in run_parallel(fill_sample, items, workers, trafo_dir=trafo_dir,
+                                                 mz_window_ppm=mz_window_ppm, rt_window_sec=rt_window_sec):
+        if error:
+            errors.append(f"{mzML}: {error}")
+            continue
+        for feature, area in zip(*result):
+            if area > 0:
+                filled.setdefault(int(feature), []).append((map_index[os.path.basename(mzML)], float(area)))
+    if errors:
+        raise RuntimeError("\n".join(errors))
+
+    # features of a ConsensusMap are iterated as copies, the map is refilled with the completed ones
+    features = []
+    for i, cf in enumerate(cmap):
+        for m, area in filled.get(i, []):
+            handle = FeatureHandle()
+            handle.setMapIndex(m)
+            handle.setUniqueId(UniqueIdGenerator.getUniqueId())
+            handle.setRT(cf.getRT())
+            handle.setMZ(cf.getMZ())
+            handle.setCharge(cf.getCharge())
+            handle.setIntensity(area)
+            cf.insert(handle)
+        features.append(cf)
+    cmap.clear(False)
+    for cf in features:
+        cmap.push_back(cf)
+    ConsensusXMLFile().store(out, cmap)
@@ -0,0 +1,93 @@
+"""Plots of feature matrices with thousands of features.
+
+Heatmaps are ordered by hierarchical clustering of the features, which is computed once per matrix and kept in
+the ResultCache, and aggregated on the server to at most one row per pixel before being sent as an image.
+Bar charts only show the top features ranked by fold change or variance.
+"""
+import os
+import numpy as np
+import pandas as pd
+from scipy.cluster.hierarchy import linkage, leaves_list
+from matplotlib import colormaps
+from utils.cache import ResultCache
+
+# larger matrices are clustered on a subset of features, the others are placed next to their closest one
+MAX_CLUSTERED = 4000
+
+
+def cluster_order(values, max_clustered=MAX_CLUSTERED):
+    """Feature (row) order of a hierarchical clustering with average linkage."""
+    values = np.nan_to_num(np.asarray(values, dtype=float), posinf=0, neginf=0)
+    if len(values) < 3:
+        return np.arange(len(values))
+    sampled = np.linspace(0, len(values)-1, min(len(values), max_clustered)).astype(int)
+    leaves = sampled[leaves_list(linkage(values[sampled], "average"))]
+    if len(sampled) == len(values):
+        return leaves
+    # position of the closest clustered feature, computed in chunks to bound the distance matrix
+    position = np.empty(len(values), dtype=int)
+    reference = values[leaves]
+    for start in range(0, len(values), 1000):
+        chunk = values[start:start+1000]
+        distances = (chunk**2).sum(axis=1)[:, None] - 2*chunk @ reference.T + (reference**2).sum(axis=1)[None, :]
+        position[start:start+1000] = distances.argmin(axis=1)
+    position[leaves] = np.arange(len(leaves))
+    return np.lexsort((np.arange(len(values)), position))
+
+
+def cached_cluster_order(df, matrix_hash, cache=None):
+    """cluster_order of a DataFrame, loaded from the cache if the matrix has been clustered before."""
+    cache = cache or ResultCache()
+    key = cache.key("cluster order", matrix_hash, list(map(str, df.columns)), len(df))
+    entry = cache.get(key)
+    if entry is None:
+        with cache.put(key) as entry:
+            np.save(os.path.join(entry, "order.npy"), cluster_order(df.to_numpy()))
+        entry = cache.get(key)
+    return np.load(os.path.join(entry, "order.npy"))
+
+
+def aggregate_rows(df, max_rows=1000):
+    """Means of consecutive blocks of rows so that at most max_rows remain, blocks are named by their first row."""
+    if len(df) <= max_rows:
+        return df
+    blocks = np.arange(len(df)) * max_rows // len(df)
+    aggregated = df.groupby(blocks).mean()
+    aggregated.index = df.index[np.searchsorted(blocks, aggregated.index)].astype(str)
+    return aggregated
+
+
+def raster_image(df, cmap="RdBu_r", symmetric=True):
+    """RGB image (rows x columns x 3, uint8) of a DataFrame and the value range of the color scale."""
+    values = np.asarray(df, dtype=float)
+    finite = values[np.isfinite(values)]
+    vmax = np.abs(finite).max(initial=0) if symmetric else finite.max(initial=0)
+    vmin = -vmax if symmetric else finite.min(initial=0)
+    scaled = (np.clip(np.nan_to_num(values, nan=(vmin+vmax)/2), vmin, vmax) - vmin) / ((vmax - vmin) or 1)
+    return (colormaps[cmap](scaled)[..., :3] * 255).astype(np.uint8), (vmin, vmax)
+
+
+def top_features(df, n, values=None):
+    """The n rows of df with the highest score.
+
+    The score is the largest absolute value per row of values (e.g. log 2 fold changes), or the variance of the
+    rows of df if values is None.
+    """
+    if len(df) <= n:
+        return df
+    if values is None:
+        score = df.var(axis=1)
+    else:
+        score = values.replace([np.inf, -np.inf], np.nan).abs().max(axis=1)
+    order = np.argsort(-np.nan_to_num(score.to_numpy(dtype=float), nan=-np.inf), kind="stable")
+    return df.iloc[np.sort(order[:n])]
+
+
+def search_features(features, query, limit=None):
+    """Features containing query (case insensitive), all features for an empty query."""
+    features = pd.Index(features)
+    if query:
+        features = features[features.astype(str).str.contains(query, case=False, regex=False)]
+    if limit is not None:
+        return features[:limit]
+    return features
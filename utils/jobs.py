@@ -0,0 +1,213 @@
+"""Local job queue for workflows that run in the background of the Streamlit app.
+
+Every job is a folder holding its state as job.json and the output of its process as log.txt. Jobs run in
+their own process (`python -m utils.jobs <job folder>`) which is independent of the Streamlit script run that
+submitted it, so a browser reload or a widget click does not interrupt it and any page can reattach to it later.
+At most max_running jobs run at the same time, the others wait in the queue and are started when a job finishes.
+
+A job calls a module level function given as "module:function" with JSON serializable keyword arguments and a
+progress(message, fraction) callback. Its return value is stored as the result of the job.
+"""
+import importlib
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import traceback
+import uuid
+from contextlib import contextmanager
+
+JOBS_DIR = "jobs"
+MAX_RUNNING = 2
+# running jobs write a heartbeat, jobs without one for STALE_SEC whose process is gone were killed with it
+HEARTBEAT_SEC = 5
+STALE_SEC = 60
+
+
+def write_job(path, job):
+    with tempfile.NamedTemporaryFile("w", dir=path, suffix=".tmp", delete=False) as f:
+        json.dump(job, f, indent=2)
+    os.replace(f.name, os.path.join(path, "job.json"))
+
+
+def read_job(path):
+    with open(os.path.join(path, "job.json"), "r") as f:
+        return json.load(f)
+
+
+def process_alive(pid):
+    """Whether a process with this id exists, None if that can not be checked."""
+    if not pid or os.name == "nt":
+        # os.kill terminates the process on Windows
+        return None
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class JobQueue:
+    def __init__(self, directory=JOBS_DIR, max_running=None):
+        """
+        Parameters
+        ----------
+        directory:
+            folder holding one subfolder per job.
+        max_running:
+            number of jobs running at the same time, stored for the queue when jobs are submitted.
+            None uses the stored value or MAX_RUNNING.
+        """
+        self.directory = directory
+        self.max_running = max_running
+        if max_running is None:
+            self.max_running = MAX_RUNNING
+            if os.path.isfile(os.path.join(directory, "queue.json")):
+                with open(os.path.join(directory, "queue.json"), "r") as f:
+                    self.max_running = json.load(f)["max_running"]
+
+    def path(self, job_id):
+        return os.path.join(self.directory, job_id)
+
+    def submit(self, kind, func, **kwargs):
+        """Queues func(**kwargs, progress=...) and starts it if fewer than max_running jobs run. Returns the job id."""
+        job_id = time.strftime("%Y%m%d-%H%M%S-") + uuid.uuid4().hex[:6]
+        os.makedirs(self.path(job_id))
+        with open(os.path.join(self.directory, "queue.json"), "w") as f:
+            json.dump({"max_running": self.max_running}, f)
+        write_job(self.path(job_id), {"id": job_id, "kind": kind, "func": func, "kwargs": kwargs,
+                                      "status": "queued", "created": time.time(), "started": None, "finished": None,
+                                      "heartbeat": None, "pid": None, "progress": [], "result": None, "error": ""})
+        self.start_queued()
+        return job_id
+
+    def job(self, job_id):
+        """State of a job, running jobs without heartbeat whose process is gone are reported as interrupted.
+
+        A job whose process is still alive but too busy to write its heartbeat keeps running.
+        """
+        job = read_job(self.path(job_id))
+        if (job["status"] in ("starting", "running") and time.time() - (job["heartbeat"] or job["created"]) > STALE_SEC
+                and not process_alive(job.get("pid"))):
+            job["status"] = "interrupted"
+        return job
+
+    def jobs(self, kind=None):
+        """All jobs (of one kind), oldest first."""
+        if not os.path.isdir(self.directory):
+            return []
+        jobs = []
+        for job_id in sorted(os.listdir(self.directory)):
+            if os.path.isfile(os.path.join(self.path(job_id), "job.json")):
+                job = self.job(job_id)
+                if kind is None or job["kind"] == kind:
+                    jobs.append(job)
+        return sorted(jobs, key=lambda job: job["created"])
+
+    def active(self, kind=None):
+        """Jobs (of one kind) that are queued or running."""
+        return [job for job in self.jobs(kind) if job["status"] in ("queued", "starting", "running")]
+
+    def log(self, job_id):
+        path = os.path.join(self.path(job_id), "log.txt")
+        if not os.path.isfile(path):
+            return ""
+        with open(path, "r", errors="replace") as f:
+            return f.read()
+
+    def remove(self, job_id):
+        """Deletes the state of a job that is not running."""
+        if self.job(job_id)["status"] not in ("starting", "running"):
+            shutil.rmtree(self.path(job_id), ignore_errors=True)
+
+    @contextmanager
+    def lock(self):
+        """Lock file so that only one process at a time decides which queued jobs to start."""
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(self.directory, ".lock")
+        while True:
+            try:
+                os.close(os.open(path, os.O_CREAT | os.O_EXCL))
+                break
+            except FileExistsError:
+                try:
+                    if time.time() - os.path.getmtime(path) > STALE_SEC:
+                        os.remove(path)
+                except OSError:
+                    pass
+                time.sleep(0.05)
+        try:
+            yield
+        finally:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def start_queued(self):
+        """Starts queued jobs in submission order as long as fewer than max_running jobs run."""
+        with self.lock():
+            jobs = self.jobs()
+            running = sum(job["status"] in ("starting", "running") for job in jobs)
+            for job in jobs:
+                if running >= self.max_running:
+                    break
+                if job["status"] != "queued":
+                    continue
+                job["status"] = "starting"
+                job["heartbeat"] = time.time()
+                write_job(self.path(job["id"]), job)
+                with open(os.path.join(self.path(job["id"]), "log.txt"), "w") as log:
+                    if os.name == "nt":
+                        detach = {"creationflags": subprocess.CREATE_NEW_PROCESS_GROUP}
+                    else:
+                        detach = {"start_new_session": True}
+                    subprocess.Popen([sys.executable, "-m", "utils.jobs", self.path(job["id"])],
+                                     stdout=log, stderr=subprocess.STDOUT, stdin=subprocess.DEVNULL, **detach)
+                running += 1
+
+
+def run_job(path):
+    """Runs the job in folder path in this process and starts the next queued jobs afterwards."""
+    job = read_job(path)
+    state = threading.Lock()
+
+    def save(**changes):
+        with state:
+            job.update(changes)
+            job["heartbeat"] = time.time()
+            write_job(path, job)
+
+    def progress(message, fraction=None):
+        save(progress=job["progress"] + [[time.time(), message, fraction]])
+
+    stop = threading.Event()
+
+    def heartbeat():
+        while not stop.wait(HEARTBEAT_SEC):
+            save()
+
+    save(status="running", started=time.time(), pid=os.getpid())
+    threading.Thread(target=heartbeat, daemon=True).start()
+    try:
+        module, name = job["func"].split(":")
+        result = getattr(importlib.import_module(module), name)(**job["kwargs"], progress=progress)
+        stop.set()
+        save(status="done", finished=time.time(), result=result)
+    except BaseException as e:
+        stop.set()
+        traceback.print_exc()
+        save(status="failed", finished=time.time(), error=f"{type(e).__name__}: {e}")
+    finally:
+        sys.stdout.flush()
+        JobQueue(os.path.dirname(os.path.abspath(path))).start_queued()
+
+
+if __name__ == "__main__":
+    run_job(sys.argv[1])
@@ -0,0 +1,86 @@
+"""Streamlit widgets to follow the background jobs of a page."""
+import time
+import datetime
+import pandas as pd
+import streamlit as st
+from utils.jobs import JobQueue
+from utils.metrics import load_metrics
+
+POLL_SEC = 2
+
+
+def job_queue_settings(key):
+    """Number input for the number of jobs running at the same time, returns the JobQueue to submit to."""
+    queue = JobQueue()
+    max_running = st.number_input("parallel jobs", 1, 16, queue.max_running, key=key+" parallel jobs",
+                                  help="Number of workflow runs at the same time, further runs wait in the queue.")
+    return JobQueue(max_running=max_running)
+
+
+def show_jobs(kind):
+    """Shows the jobs of one kind with the progress of their stages.
+
+    Jobs are read from disk, so they are shown again after a browser reload. Returns the last finished job or None.
+    """
+    queue = JobQueue()
+    queue.start_queued()
+    jobs = queue.jobs(kind)
+    if not jobs:
+        return None
+    st.markdown("##### Jobs")
+    for job in reversed(jobs):
+        created = datetime.datetime.fromtimestamp(job["created"]).strftime("%Y-%m-%d %H:%M:%S")
+        with st.expander(f"{created}: {job['status']}", expanded=job["status"] in ("queued", "starting", "running", "failed")):
+            if job["status"] in ("queued", "starting", "running"):
+                if job["progress"]:
+                    _, message, fraction = job["progress"][-1]
+                    st.write(message)
+                    if fraction is not None:
+                        st.progress(fraction)
+                else:
+                    st.write("waiting for a free slot" if job["status"] == "queued" else "starting")
+            if job["status"] == "failed":
+                st.error(job["error"])
+            if job["status"] == "interrupted":
+                st.warning("The job process was stopped before it finished.")
+            if job["progress"]:
+                st.dataframe(pd.DataFrame([(datetime.datetime.fromtimestamp(t).strftime("%H:%M:%S"), message) for t, message, _ in job["progress"]],
+                                          columns=["time", "stage"]))
+            if job["status"] in ("failed", "interrupted"):
+                st.code(queue.log(job["id"])[-5000:])
+            if job["status"] not in ("queued", "starting", "running") and st.button("Remove", key="remove job "+job["id"]):
+                queue.remove(job["id"])
+                st.experimental_rerun()
+    finished = [job for job in jobs if job["status"] == "done"]
+    return finished[-1] if finished else None
+
+
+def show_metrics(path):
+    """Timing breakdown of the stages of a run from its metrics file."""
+    stages = load_metrics(path)
+    if not stages:
+        return
+    df = pd.DataFrame([{**{key: value for key, value in stage.items() if key not in ("items", "profile", "worker profiles")},
+                        **{"items": ", ".join(f"{n} {item}" for item, n in stage["items"].items())}}
+                       for stage in stages])
+    df["bytes read"] = (df["bytes read"] / 1024**2).round(1)
+    df["bytes written"] = (df["bytes written"] / 1024**2).round(1)
+    df = df.rename(columns={"bytes read": "read MB", "bytes written": "written MB"})
+    st.bar_chart(df.set_index("stage")[["wall time s", "CPU time s"]])
+    st.dataframe(df)
+    profiles = [stage["profile"] for stage in stages if "profile" in stage]
+    if profiles:
+        st.write("cProfile statistics (open with `python -m pstats <file>` or snakeviz):")
+        st.code("\n".join(profiles))
+    workers = [stage["worker profiles"] for stage in stages if "worker profiles" in stage]
+    if workers:
+        st.write("cProfile statistics of the worker processes, one file per item:")
+        st.code("\n".join(workers))
+
+
+def poll(kind):
+    """Reruns the page every POLL_SEC seconds while jobs of one kind are queued or running, call it last on a page."""
+    if JobQueue().active(kind):
+        if st.checkbox("refresh while jobs are running", True, key=kind+" refresh jobs"):
+            time.sleep(POLL_SEC)
+            st.experimental_rerun()
@@ -0,0 +1,100 @@
+"""Feature matrix loading for the result pages.
+
+A tsv or xlsx feature matrix is parsed once into an uncompressed Arrow IPC file in the ResultCache, keyed by its
+path, size and modification time, unless an up to date Arrow file was written next to it (by write_table or
+utils.consensus). Afterwards only the requested columns are read from the memory-mapped file and the resulting
+DataFrames are kept in a size bounded memo that is shared by all reruns and sessions of the server.
+"""
+import os
+import threading
+from collections import OrderedDict
+import pandas as pd
+import pyarrow as pa
+from utils.cache import ResultCache
+
+MEMO_SIZE_MB = 1000
+
+# (arrow file, mtime, size, columns) -> (DataFrame, size in bytes), least recently used first
+memo = OrderedDict()
+# the server runs every session in its own thread
+memo_lock = threading.Lock()
+
+
+def read_table(path):
+    if path.endswith("xlsx"):
+        return arrow_compatible(pd.read_excel(path))
+    return arrow_compatible(pd.read_csv(path, sep="\t"))
+
+
+def arrow_compatible(df):
+    df.columns = [str(c) for c in df.columns]
+    for column in df.columns:
+        # Arrow columns need a single type, mixed Excel columns are stored as text
+        if df[column].dtype == object:
+            df[column] = df[column].where(df[column].isna(), df[column].astype(str))
+    return df
+
+
+def arrow_path(path):
+    """Arrow file next to a matrix, named with its extension so FeatureMatrix.tsv and .xlsx do not share one."""
+    return path+".arrow"
+
+
+def write_arrow(table, path):
+    # replaced atomically, DataFrames read before are views of the memory-mapped old file
+    tmp = path+".tmp"
+    with pa.OSFile(tmp, "wb") as sink:
+        with pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+    os.replace(tmp, path)
+
+
+def write_table(df, path):
+    """Writes a feature matrix as tsv file and as Arrow file next to it."""
+    df.to_csv(path, sep="\t", index=False)
+    write_arrow(pa.Table.from_pandas(arrow_compatible(df.copy()), preserve_index=False), arrow_path(path))
+
+
+def columnar_file(path, cache=None):
+    """Path of the Arrow IPC file holding the matrix, converted on first use."""
+    stat = os.stat(path)
+    if os.path.isfile(arrow_path(path)) and os.stat(arrow_path(path)).st_mtime_ns >= stat.st_mtime_ns:
+        return arrow_path(path)
+    cache = cache or ResultCache()
+    key = cache.key("feature matrix", os.path.abspath(path), stat.st_size, stat.st_mtime_ns)
+    entry = cache.get(key)
+    if entry is None:
+        table = pa.Table.from_pandas(read_table(path), preserve_index=False)
+        with cache.put(key) as entry:
+            write_arrow(table, os.path.join(entry, "matrix.arrow"))
+        entry = cache.get(key)
+    return os.path.join(entry, "matrix.arrow")
+
+
+def matrix_columns(path):
+    """Column names of a feature matrix, only the schema of the converted file is read."""
+    return pa.ipc.open_file(pa.memory_map(columnar_file(path), "r")).schema.names
+
+
+def load_matrix(path, columns=None):
+    """DataFrame with the given columns of a feature matrix (all if None), missing columns are ignored.
+
+    The DataFrame is shared with other callers and must not be modified in place.
+    """
+    arrow = columnar_file(path)
+    # a replaced file is a new entry, the old one is evicted in time
+    stat = os.stat(arrow)
+    key = (arrow, stat.st_mtime_ns, stat.st_size, None if columns is None else tuple(columns))
+    with memo_lock:
+        if key in memo:
+            memo.move_to_end(key)
+            return memo[key][0]
+    table = pa.ipc.open_file(pa.memory_map(arrow, "r")).read_all()
+    if columns is not None:
+        table = table.select([c for c in dict.fromkeys(columns) if c in table.column_names])
+    df = table.to_pandas()
+    with memo_lock:
+        memo[key] = (df, df.memory_usage(deep=True).sum())
+        while len(memo) > 1 and sum(size for _, size in memo.values()) > MEMO_SIZE_MB*1024**2:
+            memo.popitem(last=False)
+    return df
@@ -0,0 +1,164 @@
+import os
+import sys
+import threading
+
+# interval of MemorySampler
+SAMPLE_SEC = 0.2
+
+
+def peak_memory_mb():
+    """Peak resident memory of the current process in MB, None if it can not be determined.
+
+    This is the maximum over the whole lifetime of the process (or since reset_peak_memory), not of a single call.
+    It only measures a task if the process was started for it, e.g. the worker processes of one run_parallel call,
+    or was reset before it.
+    """
+    # the high-water mark of /proc, unlike ru_maxrss it can be reset and does not keep the peak of the program
+    # that exec'd this one (a spawned multiprocessing child starts with the peak of its parent in ru_maxrss)
+    try:
+        with open("/proc/self/status", "r") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    if sys.platform == "win32":
+        import ctypes
+        from ctypes import wintypes
+
+        class PROCESS_MEMORY_COUNTERS(ctypes.Structure):
+            _fields_ = [("cb", wintypes.DWORD),
+                        ("PageFaultCount", wintypes.DWORD),
+                        ("PeakWorkingSetSize", ctypes.c_size_t),
+                        ("WorkingSetSize", ctypes.c_size_t),
+                        ("QuotaPeakPagedPoolUsage", ctypes.c_size_t),
+                        ("QuotaPagedPoolUsage", ctypes.c_size_t),
+                        ("QuotaPeakNonPagedPoolUsage", ctypes.c_size_t),
+                        ("QuotaNonPagedPoolUsage", ctypes.c_size_t),
+                        ("PagefileUsage", ctypes.c_size_t),
+                        ("PeakPagefileUsage", ctypes.c_size_t)]
+        counters = PROCESS_MEMORY_COUNTERS()
+        counters.cb = ctypes.sizeof(counters)
+        if not ctypes.windll.psapi.GetProcessMemoryInfo(ctypes.windll.kernel32.GetCurrentProcess(),
+                                                        ctypes.byref(counters), counters.cb):
+            return None
+        return counters.PeakWorkingSetSize / 1024**2
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # bytes on macOS, kilobytes on Linux
+    if sys.platform == "darwin":
+        return peak / 1024**2
+    return peak / 1024
+
+
+def reset_peak_memory():
+    """Resets the peak of peak_memory_mb to the current resident memory, returns False where that is not possible
+    (only Linux supports it)."""
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+    except OSError:
+        return False
+    return True
+
+
+def children_peak_memory_mb():
+    """Largest peak resident memory of the terminated worker processes of this process in MB, None if unknown."""
+    if sys.platform == "win32":
+        return None
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    if sys.platform == "darwin":
+        return peak / 1024**2
+    return peak / 1024
+
+
+def child_pids(pid):
+    """Ids of the child processes of a process, None if the kernel does not list them (/proc/<pid>/task/*/children)."""
+    task_dir = os.path.join("/proc", str(pid), "task")
+    pids = []
+    try:
+        tasks = os.listdir(task_dir)
+    except OSError:
+        return []
+    for task in tasks:
+        try:
+            # children are listed by the thread that started them
+            with open(os.path.join(task_dir, task, "children"), "r") as f:
+                pids += [int(child) for child in f.read().split()]
+        except FileNotFoundError:
+            if not os.path.exists(os.path.join(task_dir, task)):
+                continue
+            return None
+        except OSError:
+            continue
+    return pids
+
+
+def process_tree_memory_mb(pid=None):
+    """Resident memory of a process (default this one) and all its descendants in MB, None where the process tree
+    can not be read from /proc (not Linux or a kernel without CONFIG_PROC_CHILDREN).
+
+    Only the process tree is walked, not all processes. Pages shared between the processes, e.g. after fork, are
+    counted once per process.
+    """
+    pid = pid or os.getpid()
+    if not os.path.isdir("/proc/self"):
+        return None
+    pages, todo = 0, [pid]
+    while todo:
+        pid = todo.pop()
+        try:
+            with open(os.path.join("/proc", str(pid), "statm"), "r") as f:
+                pages += int(f.read().split()[1])
+        except OSError:
+            continue
+        children = child_pids(pid)
+        if children is None:
+            return None
+        todo.extend(children)
+    return pages * os.sysconf("SC_PAGE_SIZE") / 1024**2
+
+
+class MemorySampler:
+    """Samples process_tree_memory_mb in a thread every interval seconds between start and stop (or as context manager).
+
+    peak is the largest sample in MB, None where the memory can not be sampled. Spikes shorter than the interval
+    may be missed.
+    """
+    def __init__(self, interval=SAMPLE_SEC):
+        self.interval = interval
+        self.peak = None
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    def sample(self):
+        memory = process_tree_memory_mb()
+        if memory is not None:
+            self.peak = max(self.peak or 0, memory)
+
+    def run(self):
+        self.sample()
+        while not self.stopped.wait(self.interval):
+            self.sample()
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+        self.thread.join()
+        self.sample()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stop()
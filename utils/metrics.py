@@ -0,0 +1,166 @@
+"""Timing and resource metrics of workflow stages.
+
+Every stage records its wall time, the CPU time of this process and of the worker processes that finished during
+the stage, the peak memory of this process and its workers during the stage, the bytes of its input and output
+files and the number of items (files, spectra, features) it processed. Spectra of input mzML files and the features
+and consensus features of its outputs are counted from the files, blocks can add their own counts. Memory is
+sampled while the stage runs, where that is not possible (no /proc) the peak of the processes since they started is
+recorded as "process peak so far MB" instead. The metrics of a run are written to a JSON file after every stage.
+With profile=True each stage is additionally run under cProfile and its statistics are stored next to the metrics
+file, e.g. for `python -m pstats profiles/FeatureFinderMetabo.prof` or snakeviz. The work a stage hands to
+run_parallel is profiled in the worker processes, one file per item in a folder named after the stage
+(profiles/FeatureFinderMetabo/<mzML file>.prof).
+"""
+import cProfile
+import json
+import os
+import re
+import time
+from contextlib import contextmanager
+from utils import parallel
+from utils.memory import peak_memory_mb, children_peak_memory_mb, MemorySampler
+
+
+def path_size(path):
+    """Size of a file or of all files in a directory in bytes."""
+    if not path or not os.path.exists(path):
+        return 0
+    if os.path.isfile(path):
+        return os.path.getsize(path)
+    return sum(os.path.getsize(os.path.join(root, f)) for root, _, files in os.walk(path) for f in files)
+
+
+def count_files(path):
+    if not path or not os.path.exists(path):
+        return 0
+    if os.path.isfile(path):
+        return 1
+    return sum(len(files) for _, _, files in os.walk(path))
+
+
+# counts at the top of mzML and featureXML files, the tags are within the first chunks
+COUNT_TAGS = {".mzML": (rb'<spectrumList count="(\d+)"', "spectra"), ".featureXML": (rb'<featureList count="(\d+)"', "features")}
+CHUNK_BYTES = 1024**2
+
+
+def files_in(path):
+    if not path or not os.path.exists(path):
+        return []
+    if os.path.isfile(path):
+        return [path]
+    return [os.path.join(root, f) for root, _, files in os.walk(path) for f in files]
+
+
+def count_items(path):
+    """{item: count} of the spectra of mzML files, features of featureXML files and exported feature tables and the
+    consensus features of consensusXML files in a file or folder."""
+    items = {}
+    for file in files_in(path):
+        if file.endswith(".summary.json"):
+            with open(file, "r") as f:
+                items["features"] = items.get("features", 0) + json.load(f)["features"]
+            continue
+        ext = os.path.splitext(file)[1]
+        if ext in COUNT_TAGS:
+            pattern, item = COUNT_TAGS[ext]
+            with open(file, "rb") as f:
+                head = b""
+                for _ in range(4):
+                    head += f.read(CHUNK_BYTES)
+                    match = re.search(pattern, head)
+                    if match:
+                        items[item] = items.get(item, 0) + int(match.group(1))
+                        break
+        elif ext == ".consensusXML":
+            # consensusXML files hold no count, the elements are counted without parsing
+            tag, n, tail = b"<consensusElement ", 0, b""
+            with open(file, "rb") as f:
+                for chunk in iter(lambda: f.read(CHUNK_BYTES), b""):
+                    data = tail + chunk
+                    n += data.count(tag)
+                    # too short to hold a whole tag, so none is counted twice
+                    tail = data[-(len(tag)-1):]
+            items["consensus features"] = items.get("consensus features", 0) + n
+    return items
+
+
+def cpu_seconds():
+    """CPU time of this process and its terminated children."""
+    times = os.times()
+    return times.user + times.system + times.children_user + times.children_system
+
+
+class Metrics:
+    def __init__(self, path, profile=False):
+        """
+        Parameters
+        ----------
+        path:
+            JSON file the stage metrics are written to.
+        profile:
+            run every stage under cProfile and store the statistics in a profiles folder next to path.
+        """
+        self.path = path
+        self.profile = profile
+        self.stages = []
+
+    @contextmanager
+    def stage(self, name, inputs=(), outputs=(), status="computed"):
+        """Measures the block as one stage, yields a dict to which the block can add "items" counts."""
+        stage = {"stage": name, "status": status, "items": {}}
+        bytes_read = sum(path_size(p) for p in inputs)
+        stage["items"]["input files"] = sum(count_files(p) for p in inputs)
+        for path in inputs:
+            spectra = count_items(path).get("spectra")
+            if spectra:
+                stage["items"]["spectra"] = stage["items"].get("spectra", 0) + spectra
+        profiler = cProfile.Profile() if self.profile and status == "computed" else None
+        if profiler is not None:
+            profile = os.path.join(os.path.dirname(self.path), "profiles", re.sub(r"[^\w.-]+", "_", name))
+            parallel.profile_dir = profile
+        wall, cpu = time.perf_counter(), cpu_seconds()
+        memory = MemorySampler()
+        memory.start()
+        if profiler is not None:
+            profiler.enable()
+        try:
+            yield stage
+        finally:
+            if profiler is not None:
+                profiler.disable()
+                parallel.profile_dir = None
+            memory.stop()
+            stage["wall time s"] = time.perf_counter() - wall
+            stage["CPU time s"] = cpu_seconds() - cpu
+            if memory.peak is not None:
+                stage["peak memory MB"] = memory.peak
+            else:
+                stage["process peak so far MB"] = max(filter(None, [peak_memory_mb(), children_peak_memory_mb()]),
+                                                      default=None)
+            stage["bytes read"] = bytes_read
+            stage["bytes written"] = sum(path_size(p) for p in outputs)
+            for path in outputs:
+                for item, n in count_items(path).items():
+                    if item != "spectra":
+                        stage["items"][item] = stage["items"].get(item, 0) + n
+            if profiler is not None:
+                os.makedirs(os.path.dirname(profile), exist_ok=True)
+                profiler.dump_stats(profile+".prof")
+                stage["profile"] = profile+".prof"
+                if os.path.isdir(profile):
+                    stage["worker profiles"] = profile
+            self.stages.append(stage)
+            self.save()
+
+    def save(self):
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        with open(self.path, "w") as f:
+            json.dump({"stages": self.stages}, f, indent=2)
+
+
+def load_metrics(path):
+    """Stage metrics of a run as list of dicts, empty if the run wrote none."""
+    if not os.path.isfile(path):
+        return []
+    with open(path, "r") as f:
+        return json.load(f)["stages"]
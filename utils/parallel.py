@@ -0,0 +1,52 @@
+import cProfile
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+# folder for the cProfile statistics of every item, set by Metrics.stage while a profiled stage runs
+profile_dir = None
+
+
+def default_workers():
+    return os.cpu_count() or 1
+
+
+def item_name(item):
+    """File name for the statistics of an item, a file or a tuple starting with one."""
+    if isinstance(item, (tuple, list)):
+        item = item[0]
+    return re.sub(r"[^\w.-]+", "_", os.path.basename(str(item)))
+
+
+def profiled(func, item, directory, /, **kwargs):
+    """func(item, **kwargs) under cProfile in the worker process, the statistics are stored as directory/<item>.prof."""
+    profiler = cProfile.Profile()
+    try:
+        return profiler.runcall(func, item, **kwargs)
+    finally:
+        os.makedirs(directory, exist_ok=True)
+        profiler.dump_stats(os.path.join(directory, item_name(item)+".prof"))
+
+
+def run_parallel(func, items, workers=None, **kwargs):
+    """Runs func(item, **kwargs) for every item in a process pool.
+
+    Yields (item, result, error) tuples in the order the items finish. An exception raised for one item
+    is returned as error (result None) and does not stop the remaining items.
+    func has to be a module level function so it can be sent to the worker processes. While profile_dir is set
+    every item is profiled in its worker.
+    """
+    items = list(items)
+    if not items:
+        return
+    workers = min(workers or default_workers(), len(items))
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        if profile_dir is None:
+            futures = {executor.submit(func, item, **kwargs): item for item in items}
+        else:
+            futures = {executor.submit(profiled, func, item, profile_dir, **kwargs): item for item in items}
+        for future in as_completed(futures):
+            try:
+                yield futures[future], future.result(), None
+            except Exception as e:
+                yield futures[future], None, e
@@ -0,0 +1,62 @@
+"""Index of the spectra of an mzML file by retention time, MS level and polarity, kept in the ResultCache.
+
+Indexed mzML files store the byte offset of every spectrum, so together with this index single spectra can be
+decoded by position (OnDiscMSExperiment). Spectra of other MS levels or polarities are skipped without decoding
+them and a target with a retention time window only needs the spectra within it.
+"""
+import os
+import numpy as np
+from pyopenms import OnDiscMSExperiment
+from utils.cache import ResultCache
+
+# polarity filter names and the values of pyopenms IonSource.Polarity
+POLARITIES = {"any": None, "positive": 1, "negative": 2}
+
+
+def build_scan_index(file):
+    """Retention time (s), MS level and polarity of every spectrum of an indexed mzML file, None without index."""
+    exp = OnDiscMSExperiment()
+    if not exp.openFile(file):
+        return None
+    meta = exp.getMetaData()
+    return {"rt": np.array([spec.getRT() for spec in meta], dtype=float),
+            "ms_level": np.array([spec.getMSLevel() for spec in meta], dtype=np.int8),
+            "polarity": np.array([spec.getInstrumentSettings().getPolarity().value for spec in meta], dtype=np.int8)}
+
+
+def scan_index(file, cache=None):
+    """build_scan_index of a file, read from the cache if the file content has been indexed before."""
+    cache = cache or ResultCache()
+    key = cache.key("scan index", cache.file_hash(file), ["rt", "ms_level", "polarity"])
+    entry = cache.get(key)
+    if entry is None:
+        index = build_scan_index(file)
+        with cache.put(key) as entry:
+            # files without index are remembered as such, an empty entry
+            if index is not None:
+                np.savez(os.path.join(entry, "index.npz"), **index)
+        entry = cache.get(key)
+    if not os.path.isfile(os.path.join(entry, "index.npz")):
+        return None
+    with np.load(os.path.join(entry, "index.npz")) as index:
+        return dict(index)
+
+
+def scans_in_windows(rt, times):
+    """Positions of the spectra with start < RT < end for every (start, end) window in times, as arrays."""
+    order = np.argsort(rt, kind="stable")
+    sorted_rt = rt[order]
+    scans = []
+    for start, end in times:
+        lo = np.searchsorted(sorted_rt, start, side="right")
+        hi = np.searchsorted(sorted_rt, end, side="left")
+        scans.append(np.sort(order[lo:hi]))
+    return scans
+
+
+def select_scans(index, ms_level=1, polarity="any"):
+    """Positions of the spectra of one MS level and polarity ("any", "positive" or "negative")."""
+    selected = index["ms_level"] == ms_level
+    if POLARITIES[polarity] is not None:
+        selected &= index["polarity"] == POLARITIES[polarity]
+    return np.flatnonzero(selected)
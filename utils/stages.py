@@ -0,0 +1,94 @@
+"""Incremental execution of workflow stages.
+
+Every stage records a fingerprint over its arguments and the fingerprints of its input files and directories.
+Outputs of a stage inherit the fingerprint of the stage, inputs that were not produced by a stage are
+fingerprinted by size and modification time. On the next run a stage is only executed again if its fingerprint
+changed or one of its outputs is missing, so changes propagate only to the stages downstream of them.
+"""
+import hashlib
+import json
+import os
+import shutil
+
+
+class Pipeline:
+    # keyword arguments that do not change the results of a stage
+    untracked = ("workers",)
+
+    def __init__(self, directory, force=False, metrics=None):
+        """
+        Parameters
+        ----------
+        directory:
+            folder holding the stage state file, usually the interim results folder.
+        force:
+            run every stage regardless of its previous fingerprint.
+        metrics:
+            optional Metrics instance that records every stage.
+        """
+        self.directory = directory
+        self.metrics = metrics
+        self.state_file = os.path.join(directory, "stages.json")
+        self.force = force
+        self.state = {"stages": {}, "artifacts": {}}
+        if os.path.isfile(self.state_file) and not force:
+            with open(self.state_file, "r") as f:
+                self.state = json.load(f)
+        self.report = []
+
+    def path_fingerprint(self, path):
+        if not path:
+            return None
+        path = os.path.normpath(path)
+        if path in self.state["artifacts"]:
+            return self.state["artifacts"][path]
+        if os.path.isdir(path):
+            return [(os.path.relpath(os.path.join(root, f), path), os.path.getsize(os.path.join(root, f)),
+                     os.path.getmtime(os.path.join(root, f)))
+                    for root, _, files in sorted(os.walk(path)) for f in sorted(files)]
+        if os.path.isfile(path):
+            return [os.path.getsize(path), os.path.getmtime(path)]
+        return None
+
+    def fingerprint(self, name, inputs, args, kwargs):
+        kwargs = {key: value for key, value in kwargs.items() if key not in self.untracked}
+        content = [name, [self.path_fingerprint(p) for p in inputs], args, kwargs]
+        return hashlib.sha256(json.dumps(content, sort_keys=True, default=str).encode()).hexdigest()
+
+    def run(self, name, inputs, outputs, func, *args, **kwargs):
+        """Calls func(*args, **kwargs) unless the stage can be reused from the previous run.
+
+        inputs and outputs are the files and directories the stage reads and writes. Existing outputs are
+        deleted before the stage runs. Returns True if the stage was executed.
+        """
+        fingerprint = self.fingerprint(name, inputs, args, kwargs)
+        if self.state["stages"].get(name) == fingerprint and all(os.path.exists(p) for p in outputs):
+            self.report.append((name, "reused"))
+            if self.metrics is not None:
+                with self.metrics.stage(name, status="reused"):
+                    pass
+            return False
+        for path in outputs:
+            if os.path.isdir(path):
+                shutil.rmtree(path)
+            elif os.path.isfile(path):
+                os.remove(path)
+        # forget the old fingerprint first, a failing stage must not leave reusable looking outputs behind
+        self.state["stages"].pop(name, None)
+        self.save()
+        if self.metrics is not None:
+            with self.metrics.stage(name, inputs, outputs):
+                func(*args, **kwargs)
+        else:
+            func(*args, **kwargs)
+        self.state["stages"][name] = fingerprint
+        for path in outputs:
+            self.state["artifacts"][os.path.normpath(path)] = fingerprint
+        self.save()
+        self.report.append((name, "computed"))
+        return True
+
+    def save(self):
+        os.makedirs(self.directory, exist_ok=True)
+        with open(self.state_file, "w") as f:
+            json.dump(self.state, f, indent=2)
@@ -0,0 +1,108 @@
+"""Fold changes and t-tests over feature matrices (features x samples).
+
+Replicates are samples sharing the name before a `#`, e.g. `sample#1.mzML` and `sample#2.mzML` are replicates
+of `sample`. The replicate groups are parsed once into column indices, means, standard deviations, log 2 fold
+changes and Welch's t-tests are then computed for all features of a group pair at once.
+"""
+import hashlib
+import numpy as np
+import pandas as pd
+from scipy.stats import t as t_distribution
+
+
+def replicate_groups(samples):
+    """Maps each group name to the column indices of its replicates."""
+    groups = {}
+    for i, sample in enumerate(samples):
+        groups.setdefault(sample.split("#")[0], []).append(i)
+    return {name: np.array(indices) for name, indices in groups.items()}
+
+
+def normalize(values, method):
+    """Normalized copy of a (features x samples) array, method is "do not", "per sample" or "across feature map"."""
+    values = values.astype(float)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        if method == "per sample":
+            # maximum absolute scaling of each sample
+            return np.nan_to_num(values / np.abs(values).max(axis=0, initial=0))
+        if method == "across feature map":
+            return np.nan_to_num(values / np.abs(values).max(initial=0))
+    return values
+
+
+def fdr(p_values):
+    """Benjamini-Hochberg adjusted p-values along the first axis, NaN p-values are ignored."""
+    p_values = np.asarray(p_values, dtype=float).reshape(len(p_values), -1)
+    q_values = np.full(p_values.shape, np.nan)
+    for j in range(p_values.shape[1]):
+        valid = np.flatnonzero(~np.isnan(p_values[:, j]))
+        if not len(valid):
+            continue
+        order = valid[np.argsort(p_values[valid, j])]
+        ranked = p_values[order, j] * len(valid) / np.arange(1, len(valid)+1)
+        q_values[order, j] = np.minimum(np.minimum.accumulate(ranked[::-1])[::-1], 1)
+    return q_values
+
+
+def welch_t_test(a, b):
+    """Two-sided p-values of Welch's t-test between the rows of a and b (NaN with less than 2 replicates)."""
+    n_a, n_b = a.shape[1], b.shape[1]
+    if n_a < 2 or n_b < 2:
+        return np.full(a.shape[0], np.nan)
+    var_a = a.var(axis=1, ddof=1) / n_a
+    var_b = b.var(axis=1, ddof=1) / n_b
+    with np.errstate(divide="ignore", invalid="ignore"):
+        t = (a.mean(axis=1) - b.mean(axis=1)) / np.sqrt(var_a + var_b)
+        dof = (var_a + var_b)**2 / (var_a**2/(n_a-1) + var_b**2/(n_b-1))
+    return 2 * t_distribution.sf(np.abs(t), dof)
+
+
+def matrix_hash(df):
+    """Hash over the values, feature and sample names of a DataFrame."""
+    sha = hashlib.sha256(pd.util.hash_pandas_object(df, index=True).to_numpy().tobytes())
+    sha.update("\t".join(map(str, df.columns)).encode())
+    return sha.hexdigest()
+
+
+class FeatureStatistics:
+    """Statistics of one feature matrix, results are memoized per pair list and normalization."""
+    def __init__(self, df):
+        self.features = df.index
+        self.samples = list(df.columns)
+        self.values = df.to_numpy(dtype=float)
+        self.hash = matrix_hash(df)
+        self.groups = replicate_groups(self.samples)
+        self.normalized = {}
+        self.results = {}
+
+    def normalize(self, method):
+        """DataFrame with the normalized matrix."""
+        if method not in self.normalized:
+            self.normalized[method] = pd.DataFrame(normalize(self.values, method), index=self.features, columns=self.samples)
+        return self.normalized[method]
+
+    def compare(self, pairs, method="do not"):
+        """Mean, standard deviation, log 2 fold change, p-value and FDR DataFrames for (a, b) group pairs.
+
+        Means and standard deviations have one column per group in pairs, the others one column `a/b`
+        per pair with the fold change of a over b.
+        """
+        key = (tuple(tuple(pair) for pair in pairs), method)
+        if key not in self.results:
+            values = self.normalize(method).to_numpy()
+            pairs = [(a, b) for a, b in pairs if a in self.groups and b in self.groups]
+            names = list(dict.fromkeys(name for pair in pairs for name in pair))
+            means = {name: values[:, self.groups[name]].mean(axis=1) for name in names}
+            stds = {name: values[:, self.groups[name]].std(axis=1, ddof=1) if len(self.groups[name]) > 1
+                    else np.zeros(len(values)) for name in names}
+            columns = [a+"/"+b for a, b in pairs]
+            with np.errstate(divide="ignore", invalid="ignore"):
+                changes = [np.log2(means[a] / means[b]) for a, b in pairs]
+            p_values = np.array([welch_t_test(values[:, self.groups[a]], values[:, self.groups[b]])
+                                 for a, b in pairs]).T.reshape(len(values), len(pairs))
+            self.results[key] = (pd.DataFrame(means, index=self.features, columns=names),
+                                 pd.DataFrame(stds, index=self.features, columns=names),
+                                 pd.DataFrame(np.array(changes).T.reshape(len(values), len(pairs)), index=self.features, columns=columns),
+                                 pd.DataFrame(p_values, index=self.features, columns=columns),
+                                 pd.DataFrame(fdr(p_values), index=self.features, columns=columns))
+        return self.results[key]
@@ -0,0 +1,77 @@
+import os
+import shutil
+from pymetabo.core import FeatureFinderMetaboIdent
+from pymetabo.dataframes import DataFrames
+import pandas as pd
+from utils.chromstore import ChromatogramStore
+from utils.parallel import run_parallel
+from utils.cache import ResultCache
+from utils.metrics import Metrics
+
+
+def quantify_file(file, results_dir, library, params, time_unit="seconds", cache=None):
+    """Runs FeatureFinderMetaboIdent on one mzML file and stores AUC tables in results_dir and the chromatograms in its store.
+
+    Module level so it can run in a worker process. With a ResultCache the tables of a file that has been
+    quantified before with the same library and parameters are copied from the cache instead.
+    """
+    sample = os.path.basename(file)[:-5]
+    store = ChromatogramStore(os.path.join(results_dir, "chromatograms"))
+    # cache entry file names, independent of the sample name since the key only depends on the file content
+    outputs = {"AUC.ftr": os.path.join(results_dir, sample+"AUC.ftr"),
+               "AUC_combined.ftr": os.path.join(results_dir, sample+"AUC_combined.ftr"),
+               "chrom.arrow": store.path(sample)}
+    if cache is not None:
+        key = cache.key("FFMID", cache.file_hash(file), cache.file_hash(library), params, time_unit, "arrow", "fixed names")
+        entry = cache.get(key)
+        if entry is not None:
+            os.makedirs(store.directory, exist_ok=True)
+            for name, path in outputs.items():
+                shutil.copy(os.path.join(entry, name), path)
+            return
+    featureXML = os.path.join(results_dir, sample+".featureXML")
+    FeatureFinderMetaboIdent().run(file, featureXML, library, params=params)
+
+    DataFrames().FFMID_chroms_to_df(featureXML, os.path.join(results_dir, sample+".ftr"), time_unit=time_unit)
+
+    DataFrames().FFMID_auc_to_df(featureXML, os.path.join(results_dir, sample+"AUC.ftr"))
+
+    DataFrames().FFMID_auc_combined_to_df(os.path.join(results_dir, sample+"AUC.ftr"),
+                                          os.path.join(results_dir, sample+"AUC_combined.ftr"))
+
+    os.remove(featureXML)
+    store.write(sample, pd.read_feather(os.path.join(results_dir, sample+".ftr")))
+    os.remove(os.path.join(results_dir, sample+".ftr"))
+
+    if cache is not None:
+        with cache.put(key) as entry:
+            for name, path in outputs.items():
+                shutil.copy(path, os.path.join(entry, name))
+
+
+def quantify_files(mzML_files, results_dir, library, params, time_unit="seconds", use_cache=True, workers=None, progress=None,
+                   profile=False):
+    """Quantifies all mzML files into a fresh results_dir with one worker process per file.
+
+    progress(message, fraction) is called after each file. Stage timings are written to results_dir/metrics.json
+    (with cProfile statistics if profile). Returns the errors per file.
+    """
+    if os.path.isdir(results_dir):
+        shutil.rmtree(results_dir)
+    os.makedirs(results_dir)
+    metrics = Metrics(os.path.join(results_dir, "metrics.json"), profile)
+    errors = {}
+    with metrics.stage("FeatureFinderMetaboIdent", mzML_files, [results_dir]) as stage:
+        stage["items"]["files"] = 0
+        for i, (file, _, error) in enumerate(run_parallel(quantify_file, mzML_files, workers,
+                                                           results_dir=results_dir, library=library, params=params,
+                                                           time_unit=time_unit, cache=ResultCache() if use_cache else None)):
+            if error:
+                errors[os.path.basename(file)] = str(error)
+            else:
+                stage["items"]["files"] += 1
+            if progress is not None:
+                progress("Extracted from: " + os.path.basename(file), (i+1)/len(mzML_files))
+    with metrics.stage("Cache eviction"):
+        ResultCache().evict()
+    return {"errors": errors}
@@ -0,0 +1,290 @@
+"""The untargeted workflow and its per-sample stages that run on one file per worker process."""
+import os
+from pyopenms import FeatureMap, FeatureXMLFile, IDMapper, PeptideIdentificationList
+from pymetabo.core import (FeatureFinderMetabo, MapAligner, MetaboliteAdductDecharger, FeatureLinker, FeatureMapHelper,
+                           FeatureFinderMetaboIdent)
+from pymetabo.sirius import Sirius
+from pymetabo.gnps import GNPSExport
+from utils.parallel import run_parallel
+from utils.stages import Pipeline
+from utils.metrics import Metrics
+from utils.consensus import write_consensus_table, export_metadata
+from utils.gapfill import fill_gaps
+from utils.workspace import link_files, load_aligned, align_file
+from utils.annotation import annotate_table, save_ms1_ids
+from utils.accuratemass import search_table
+
+
+def files_in(directory, extension):
+    return sorted(os.path.join(directory, f) for f in os.listdir(directory) if f.endswith(extension))
+
+
+def run_per_file(func, items, workers=None, **kwargs):
+    """Runs func for every item in a process pool and raises if any of them failed."""
+    errors = [(item, error) for item, _, error in run_parallel(func, items, workers, **kwargs) if error]
+    if errors:
+        raise RuntimeError("\n".join(f"{item}: {error}" for item, error in errors))
+
+
+def detect_features_file(mzML, featureXML_dir, params):
+    FeatureFinderMetabo().run(mzML, os.path.join(featureXML_dir, os.path.basename(mzML)[:-4]+"featureXML"), params)
+
+
+def detect_features(mzML_dir, featureXML_dir, params, workers=None):
+    """FeatureFinderMetabo with one worker per mzML file."""
+    os.makedirs(featureXML_dir, exist_ok=True)
+    run_per_file(detect_features_file, files_in(mzML_dir, ".mzML"), workers, featureXML_dir=featureXML_dir, params=params)
+
+
+def map_ids_file(files, featureXML_out_dir, trafo_dir=None):
+    mzML, featureXML = files
+    exp = load_aligned(mzML, trafo_dir)
+    fm = FeatureMap()
+    FeatureXMLFile().load(featureXML, fm)
+    IDMapper().annotate(fm, PeptideIdentificationList(), [], False, True, exp)
+    FeatureXMLFile().store(os.path.join(featureXML_out_dir, os.path.basename(featureXML)), fm)
+
+
+def map_ids(mzML_dir, featureXML_dir, featureXML_out_dir, trafo_dir=None, workers=None):
+    """Maps MS2 spectra to features with one worker per sample, mzML and featureXML files are matched by name.
+
+    With trafo_dir the spectra of the unaligned mzML files are aligned in memory before mapping.
+    """
+    os.makedirs(featureXML_out_dir, exist_ok=True)
+    featureXMLs = {os.path.basename(f)[:-11]: f for f in files_in(featureXML_dir, ".featureXML")}
+    pairs = [(mzML, featureXMLs[os.path.basename(mzML)[:-5]]) for mzML in files_in(mzML_dir, ".mzML")
+             if os.path.basename(mzML)[:-5] in featureXMLs]
+    run_per_file(map_ids_file, pairs, workers, featureXML_out_dir=featureXML_out_dir, trafo_dir=trafo_dir)
+
+
+def align_mzML(mzML_dir, trafo_dir, mzML_out_dir, workers=None):
+    """Writes retention time aligned mzML files for tools that can only read them from disk."""
+    os.makedirs(mzML_out_dir, exist_ok=True)
+    run_per_file(align_file, files_in(mzML_dir, ".mzML"), workers, trafo_dir=trafo_dir, mzML_out_dir=mzML_out_dir)
+
+
+def create_tables(interim, results_dir, requantified, sirius_ms_dir, ms1_annotation_file, annotation_mz_window_ppm, annoation_rt_window_sec,
+                  ams_maps="", ams_adducts="", ams_mz_window_ppm=10):
+    """Feature tables of the linked and, if requantified (consensusXML file) is given, the re-quantified features."""
+    if requantified:
+        write_consensus_table(requantified, os.path.join(results_dir, "FeatureMatrixRequantified.tsv"), sirius_ms_dir)
+        write_consensus_table(os.path.join(interim, "FeatureMatrix.consensusXML"), os.path.join(results_dir, "FeatureMatrix.tsv"))
+        export_metadata(requantified, os.path.join(results_dir, "MetaData.tsv"))
+    else:
+        write_consensus_table(os.path.join(interim, "FeatureMatrix.consensusXML"),
+                              os.path.join(results_dir, "FeatureMatrix.tsv"), sirius_ms_dir)
+        export_metadata(os.path.join(interim, "FeatureMatrix.consensusXML"), os.path.join(results_dir, "MetaData.tsv"))
+
+    if ms1_annotation_file and requantified:
+        annotate_table(os.path.join(results_dir, "FeatureMatrixRequantified.tsv"), ms1_annotation_file, annotation_mz_window_ppm, annoation_rt_window_sec)
+        save_ms1_ids(os.path.join(results_dir, "FeatureMatrixRequantified.tsv"), os.path.join(results_dir, "MS1-annotations.tsv"))
+    elif ms1_annotation_file:
+        annotate_table(os.path.join(results_dir, "FeatureMatrix.tsv"), ms1_annotation_file, annotation_mz_window_ppm, annoation_rt_window_sec)
+        save_ms1_ids(os.path.join(results_dir, "FeatureMatrix.tsv"), os.path.join(results_dir, "MS1-annotations.tsv"))
+
+    if ams_maps:
+        search_table(os.path.join(results_dir, "FeatureMatrixRequantified.tsv" if requantified else "FeatureMatrix.tsv"),
+                     ams_maps, ams_maps.replace("_maps.tsv", "_structs.tsv"), ams_adducts, ams_mz_window_ppm)
+
+
+def run_workflow(mzML_files, results_dir, params, force=False, workers=None, progress=None, profile=False):
+    """Runs all stages of the untargeted workflow, stages with unchanged inputs and parameters are re-used.
+
+    params holds one entry per step as set on the Untargeted Metabolomics page, optional steps are disabled with
+    None (or False for the Sirius and GNPS exports):
+    "FeatureFinderMetabo", "MapAligner", "FeatureFinderMetaboIdent" (re-quantification), "Gap filling"
+    ("mz_window_ppm", "rt_window_sec", used instead of re-quantification), "MetaboliteAdductDecharger"
+    (with "potential_adducts" as one adduct per line), "FeatureLinker", "Sirius", "GNPS",
+    "MS1 annotation" ("file", "mz_window_ppm", "rt_window_sec") and "AccurateMassSearch" ("maps", "adducts", "mz_window_ppm").
+
+    progress(message, fraction) is called before each step. Timings of all stages are written to
+    results_dir/metrics.json, with profile=True also cProfile statistics per stage. Returns the list of
+    (stage, status) of the run.
+    """
+    ffmid = params.get("FeatureFinderMetaboIdent")
+    gap_filling = params.get("Gap filling") if not ffmid else None
+    ad = params.get("MetaboliteAdductDecharger")
+    use_sirius = params.get("Sirius", False)
+    use_gnps = params.get("GNPS", False)
+    ms1 = params.get("MS1 annotation")
+    ams = params.get("AccurateMassSearch")
+    steps = ["Fetching mzML file data...", "Detecting features...", "Aligning feature maps..."]
+    if ffmid or use_sirius:
+        steps.append("Aligning mzML files...")
+    if ad:
+        steps.append("Determining adducts...")
+    steps += ["Mapping MS2 data to features...", "Linking features..."]
+    if ffmid:
+        steps += ["Re-quantifying features with missing values..."] + (["Determining adducts..."] if ad else []) + \
+                 ["Mapping MS2 data to re-quantified features...", "Linking re-quantified features..."]
+    if gap_filling:
+        steps.append("Filling missing values...")
+    steps += (["Exporting files for Sirius..."] if use_sirius else []) + (["Exporting files for GNPS..."] if use_gnps else [])
+    steps.append("Creating feature tables...")
+    done = []
+
+    def step(message):
+        if progress is not None:
+            progress(message, len(done)/len(steps))
+        done.append(message)
+
+    if ad:
+        ad_params = {"potential_adducts": [line.encode() for line in ad["potential_adducts"].split("\n")],
+                     "charge_min": ad["charge_min"],
+                     "charge_max": ad["charge_max"],
+                     "max_neutrals": 2,
+                     "negative_mode": ad["negative_mode"]}
+
+    interim = os.path.join(results_dir, "interim")
+    pipeline = Pipeline(interim, force, Metrics(os.path.join(results_dir, "metrics.json"), profile))
+
+    step("Fetching mzML file data...")
+    mzML_dir = os.path.join(interim, "mzML_original")
+    pipeline.run("Fetch mzML files", mzML_files, [mzML_dir], link_files, sorted(mzML_files), mzML_dir)
+
+    step("Detecting features...")
+    pipeline.run("FeatureFinderMetabo", [mzML_dir], [os.path.join(interim, "FFM")],
+                 detect_features, mzML_dir, os.path.join(interim, "FFM"), params["FeatureFinderMetabo"], workers=workers)
+
+    step("Aligning feature maps...")
+    pipeline.run("MapAligner featureXML", [os.path.join(interim, "FFM")],
+                 [os.path.join(interim, "FFM_aligned"), os.path.join(interim, "Trafo")],
+                 MapAligner().run, os.path.join(interim, "FFM"), os.path.join(interim, "FFM_aligned"),
+                     os.path.join(interim, "Trafo"),
+                     {"max_num_peaks_considered": -1,
+                      "superimposer:mz_pair_max_distance": 0.05,
+                      **params["MapAligner"]})
+
+    # aligned spectra are only written to disk for tools that can not apply the RT transformation themselves,
+    # FeatureFinderMetaboIdent and the Sirius export read them from a folder
+    trafo_dir = os.path.join(interim, "Trafo")
+    mzML_aligned_dir = os.path.join(interim, "mzML_aligned")
+    if ffmid or use_sirius:
+        step("Aligning mzML files...")
+        pipeline.run("Align mzML files", [mzML_dir, trafo_dir], [mzML_aligned_dir],
+                     align_mzML, mzML_dir, trafo_dir, mzML_aligned_dir, workers=workers)
+
+    if ad:
+        step("Determining adducts...")
+        pipeline.run("MetaboliteAdductDecharger", [os.path.join(interim, "FFM_aligned")], [os.path.join(interim, "FeatureMaps_decharged")],
+                     MetaboliteAdductDecharger().run, os.path.join(interim, "FFM_aligned"), os.path.join(interim, "FeatureMaps_decharged"),
+                     {**ad_params, "retention_max_diff": 3.0, "retention_max_diff_local": 3.0})
+        featureXML_dir = os.path.join(interim, "FeatureMaps_decharged")
+    else:
+        featureXML_dir = os.path.join(interim, "FFM_aligned")
+
+    step("Mapping MS2 data to features...")
+    pipeline.run("MapID", [mzML_dir, trafo_dir, featureXML_dir], [os.path.join(interim, "FeatureMaps_ID_mapped")],
+                 map_ids, mzML_dir, featureXML_dir, os.path.join(interim, "FeatureMaps_ID_mapped"), trafo_dir, workers=workers)
+    featureXML_dir = os.path.join(interim, "FeatureMaps_ID_mapped")
+
+    step("Linking features...")
+    pipeline.run("FeatureLinker", [featureXML_dir], [os.path.join(interim, "FeatureMatrix.consensusXML")],
+                 FeatureLinker().run, featureXML_dir, os.path.join(interim, "FeatureMatrix.consensusXML"), params["FeatureLinker"])
+
+    sirius_featureXML_dir = featureXML_dir
+
+    if ffmid:
+        step("Re-quantifying features with missing values...")
+        pipeline.run("Split consensus map", [os.path.join(interim, "FeatureMatrix.consensusXML")],
+                     [os.path.join(interim, "FFM_complete.consensusXML"), os.path.join(interim, "FFM_missing.consensusXML")],
+                     FeatureMapHelper().split_consensus_map, os.path.join(interim, "FeatureMatrix.consensusXML"),
+                                             os.path.join(interim, "FFM_complete.consensusXML"),
+                                             os.path.join(interim, "FFM_missing.consensusXML"))
+
+        pipeline.run("Consensus to feature maps", [os.path.join(interim, "FFM_complete.consensusXML"), featureXML_dir],
+                     [os.path.join(interim, "FFM_complete")],
+                     FeatureMapHelper().consensus_to_feature_maps, os.path.join(interim, "FFM_complete.consensusXML"),
+                                                     featureXML_dir,
+                                                     os.path.join(interim, "FFM_complete"))
+
+        pipeline.run("FeatureFinderMetaboIdent", [mzML_aligned_dir, os.path.join(interim, "FFM_missing.consensusXML")], [os.path.join(interim, "FFMID")],
+                     FeatureFinderMetaboIdent().run, mzML_aligned_dir,
+                                     os.path.join(interim, "FFMID"),
+                                     os.path.join(interim, "FFM_missing.consensusXML"),
+                                     {**ffmid, "extract:rt_window": ffmid["detect:peak_width"]})
+
+        pipeline.run("Merge feature maps", [os.path.join(interim, "FFM_complete"), os.path.join(interim, "FFMID")],
+                     [os.path.join(interim, "FeatureMaps_merged")],
+                     FeatureMapHelper().merge_feature_maps, os.path.join(interim, "FeatureMaps_merged"), os.path.join(
+            interim, "FFM_complete"), os.path.join(interim, "FFMID"))
+
+        if ad:
+            step("Determining adducts...")
+            pipeline.run("MetaboliteAdductDecharger requantified", [os.path.join(interim, "FeatureMaps_merged")],
+                         [os.path.join(interim, "FeatureMaps_merged_decharged")],
+                         MetaboliteAdductDecharger().run, os.path.join(interim, "FeatureMaps_merged"), os.path.join(interim, "FeatureMaps_merged_decharged"),
+                         {**ad_params, "retention_max_diff": 4.0, "retention_max_diff_local": 4.0})
+            featureXML_dir = os.path.join(interim, "FeatureMaps_merged_decharged")
+        else:
+            featureXML_dir = os.path.join(interim, "FeatureMaps_merged")
+
+        step("Mapping MS2 data to re-quantified features...")
+        pipeline.run("MapID requantified", [mzML_dir, trafo_dir, featureXML_dir], [os.path.join(interim, "FeatureMaps_merged_ID_mapped")],
+                     map_ids, mzML_dir, featureXML_dir, os.path.join(interim, "FeatureMaps_merged_ID_mapped"), trafo_dir, workers=workers)
+        featureXML_dir = os.path.join(interim, "FeatureMaps_merged_ID_mapped")
+
+        step("Linking re-quantified features...")
+        pipeline.run("FeatureLinker requantified", [featureXML_dir], [os.path.join(interim, "FeatureMatrixRequantified.consensusXML")],
+                     FeatureLinker().run, featureXML_dir,
+                         os.path.join(interim, "FeatureMatrixRequantified.consensusXML"), params["FeatureLinker"])
+        sirius_featureXML_dir = featureXML_dir
+
+    if gap_filling:
+        # integrates only the missing cells in the original spectra, the linked features stay as they are
+        step("Filling missing values...")
+        pipeline.run("Gap filling", [os.path.join(interim, "FeatureMatrix.consensusXML"), mzML_dir, trafo_dir],
+                     [os.path.join(interim, "FeatureMatrixGapFilled.consensusXML")],
+                     fill_gaps, os.path.join(interim, "FeatureMatrix.consensusXML"), mzML_dir, trafo_dir,
+                         os.path.join(interim, "FeatureMatrixGapFilled.consensusXML"),
+                         gap_filling["mz_window_ppm"], gap_filling["rt_window_sec"], workers=workers)
+
+    if ffmid:
+        requantified = os.path.join(interim, "FeatureMatrixRequantified.consensusXML")
+    elif gap_filling:
+        requantified = os.path.join(interim, "FeatureMatrixGapFilled.consensusXML")
+    else:
+        requantified = ""
+
+    if use_sirius: # export only sirius ms files to use in the GUI tool
+        step("Exporting files for Sirius...")
+        pipeline.run("Sirius export", [mzML_aligned_dir, sirius_featureXML_dir], [os.path.join(results_dir, "SIRIUS")],
+                     Sirius().run, mzML_aligned_dir, sirius_featureXML_dir, os.path.join(results_dir, "SIRIUS"), "", True,
+                     {"-preprocessing:feature_only": "true"})
+        sirius_ms_dir = os.path.join(results_dir, "SIRIUS", "sirius_files")
+    else:
+        sirius_ms_dir = ""
+
+    if use_gnps:
+        step("Exporting files for GNPS...")
+        if requantified:
+            consensusXML_file = requantified
+        else:
+            consensusXML_file = os.path.join(interim, "FeatureMatrix.consensusXML")
+        # MS2 spectra are found by the spectrum index MapID stored with the features, their RT is not used
+        pipeline.run("GNPS export", [consensusXML_file, mzML_dir], [os.path.join(results_dir, "GNPS")],
+                     GNPSExport().run, consensusXML_file, mzML_dir, os.path.join(results_dir, "GNPS"))
+
+    if ms1:
+        ms1_annotation_file, annotation_mz_window_ppm, annoation_rt_window_sec = ms1["file"], ms1["mz_window_ppm"], ms1["rt_window_sec"]
+    else:
+        ms1_annotation_file, annotation_mz_window_ppm, annoation_rt_window_sec = "", 0, 0
+    if ams:
+        ams_maps, ams_adducts, ams_mz_window_ppm = ams["maps"], ams["adducts"], ams["mz_window_ppm"]
+    else:
+        ams_maps, ams_adducts, ams_mz_window_ppm = "", "", 0
+    step("Creating feature tables...")
+    tables = [os.path.join(results_dir, f"FeatureMatrix.{ext}") for ext in ("tsv", "tsv.arrow", "summary.json")]
+    tables.append(os.path.join(results_dir, "MetaData.tsv"))
+    if requantified:
+        tables += [os.path.join(results_dir, f"FeatureMatrixRequantified.{ext}") for ext in ("tsv", "tsv.arrow", "summary.json")]
+    if ms1:
+        tables.append(os.path.join(results_dir, "MS1-annotations.tsv"))
+    pipeline.run("Feature tables", [os.path.join(interim, "FeatureMatrix.consensusXML"), sirius_ms_dir, ms1_annotation_file,
+                                    ams_maps, ams_maps.replace("_maps.tsv", "_structs.tsv"), ams_adducts]
+                 + ([requantified] if requantified else []),
+                 tables,
+                 create_tables, interim, results_dir, requantified, sirius_ms_dir,
+                 ms1_annotation_file, annotation_mz_window_ppm, annoation_rt_window_sec,
+                 ams_maps, ams_adducts, ams_mz_window_ppm)
+    return pipeline.report
@@ -0,0 +1,67 @@
+"""Access to the input mzML files of a workflow without copying them.
+
+Input files are linked into the workspace, a manifest records where each of them came from. Retention time
+alignment is kept as the transformation files only and applied in memory whenever a stage loads the spectra.
+"""
+import json
+import os
+import shutil
+from pyopenms import MSExperiment, MzMLFile, TransformationDescription, TransformationXMLFile, MapAlignmentTransformer
+
+
+def link_file(source, target):
+    """Hard link, symbolic link or, if the file system supports neither, a copy. Returns the method used."""
+    try:
+        os.link(source, target)
+        return "hardlink"
+    except OSError:
+        pass
+    try:
+        os.symlink(os.path.abspath(source), target)
+        return "symlink"
+    except OSError:
+        shutil.copy(source, target)
+        return "copy"
+
+
+def link_files(files, directory):
+    """Makes files available in directory and writes directory/manifest.json."""
+    # imported here, the other functions are used by worker processes that do not need pymetabo
+    from pymetabo.helpers import Helper
+    Helper().reset_directory(directory)
+    manifest = {}
+    for file in files:
+        target = os.path.join(directory, os.path.basename(file))
+        manifest[os.path.basename(file)] = {"source": os.path.abspath(file), "method": link_file(file, target)}
+    with open(os.path.join(directory, "manifest.json"), "w") as f:
+        json.dump(manifest, f, indent=2)
+
+
+def trafo_file(trafo_dir, mzML):
+    """The transformation file of a sample in trafo_dir, None without trafo_dir.
+
+    Raises FileNotFoundError if trafo_dir is given but has no transformation for the sample, its spectra would
+    otherwise silently be used unaligned.
+    """
+    if not trafo_dir:
+        return None
+    path = os.path.join(trafo_dir, os.path.basename(mzML)[:-4]+"trafoXML")
+    if not os.path.isfile(path):
+        raise FileNotFoundError(f"No retention time transformation for {os.path.basename(mzML)} in {trafo_dir}.")
+    return path
+
+
+def load_aligned(mzML, trafo_dir=None):
+    """Loads an mzML file and applies its retention time transformation from trafo_dir if there is one."""
+    exp = MSExperiment()
+    MzMLFile().load(mzML, exp)
+    trafo_path = trafo_file(trafo_dir, mzML)
+    if trafo_path:
+        trafo = TransformationDescription()
+        TransformationXMLFile().load(trafo_path, trafo, True)
+        MapAlignmentTransformer().transformRetentionTimes(exp, trafo, True)
+    return exp
+
+
+def align_file(mzML, trafo_dir, mzML_out_dir):
+    MzMLFile().store(os.path.join(mzML_out_dir, os.path.basename(mzML)), load_aligned(mzML, trafo_dir))